@@ -172,7 +172,7 @@ var t={1:"١",2:"٢",3:"٣",4:"٤",5:"٥",6:"٦",7:"٧",8:"٨",9:"٩",0:"٠"},a=
 //! moment.js locale configuration
 var t={1:"১",2:"২",3:"৩",4:"৪",5:"৫",6:"৬",7:"৭",8:"৮",9:"৯",0:"০"},a={"১":"1","২":"2","৩":"3","৪":"4","৫":"5","৬":"6","৭":"7","৮":"8","৯":"9","০":"0"},n=e.defineLocale("bn",{months:"জানুয়ারি_ফেব্রুয়ারি_মার্চ_এপ্রিল_মে_জুন_জুলাই_আগস্ট_সেপ্টেম্বর_অক্টোবর_নভেম্বর_ডিসেম্বর".split("_"),monthsShort:"জানু_ফেব্রু_মার্চ_এপ্রিল_মে_জুন_জুলাই_আগস্ট_সেপ্ট_অক্টো_নভে_ডিসে".split("_"),weekdays:"রবিবার_সোমবার_মঙ্গলবার_বুধবার_বৃহস্পতিবার_শুক্রবার_শনিবার".split("_"),weekdaysShort:"রবি_সোম_মঙ্গল_বুধ_বৃহস্পতি_শুক্র_শনি".split("_"),weekdaysMin:"রবি_সোম_মঙ্গল_বুধ_বৃহ_শুক্র_শনি".split("_"),longDateFormat:{LT:"A h:mm সময়",LTS:"A h:mm:ss সময়",L:"DD/MM/YYYY",LL:"D MMMM YYYY",LLL:"D MMMM YYYY, A h:mm সময়",LLLL:"dddd, D MMMM YYYY, A h:mm সময়"},calendar:{sameDay:"[আজ] LT",nextDay:"[আগামীকাল] LT",nextWeek:"dddd, LT",lastDay:"[গতকাল] LT",lastWeek:"[গত] dddd, LT",sameElse:"L"},relativeTime:{future:"%s পরে",past:"%s আগে",s:"কয়েক সেকেন্ড",ss:"%d সেকেন্ড",m:"এক মিনিট",mm:"%d মিনিট",h:"এক ঘন্টা",hh:"%d ঘন্টা",d:"এক দিন",dd:"%d দিন",M:"এক মাস",MM:"%d মাস",y:"এক বছর",yy:"%d বছর"},preparse:function(e){return e.replace(/[১২৩৪৫৬৭৮৯০]/g,(function(e){return a[e]}))},postformat:function(e){return e.replace(/\d/g,(function(e){return t[e]}))},meridiemParse:/রাত|সকাল|দুপুর|বিকাল|রাত/,meridiemHour:function(e,t){return 12===e&&(e=0),"রাত"===t&&e>=4||"দুপুর"===t&&e<5||"বিকাল"===t?e+12:e},meridiem:function(e,t,a){return e<4?"রাত":e<10?"সকাল":e<17?"দুপুর":e<20?"বিকাল":"রাত"},week:{dow:0,doy:6}});return n}))},"90ea":function(e,t,a){(function(e,t){t(a("c1df"))})(0,(function(e){"use strict";
 //! moment.js locale configuration
-var t=e.defineLocale("zh-tw",{months:"一月_二月_三月_四月_五月_六月_七月_八月_九月_十月_十一月_十二月".split("_"),monthsShort:"1月_2月_3月_4月_5月_6月_7月_8月_9月_10月_11月_12月".split("_"),weekdays:"星期日_星期一_星期二_星期三_星期四_星期五_星期六".split("_"),weekdaysShort:"週日_週一_週二_週三_週四_週五_週六".split("_"),weekdaysMin:"日_一_二_三_四_五_六".split("_"),longDateFormat:{LT:"HH:mm",LTS:"HH:mm:ss",L:"YYYY/MM/DD",LL:"YYYY年M月D日",LLL:"YYYY年M月D日 HH:mm",LLLL:"YYYY年M月D日dddd HH:mm",l:"YYYY/M/D",ll:"YYYY年M月D日",lll:"YYYY年M月D日 HH:mm",llll:"YYYY年M月D日dddd HH:mm"},meridiemParse:/凌晨|早上|上午|中午|下午|晚上/,meridiemHour:function(e,t){return 12===e&&(e=0),"凌晨"===t||"早上"===t||"上午"===t?e:"中午"===t?e>=11?e:e+12:"下午"===t||"晚上"===t?e+12:void 0},meridiem:function(e,t,a){var n=100*e+t;return n<600?"凌晨":n<900?"早上":n<1130?"上午":n<1230?"中午":n<1800?"下午":"晚上"},calendar:{sameDay:"[今天] LT",nextDay:"[明天] LT",nextWeek:"[下]dddd LT",lastDay:"[昨天] LT",lastWeek:"[上]dddd LT",sameElse:"L"},dayOfMonthOrdinalParse:/\d{1,2}(日|月|週)/,ordinal:function(e,t){switch(t){case"d":case"D":case"DDD":return e+"日";case"M":return e+"月";case"w":case"W":return e+"週";default:return e}},relativeTime:{future:"%s後",past:"%s前",s:"幾秒",ss:"%d 秒",m:"1 分鐘",mm:"%d 分鐘",h:"1 小時",hh:"%d 小時",d:"1 天",dd:"%d 天",M:"1 個月",MM:"%d 個月",y:"1 年",yy:"%d 年"}});return t}))},9257:function(e,t,a){"use strict";a("b0c0");var n=a("7a23"),s={class:"tweet"},r={class:"tweet-owner"},i=["src"],d={class:"tweet-content"},_={class:"tweet-content-header"},o=Object(n["h"])("span",null,"·",-1),u={class:"created-at"},m={class:"tweet-content-body"},l={key:0},c={key:1,class:"tweet-content-edit-tweet"},h={key:2,class:"tweet-content-body-images"},M={class:"tweet-content-body-images-wrapper"},L=["src"],f={key:0,class:"tweet-content-actions"},Y={class:"action-item comment"},y={key:1,class:"tweet-content-edit-actions"},p={class:"tweet-edit-button"};function k(e,t,a,k,D,w){var g,T,v,b,S,H,j,x,O=Object(n["C"])("router-link"),P=Object(n["C"])("base-icon"),W=Object(n["C"])("BaseIcon"),E=Object(n["C"])("EditTweetPopup");return Object(n["u"])(),Object(n["g"])("div",s,[Object(n["h"])("div",r,[Object(n["k"])(O,{to:{name:"Profile",params:{profileId:null===(g=a.tweetData)||void 0===g||null===(T=g.author)||void 0===T?void 0:T.id}}},{default:Object(n["J"])((function(){return[Object(n["h"])("img",{src:D.avatar},null,8,i)]})),_:1},8,["to"])]),Object(n["h"])("div",d,[Object(n["h"])("div",_,[Object(n["h"])("p",null,[Object(n["j"])(Object(n["F"])(null===(v=a.tweetData)||void 0===v||null===(b=v.author)||void 0===b?void 0:b.name)+" ",1),o,Object(n["h"])("span",u,Object(n["F"])(w.fromNow),1)])]),Object(n["h"])("div",m,[D.isTweetEditing?Object(n["f"])("",!0):(Object(n["u"])(),Object(n["g"])("p",l,Object(n["F"])(D.editedTweetData),1)),D.isTweetEditing?(Object(n["u"])(),Object(n["g"])("div",c,[Object(n["K"])(Object(n["h"])("textarea",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return D.editedTweetData=e})},null,512),[[n["H"],D.editedTweetData]])])):Object(n["f"])("",!0),(null===(S=a.tweetData)||void 0===S||null===(H=S.attachments)||void 0===H?void 0:H.length)>0?(Object(n["u"])(),Object(n["g"])("div",h,[Object(n["h"])("div",M,[(Object(n["u"])(!0),Object(n["g"])(n["a"],null,Object(n["A"])(a.tweetData.attachments,(function(a,s){return Object(n["u"])(),Object(n["g"])("div",{key:s,class:"tweet-content-image-item"},[Object(n["h"])("img",{src:a,onClick:t[1]||(t[1]=function(t){return e.$store.dispatch("setLightbox",w.tweetImages)})},null,8,L)])})),128))])])):Object(n["f"])("",!0)]),D.isTweetEditing?Object(n["f"])("",!0):(Object(n["u"])(),Object(n["g"])("div",f,[Object(n["h"])("div",{class:Object(n["q"])(["action-item like",{"like--liked":w.isLikedByUser}]),onClick:t[2]||(t[2]=function(){return w.handleLikeClick&&w.handleLikeClick.apply(w,arguments)})},[Object(n["k"])(P,{icon:"like"}),Object(n["h"])("span",null,Object(n["F"])((null===(j=a.tweetData)||void 0===j||null===(x=j.likes)||void 0===x?void 0:x.length)||0),1)],2),Object(n["h"])("div",Y,[Object(n["k"])(P,{icon:"share"})])])),D.isTweetEditing?(Object(n["u"])(),Object(n["g"])("div",y,[Object(n["h"])("div",{class:"action-item cancel",onClick:t[3]||(t[3]=function(){return w.handleCancelEdit&&w.handleCancelEdit.apply(w,arguments)})}," Cancel "),Object(n["h"])("div",{class:"action-item save",onClick:t[4]||(t[4]=function(){return w.handleEditTweet&&w.handleEditTweet.apply(w,arguments)})}," Save ")])):Object(n["f"])("",!0)]),Object(n["h"])("div",p,[Object(n["h"])("div",{class:"tweet-edit-button-icon",onClick:t[5]||(t[5]=function(e){return D.isEditMenuOpened=!D.isEditMenuOpened})},[Object(n["k"])(W,{icon:"editTweet"})]),D.isEditMenuOpened?(Object(n["u"])(),Object(n["e"])(E,{key:0,"tweet-id":a.tweetData.id,onDeleteTweet:w.handleDelete,onEditTweet:w.handleClickToEdit},null,8,["tweet-id","onDeleteTweet","onEditTweet"])):Object(n["f"])("",!0)])])}var D=a("1da1"),w=a("5530"),g=(a("96cf"),a("4de4"),a("8bac")),T={class:"edit-tweet-popup"},v={class:"icon"},b=Object(n["h"])("span",null,"Удалить",-1);function S(e,t,a,s,r,i){var d=Object(n["C"])("BaseIcon");return Object(n["u"])(),Object(n["g"])("div",T,[Object(n["h"])("div",{class:"edit-tweet-popup-item delete",onClick:t[0]||(t[0]=function(){return i.handleDelete&&i.handleDelete.apply(i,arguments)})},[Object(n["h"])("div",v,[Object(n["k"])(d,{icon:"trash"})]),b])])}var H=a("7424"),j={name:"EditTweetPopup",components:{BaseIcon:g["a"]},props:{tweetId:{type:String,default:""}},methods:{handleDelete:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:return t.prev=0,t.next=3,Object(H["a"])(e.tweetId);case 3:e.$notification({type:"success",message:"Tweet deleted."}),e.$emit("delete-tweet"),t.next=10;break;case 7:t.prev=7,t.t0=t["catch"](0),e.$notification({type:"error",message:"Error when delete tweet"});case 10:case"end":return t.stop()}}),t,null,[[0,7]])})))()},handleEdit:function(){this.$emit("edit-tweet")}}};a("0fa0");j.render=S;var x=j,O=a("c1df"),P=a.n(O),W=a("7f56"),E=a("5502");P.a.locale("ru");var A=new W["AvatarGenerator"],F={name:"Tweet",components:{BaseIcon:g["a"],EditTweetPopup:x},props:{tweetData:{type:Object,default:function(){}}},data:function(){return{isEditMenuOpened:!1,isTweetEditing:!1,editedTweetData:this.tweetData.content,avatar:null}},computed:Object(w["a"])(Object(w["a"])({},Object(E["b"])({me:"getMe"})),{},{tweetImages:function(){return this.tweetData.attachments},fromNow:function(){var e,t=P.a.utc(null===(e=this.tweetData)||void 0===e?void 0:e.stamp).format();return P()(t).fromNow()},isLikedByUser:function(){var e,t,a,n=this;return(null===(e=this.tweetData)||void 0===e||null===(t=e.likes)||void 0===t||null===(a=t.filter((function(e){return(null===e||void 0===e?void 0:e.user_id)===n.me.id})))||void 0===a?void 0:a.length)>0}}),mounted:function(){var e,t;this.avatar=A.generateRandomAvatar(null===(e=this.tweetData)||void 0===e||null===(t=e.author)||void 0===t?void 0:t.id)},methods:{handleDelete:function(){this.$emit("delete-tweet")},handleEditTweet:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){var a;return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:return a={id:e.tweetData.id,content:e.editedTweetData},t.prev=1,t.next=4,Object(H["k"])(a);case 4:e.$notification({type:"success",message:"Tweet is edited succesfully!"}),t.next=10;break;case 7:t.prev=7,t.t0=t["catch"](1),e.$notification({type:"error",message:"Error when editing tweet!"});case 10:e.isTweetEditing=!1;case 11:case"end":return t.stop()}}),t,null,[[1,7]])})))()},handleLikeClick:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:if(e.isLikedByUser){t.next=5;break}return t.next=3,Object(H["g"])(e.tweetData.id);case 3:t.next=7;break;case 5:return t.next=7,Object(H["b"])(e.tweetData.id);case 7:e.$emit("get-tweets");case 8:case"end":return t.stop()}}),t)})))()},handleCancelEdit:function(){this.isTweetEditing=!1},handleClickToEdit:function(){this.isTweetEditing=!0,this.isEditMenuOpened=!1}}};a("bba0");F.render=k;t["a"]=F},"957c":function(e,t,a){(function(e,t){t(a("c1df"))})(0,(function(e){"use strict";
+var t=e.defineLocale("zh-tw",{months:"一月_二月_三月_四月_五月_六月_七月_八月_九月_十月_十一月_十二月".split("_"),monthsShort:"1月_2月_3月_4月_5月_6月_7月_8月_9月_10月_11月_12月".split("_"),weekdays:"星期日_星期一_星期二_星期三_星期四_星期五_星期六".split("_"),weekdaysShort:"週日_週一_週二_週三_週四_週五_週六".split("_"),weekdaysMin:"日_一_二_三_四_五_六".split("_"),longDateFormat:{LT:"HH:mm",LTS:"HH:mm:ss",L:"YYYY/MM/DD",LL:"YYYY年M月D日",LLL:"YYYY年M月D日 HH:mm",LLLL:"YYYY年M月D日dddd HH:mm",l:"YYYY/M/D",ll:"YYYY年M月D日",lll:"YYYY年M月D日 HH:mm",llll:"YYYY年M月D日dddd HH:mm"},meridiemParse:/凌晨|早上|上午|中午|下午|晚上/,meridiemHour:function(e,t){return 12===e&&(e=0),"凌晨"===t||"早上"===t||"上午"===t?e:"中午"===t?e>=11?e:e+12:"下午"===t||"晚上"===t?e+12:void 0},meridiem:function(e,t,a){var n=100*e+t;return n<600?"凌晨":n<900?"早上":n<1130?"上午":n<1230?"中午":n<1800?"下午":"晚上"},calendar:{sameDay:"[今天] LT",nextDay:"[明天] LT",nextWeek:"[下]dddd LT",lastDay:"[昨天] LT",lastWeek:"[上]dddd LT",sameElse:"L"},dayOfMonthOrdinalParse:/\d{1,2}(日|月|週)/,ordinal:function(e,t){switch(t){case"d":case"D":case"DDD":return e+"日";case"M":return e+"月";case"w":case"W":return e+"週";default:return e}},relativeTime:{future:"%s後",past:"%s前",s:"幾秒",ss:"%d 秒",m:"1 分鐘",mm:"%d 分鐘",h:"1 小時",hh:"%d 小時",d:"1 天",dd:"%d 天",M:"1 個月",MM:"%d 個月",y:"1 年",yy:"%d 年"}});return t}))},9257:function(e,t,a){"use strict";a("b0c0");var n=a("7a23"),s={class:"tweet"},r={class:"tweet-owner"},i=["src"],d={class:"tweet-content"},_={class:"tweet-content-header"},o=Object(n["h"])("span",null,"·",-1),u={class:"created-at"},m={class:"tweet-content-body"},l={key:0},c={key:1,class:"tweet-content-edit-tweet"},h={key:2,class:"tweet-content-body-images"},M={class:"tweet-content-body-images-wrapper"},L=["src"],f={key:0,class:"tweet-content-actions"},Y={class:"action-item comment"},y={key:1,class:"tweet-content-edit-actions"},p={class:"tweet-edit-button"};function k(e,t,a,k,D,w){var g,T,v,b,S,H,j,x,O=Object(n["C"])("router-link"),P=Object(n["C"])("base-icon"),W=Object(n["C"])("BaseIcon"),E=Object(n["C"])("EditTweetPopup");return Object(n["u"])(),Object(n["g"])("div",s,[Object(n["h"])("div",r,[Object(n["k"])(O,{to:{name:"Profile",params:{profileId:null===(g=a.tweetData)||void 0===g||null===(T=g.author)||void 0===T?void 0:T.id}}},{default:Object(n["J"])((function(){return[Object(n["h"])("img",{src:D.avatar},null,8,i)]})),_:1},8,["to"])]),Object(n["h"])("div",d,[Object(n["h"])("div",_,[Object(n["h"])("p",null,[Object(n["j"])(Object(n["F"])(null===(v=a.tweetData)||void 0===v||null===(b=v.author)||void 0===b?void 0:b.name)+" ",1),o,Object(n["h"])("span",u,Object(n["F"])(w.fromNow),1)])]),Object(n["h"])("div",m,[D.isTweetEditing?Object(n["f"])("",!0):(Object(n["u"])(),Object(n["g"])("p",l,Object(n["F"])(D.editedTweetData),1)),D.isTweetEditing?(Object(n["u"])(),Object(n["g"])("div",c,[Object(n["K"])(Object(n["h"])("textarea",{"onUpdate:modelValue":t[0]||(t[0]=function(e){return D.editedTweetData=e})},null,512),[[n["H"],D.editedTweetData]])])):Object(n["f"])("",!0),(null===(S=a.tweetData)||void 0===S||null===(H=S.attachments)||void 0===H?void 0:H.length)>0?(Object(n["u"])(),Object(n["g"])("div",h,[Object(n["h"])("div",M,[(Object(n["u"])(!0),Object(n["g"])(n["a"],null,Object(n["A"])(a.tweetData.attachments,(function(a,s){return Object(n["u"])(),Object(n["g"])("div",{key:s,class:"tweet-content-image-item"},[Object(n["h"])("img",{src:a,onClick:t[1]||(t[1]=function(t){return e.$store.dispatch("setLightbox",w.tweetImages)})},null,8,L)])})),128))])])):Object(n["f"])("",!0)]),D.isTweetEditing?Object(n["f"])("",!0):(Object(n["u"])(),Object(n["g"])("div",f,[Object(n["h"])("div",{class:Object(n["q"])(["action-item like",{"like--liked":w.isLikedByUser}]),onClick:t[2]||(t[2]=function(){return w.handleLikeClick&&w.handleLikeClick.apply(w,arguments)})},[Object(n["k"])(P,{icon:"like"}),Object(n["h"])("span",null,Object(n["F"])((null===(j=a.tweetData)||void 0===j?void 0:null!=j.like_count?j.like_count:null===(x=j.likes)||void 0===x?void 0:x.length)||0),1)],2),Object(n["h"])("div",Y,[Object(n["k"])(P,{icon:"share"})])])),D.isTweetEditing?(Object(n["u"])(),Object(n["g"])("div",y,[Object(n["h"])("div",{class:"action-item cancel",onClick:t[3]||(t[3]=function(){return w.handleCancelEdit&&w.handleCancelEdit.apply(w,arguments)})}," Cancel "),Object(n["h"])("div",{class:"action-item save",onClick:t[4]||(t[4]=function(){return w.handleEditTweet&&w.handleEditTweet.apply(w,arguments)})}," Save ")])):Object(n["f"])("",!0)]),Object(n["h"])("div",p,[Object(n["h"])("div",{class:"tweet-edit-button-icon",onClick:t[5]||(t[5]=function(e){return D.isEditMenuOpened=!D.isEditMenuOpened})},[Object(n["k"])(W,{icon:"editTweet"})]),D.isEditMenuOpened?(Object(n["u"])(),Object(n["e"])(E,{key:0,"tweet-id":a.tweetData.id,onDeleteTweet:w.handleDelete,onEditTweet:w.handleClickToEdit},null,8,["tweet-id","onDeleteTweet","onEditTweet"])):Object(n["f"])("",!0)])])}var D=a("1da1"),w=a("5530"),g=(a("96cf"),a("4de4"),a("8bac")),T={class:"edit-tweet-popup"},v={class:"icon"},b=Object(n["h"])("span",null,"Удалить",-1);function S(e,t,a,s,r,i){var d=Object(n["C"])("BaseIcon");return Object(n["u"])(),Object(n["g"])("div",T,[Object(n["h"])("div",{class:"edit-tweet-popup-item delete",onClick:t[0]||(t[0]=function(){return i.handleDelete&&i.handleDelete.apply(i,arguments)})},[Object(n["h"])("div",v,[Object(n["k"])(d,{icon:"trash"})]),b])])}var H=a("7424"),j={name:"EditTweetPopup",components:{BaseIcon:g["a"]},props:{tweetId:{type:String,default:""}},methods:{handleDelete:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:return t.prev=0,t.next=3,Object(H["a"])(e.tweetId);case 3:e.$notification({type:"success",message:"Tweet deleted."}),e.$emit("delete-tweet"),t.next=10;break;case 7:t.prev=7,t.t0=t["catch"](0),e.$notification({type:"error",message:"Error when delete tweet"});case 10:case"end":return t.stop()}}),t,null,[[0,7]])})))()},handleEdit:function(){this.$emit("edit-tweet")}}};a("0fa0");j.render=S;var x=j,O=a("c1df"),P=a.n(O),W=a("7f56"),E=a("5502");P.a.locale("ru");var A=new W["AvatarGenerator"],F={name:"Tweet",components:{BaseIcon:g["a"],EditTweetPopup:x},props:{tweetData:{type:Object,default:function(){}}},data:function(){return{isEditMenuOpened:!1,isTweetEditing:!1,editedTweetData:this.tweetData.content,avatar:null}},computed:Object(w["a"])(Object(w["a"])({},Object(E["b"])({me:"getMe"})),{},{tweetImages:function(){return this.tweetData.attachments},fromNow:function(){var e,t=P.a.utc(null===(e=this.tweetData)||void 0===e?void 0:e.stamp).format();return P()(t).fromNow()},isLikedByUser:function(){var e,t,a,n=this;return(null===(e=this.tweetData)||void 0===e||null===(t=e.likes)||void 0===t||null===(a=t.filter((function(e){return(null===e||void 0===e?void 0:e.user_id)===n.me.id})))||void 0===a?void 0:a.length)>0}}),mounted:function(){var e,t;this.avatar=A.generateRandomAvatar(null===(e=this.tweetData)||void 0===e||null===(t=e.author)||void 0===t?void 0:t.id)},methods:{handleDelete:function(){this.$emit("delete-tweet")},handleEditTweet:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){var a;return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:return a={id:e.tweetData.id,content:e.editedTweetData},t.prev=1,t.next=4,Object(H["k"])(a);case 4:e.$notification({type:"success",message:"Tweet is edited succesfully!"}),t.next=10;break;case 7:t.prev=7,t.t0=t["catch"](1),e.$notification({type:"error",message:"Error when editing tweet!"});case 10:e.isTweetEditing=!1;case 11:case"end":return t.stop()}}),t,null,[[1,7]])})))()},handleLikeClick:function(){var e=this;return Object(D["a"])(regeneratorRuntime.mark((function t(){return regeneratorRuntime.wrap((function(t){while(1)switch(t.prev=t.next){case 0:if(e.isLikedByUser){t.next=5;break}return t.next=3,Object(H["g"])(e.tweetData.id);case 3:t.next=7;break;case 5:return t.next=7,Object(H["b"])(e.tweetData.id);case 7:e.$emit("get-tweets");case 8:case"end":return t.stop()}}),t)})))()},handleCancelEdit:function(){this.isTweetEditing=!1},handleClickToEdit:function(){this.isTweetEditing=!0,this.isEditMenuOpened=!1}}};a("bba0");F.render=k;t["a"]=F},"957c":function(e,t,a){(function(e,t){t(a("c1df"))})(0,(function(e){"use strict";
 //! moment.js locale configuration
 function t(e,t){var a=e.split("_");return t%10===1&&t%100!==11?a[0]:t%10>=2&&t%10<=4&&(t%100<10||t%100>=20)?a[1]:a[2]}function a(e,a,n){var s={ss:a?"секунда_секунды_секунд":"секунду_секунды_секунд",mm:a?"минута_минуты_минут":"минуту_минуты_минут",hh:"час_часа_часов",dd:"день_дня_дней",ww:"неделя_недели_недель",MM:"месяц_месяца_месяцев",yy:"год_года_лет"};return"m"===n?a?"минута":"минуту":e+" "+t(s[n],+e)}var n=[/^янв/i,/^фев/i,/^мар/i,/^апр/i,/^ма[йя]/i,/^июн/i,/^июл/i,/^авг/i,/^сен/i,/^окт/i,/^ноя/i,/^дек/i],s=e.defineLocale("ru",{months:{format:"января_февраля_марта_апреля_мая_июня_июля_августа_сентября_октября_ноября_декабря".split("_"),standalone:"январь_февраль_март_апрель_май_июнь_июль_август_сентябрь_октябрь_ноябрь_декабрь".split("_")},monthsShort:{format:"янв._февр._мар._апр._мая_июня_июля_авг._сент._окт._нояб._дек.".split("_"),standalone:"янв._февр._март_апр._май_июнь_июль_авг._сент._окт._нояб._дек.".split("_")},weekdays:{standalone:"воскресенье_понедельник_вторник_среда_четверг_пятница_суббота".split("_"),format:"воскресенье_понедельник_вторник_среду_четверг_пятницу_субботу".split("_"),isFormat:/\[ ?[Вв] ?(?:прошлую|следующую|эту)? ?] ?dddd/},weekdaysShort:"вс_пн_вт_ср_чт_пт_сб".split("_"),weekdaysMin:"вс_пн_вт_ср_чт_пт_сб".split("_"),monthsParse:n,longMonthsParse:n,shortMonthsParse:n,monthsRegex:/^(январ[ья]|янв\.?|феврал[ья]|февр?\.?|марта?|мар\.?|апрел[ья]|апр\.?|ма[йя]|июн[ья]|июн\.?|июл[ья]|июл\.?|августа?|авг\.?|сентябр[ья]|сент?\.?|октябр[ья]|окт\.?|ноябр[ья]|нояб?\.?|декабр[ья]|дек\.?)/i,monthsShortRegex:/^(январ[ья]|янв\.?|феврал[ья]|февр?\.?|марта?|мар\.?|апрел[ья]|апр\.?|ма[йя]|июн[ья]|июн\.?|июл[ья]|июл\.?|августа?|авг\.?|сентябр[ья]|сент?\.?|октябр[ья]|окт\.?|ноябр[ья]|нояб?\.?|декабр[ья]|дек\.?)/i,monthsStrictRegex:/^(январ[яь]|феврал[яь]|марта?|апрел[яь]|ма[яй]|июн[яь]|июл[яь]|августа?|сентябр[яь]|октябр[яь]|ноябр[яь]|декабр[яь])/i,monthsShortStrictRegex:/^(янв\.|февр?\.|мар[т.]|апр\.|ма[яй]|июн[ья.]|июл[ья.]|авг\.|сент?\.|окт\.|нояб?\.|дек\.)/i,longDateFormat:{LT:"H:mm",LTS:"H:mm:ss",L:"DD.MM.YYYY",LL:"D MMMM YYYY г.",LLL:"D MMMM YYYY г., H:mm",LLLL:"dddd, D MMMM YYYY г., H:mm"},calendar:{sameDay:"[Сегодня, в] LT",nextDay:"[Завтра, в] LT",lastDay:"[Вчера, в] LT",nextWeek:function(e){if(e.week()===this.week())return 2===this.day()?"[Во] dddd, [в] LT":"[В] dddd, [в] LT";switch(this.day()){case 0:return"[В следующее] dddd, [в] LT";case 1:case 2:case 4:return"[В следующий] dddd, [в] LT";case 3:case 5:case 6:return"[В следующую] dddd, [в] LT"}},lastWeek:function(e){if(e.week()===this.week())return 2===this.day()?"[Во] dddd, [в] LT":"[В] dddd, [в] LT";switch(this.day()){case 0:return"[В прошлое] dddd, [в] LT";case 1:case 2:case 4:return"[В прошлый] dddd, [в] LT";case 3:case 5:case 6:return"[В прошлую] dddd, [в] LT"}},sameElse:"L"},relativeTime:{future:"через %s",past:"%s назад",s:"несколько секунд",ss:a,m:a,mm:a,h:"час",hh:a,d:"день",dd:a,w:"неделя",ww:a,M:"месяц",MM:a,y:"год",yy:a},meridiemParse:/ночи|утра|дня|вечера/i,isPM:function(e){return/^(дня|вечера)$/.test(e)},meridiem:function(e,t,a){return e<4?"ночи":e<12?"утра":e<17?"дня":"вечера"},dayOfMonthOrdinalParse:/\d{1,2}-(й|го|я)/,ordinal:function(e,t){switch(t){case"M":case"d":case"DDD":return e+"-й";case"D":return e+"-го";case"w":case"W":return e+"-я";default:return e}},week:{dow:1,doy:4}});return s}))},"958b":function(e,t,a){(function(e,t){t(a("c1df"))})(0,(function(e){"use strict";
 //! moment.js locale configuration
@@ -1,3 +1,3 @@
 import sys
 
-sys.path.append('server/')
+sys.path.append("server/")
@@ -0,0 +1,140 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Annotated, NamedTuple, Optional, Tuple
+
+from database import async_session
+from fastapi import Depends, HTTPException, Security
+from fastapi.security import APIKeyCookie, APIKeyHeader, APIKeyQuery
+from models import ApiKey, User
+from settings import settings
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class Principal(NamedTuple):
+    id: int
+    name: str
+
+
+class PrincipalCache:
+    # Bounded LRU of key hash -> principal with a TTL. The TTL is also how
+    # long a revocation done by another worker process can go unnoticed.
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+
+    def get(self, key_hash: str) -> Optional[Principal]:
+        entry = self._entries.get(key_hash)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at < time.monotonic():
+            del self._entries[key_hash]
+            return None
+        self._entries.move_to_end(key_hash)
+        return principal
+
+    def put(self, key_hash: str, principal: Principal) -> None:
+        self._entries[key_hash] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(key_hash)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key_hash: str) -> None:
+        self._entries.pop(key_hash, None)
+
+
+principal_cache = PrincipalCache(settings.auth_cache_size, settings.auth_cache_ttl)
+
+api_key_header = APIKeyHeader(name="api-key", auto_error=False)
+# For EventSource, which cannot send headers; see get_stream_user.
+api_key_query = APIKeyQuery(name="api_key", auto_error=False)
+api_key_cookie = APIKeyCookie(name="api_key", auto_error=False)
+
+
+def hash_key(api_key: str) -> str:
+    # Keys are random tokens, a fast unsalted hash is enough to keep them
+    # out of the database.
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def _load_principal(key_hash: str) -> Optional[Principal]:
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.id, User.name)
+            .join(ApiKey, ApiKey.user_id == User.id)
+            .where(ApiKey.key_hash == key_hash, ApiKey.revoked_at.is_(None))
+        )
+        row = result.first()
+    return Principal(row.id, row.name) if row is not None else None
+
+
+async def authenticate(api_key: str) -> Principal:
+    key_hash = hash_key(api_key)
+    principal = principal_cache.get(key_hash)
+    if principal is None:
+        principal = await _load_principal(key_hash)
+        if principal is None:
+            raise HTTPException(status_code=401, detail="Invalid api-key")
+        principal_cache.put(key_hash, principal)
+    return principal
+
+
+async def get_current_user(
+    api_key: Annotated[Optional[str], Security(api_key_header)],
+) -> Principal:
+    if not api_key:
+        raise HTTPException(status_code=401, detail="Missing api-key header")
+    return await authenticate(api_key)
+
+
+async def get_stream_user(
+    header: Annotated[Optional[str], Security(api_key_header)],
+    query: Annotated[Optional[str], Security(api_key_query)],
+    cookie: Annotated[Optional[str], Security(api_key_cookie)],
+) -> Principal:
+    # The browser's EventSource sends no custom headers, so the stream also
+    # takes the key from the api_key cookie or query parameter. A query
+    # parameter ends up in access logs; the cookie does not.
+    api_key = header or cookie or query
+    if not api_key:
+        raise HTTPException(
+            status_code=401, detail="Missing api-key header, api_key cookie or query"
+        )
+    return await authenticate(api_key)
+
+
+CurrentUser = Annotated[Principal, Depends(get_current_user)]
+StreamUser = Annotated[Principal, Depends(get_stream_user)]
+
+
+async def issue_api_key(
+    session: AsyncSession, user_id: int, api_key: Optional[str] = None
+) -> Tuple[int, str]:
+    api_key = api_key or secrets.token_urlsafe(32)
+    result = await session.execute(
+        insert(ApiKey)
+        .values(user_id=user_id, key_hash=hash_key(api_key))
+        .returning(ApiKey.id)
+    )
+    return result.scalar_one(), api_key
+
+
+async def revoke_api_key(
+    session: AsyncSession, key_id: int, user_id: Optional[int] = None
+) -> bool:
+    query = update(ApiKey).where(ApiKey.id == key_id, ApiKey.revoked_at.is_(None))
+    if user_id is not None:
+        query = query.where(ApiKey.user_id == user_id)
+    result = await session.execute(
+        query.values(revoked_at=func.now()).returning(ApiKey.key_hash)
+    )
+    key_hash = result.scalar()
+    if key_hash is None:
+        return False
+    principal_cache.invalidate(key_hash)
+    return True
@@ -0,0 +1,43 @@
+from errors import error_response, status_error_type
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TOO_LARGE = "Request body is too large"
+
+
+class BodySizeLimitMiddleware:
+    # Rejects oversized bodies with 413 as early as possible: up front when
+    # Content-Length is declared, otherwise as soon as the streamed body
+    # crosses the limit, so the rest of it is never read.
+
+    def __init__(self, app: ASGIApp, max_size: int) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self.max_size:
+                response = error_response(413, status_error_type(413), TOO_LARGE)
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # Re-raised by FastAPI's body parsing and rendered by its
+                    # exception middleware.
+                    raise HTTPException(status_code=413, detail=TOO_LARGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
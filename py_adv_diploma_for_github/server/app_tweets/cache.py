@@ -0,0 +1,210 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+from settings import settings
+
+try:
+    from redis import asyncio as redis
+    from redis.exceptions import RedisError
+except ImportError:  # the shared tier is optional
+    redis = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+
+class TimelineCache:
+    # Rendered timeline pages keyed by the reader's version counter. Writes
+    # bump the counters of the readers they affect, so a cached page is
+    # never served after a change and nothing depends on expiry.
+    #
+    # Two tiers: a bounded in-process LRU and, with REDIS_URL, a shared
+    # Redis tier that also holds the counters. Without Redis the counters are
+    # per process, which is only exact with a single worker, and kept for
+    # the maxsize readers seen last: a dropped counter restarts at the
+    # current time, above any value it had, so it only costs misses.
+
+    def __init__(
+        self,
+        maxsize: int,
+        redis_url: Optional[str],
+        shared_ttl: int,
+        bump_window: float = 0.0,
+    ):
+        self.maxsize = maxsize
+        self.shared_ttl = shared_ttl
+        self.bump_window = bump_window
+        self.stats: Counter = Counter()
+        self._local: "OrderedDict[str, bytes]" = OrderedDict()
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        # Readers bumped within bump_window, by monotonic time of the bump,
+        # oldest first. Past maxsize the oldest are forgotten and every
+        # reader counts as bumped until the window of the last one closes.
+        self._bumped: "OrderedDict[int, float]" = OrderedDict()
+        self._bumps_forgotten_at = float("-inf")
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                raise RuntimeError("REDIS_URL is set but the redis package is missing")
+            self._redis = redis.from_url(redis_url)
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 or self._redis is not None
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f"timeline:version:{user_id}"
+
+    @staticmethod
+    def _bumped_key(user_id: int) -> str:
+        return f"timeline:bumped:{user_id}"
+
+    async def version(self, user_id: int) -> Optional[int]:
+        # Counters start at the current time, so a counter that was lost
+        # (Redis restart) can never come back to a value already used.
+        if self._redis is None:
+            version = self._versions.setdefault(user_id, time.time_ns())
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.maxsize:
+                self._versions.popitem(last=False)
+            return version
+        key = self._version_key(user_id)
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.set(key, time.time_ns(), nx=True)
+                pipe.get(key)
+                _, value = await pipe.execute()
+        except RedisError:
+            logger.exception("Reading the timeline version failed")
+            return None
+        return int(value)
+
+    async def bump(self, user_ids: Iterable[int]) -> None:
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        self.stats["invalidations"] += len(user_ids)
+        if self._redis is None:
+            # Readers without a counter get a new one, and so a new
+            # version, on their next read.
+            for user_id in user_ids:
+                if user_id in self._versions:
+                    self._versions[user_id] += 1
+            self._mark_bumped(user_ids)
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    key = self._version_key(user_id)
+                    pipe.set(key, time.time_ns(), nx=True)
+                    pipe.incr(key)
+                    if self.bump_window > 0:
+                        pipe.set(
+                            self._bumped_key(user_id),
+                            1,
+                            px=max(int(self.bump_window * 1000), 1),
+                        )
+                await pipe.execute()
+        except RedisError:
+            # Entries of the missed users stay readable for at most
+            # shared_ttl in Redis, but forever in the local tier.
+            logger.exception("Bumping timeline versions failed")
+            self._local.clear()
+
+    def _mark_bumped(self, user_ids: Iterable[int]) -> None:
+        if self.bump_window <= 0:
+            return
+        now = time.monotonic()
+        for user_id in user_ids:
+            self._bumped[user_id] = now
+            self._bumped.move_to_end(user_id)
+        while self._bumped:
+            _, bumped_at = next(iter(self._bumped.items()))
+            if now - bumped_at > self.bump_window:
+                self._bumped.popitem(last=False)
+            elif len(self._bumped) > self.maxsize:
+                self._bumped.popitem(last=False)
+                self._bumps_forgotten_at = bumped_at
+            else:
+                break
+
+    async def needs_primary(self, user_id: int) -> bool:
+        # Whether the reader's next page has to be built on the primary: it
+        # is cached under the current version, and a write bumped that
+        # version within bump_window, so a lagging replica could leave the
+        # write out of a page that stays cached until the next bump.
+        if not self.enabled or self.bump_window <= 0:
+            return False
+        if self._redis is None:
+            bumped_at = max(
+                self._bumped.get(user_id, self._bumps_forgotten_at),
+                self._bumps_forgotten_at,
+            )
+            return time.monotonic() - bumped_at <= self.bump_window
+        try:
+            return bool(await self._redis.exists(self._bumped_key(user_id)))
+        except RedisError:
+            logger.exception("Reading the timeline bump failed")
+            return True
+
+    async def get(self, key: str) -> Optional[Any]:
+        # bytes, from either tier (the Redis client does not decode).
+        raw: Any = self._local.get(key)
+        if raw is not None:
+            self._local.move_to_end(key)
+            self.stats["local_hits"] += 1
+            return orjson.loads(raw)
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(key)
+            except RedisError:
+                logger.exception("Reading the shared timeline cache failed")
+            if raw is not None:
+                self.stats["shared_hits"] += 1
+                self._store_local(key, raw)
+                return orjson.loads(raw)
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        raw = orjson.dumps(value)
+        self._store_local(key, raw)
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, raw, ex=self.shared_ttl)
+            except RedisError:
+                logger.exception("Writing the shared timeline cache failed")
+
+    def _store_local(self, key: str, raw: bytes) -> None:
+        self._local[key] = raw
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["local_hits"] + self.stats["shared_hits"]
+        lookups += self.stats["misses"]
+        hits = self.stats["local_hits"] + self.stats["shared_hits"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else None,
+            "local_entries": len(self._local),
+            "local_versions": len(self._versions),
+            "shared": self._redis is not None,
+        }
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+
+
+timeline_cache = TimelineCache(
+    settings.timeline_cache_size,
+    settings.redis_url,
+    settings.timeline_cache_ttl,
+    # How long a replica may lag before it is ejected (replicas.stick_seconds).
+    bump_window=settings.replica_max_lag + settings.replica_check_interval,
+)
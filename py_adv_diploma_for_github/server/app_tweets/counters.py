@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database import async_session
+from models import HashtagCount, Tweet
+from push import hub
+from settings import settings
+from sqlalchemy import Integer, column, delete, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from tags import TagUse
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5
+MAX_PENDING = 1000
+
+
+class DeltaBuffer(ABC):
+    # Write-behind buffer of counter deltas. Writers only touch an in-process
+    # dict; a background task hands the accumulated deltas to _apply once
+    # per flush, so a burst on one key costs a single row update per interval
+    # instead of one per event.
+
+    name = "counter"
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+    ) -> None:
+        self._session_factory = session_factory
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._pending: Dict[Any, int] = defaultdict(int)
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, key: Any, delta: int) -> None:
+        self._pending[key] += delta
+        if len(self._pending) >= self._max_pending:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("%s flush failed", self.name)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            # Sorted keys keep the row lock order stable between workers.
+            deltas = sorted((key, delta) for key, delta in pending.items() if delta)
+            try:
+                await self._apply(deltas)
+            except Exception:
+                for key, delta in deltas:
+                    self._pending[key] += delta
+                raise
+
+    @abstractmethod
+    async def _apply(self, deltas: List[Tuple[Any, int]]) -> None:
+        # Writes the non-zero deltas, sorted by key, in one transaction.
+        ...
+
+
+class LikeCounter(DeltaBuffer):
+    # tweets.like_count, keyed by tweet id.
+
+    name = "Like counter"
+
+    async def _apply(self, deltas: List[Tuple[int, int]]) -> None:
+        if not deltas:
+            return
+        rows = values(
+            column("tweet_id", Integer), column("delta", Integer), name="deltas"
+        ).data(deltas)
+        async with self._session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    update(Tweet)
+                    .where(Tweet.id == rows.c.tweet_id)
+                    .values(like_count=Tweet.like_count + rows.c.delta)
+                    .returning(Tweet.id, Tweet.like_count)
+                    .execution_options(synchronize_session=False)
+                )
+                counts = dict(result.tuples().all())
+        # Streams get the new totals, one event per tweet and flush.
+        hub.publish_likes(counts)
+
+
+class TrendCounter(DeltaBuffer):
+    # hashtag_counts, keyed by (bucket, tag). A use is counted in the bucket
+    # of its created_at and taken back from the same bucket when the tag is
+    # edited out or the tweet deleted, so the counts of a window never have
+    # to be recomputed from tweet_hashtags. Buckets that fell out of the
+    # window are dropped as the window moves on.
+
+    name = "Trend counter"
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        bucket_seconds: int,
+        window_seconds: int,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+    ) -> None:
+        super().__init__(session_factory, flush_interval, max_pending)
+        self.bucket = timedelta(seconds=bucket_seconds)
+        self.window = timedelta(seconds=window_seconds)
+        self._pruned: Optional[datetime] = None
+
+    def bucket_of(self, moment: datetime) -> datetime:
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return moment - (moment - epoch) % self.bucket
+
+    def window_start(self, now: Optional[datetime] = None) -> datetime:
+        # The current, partial bucket and the full ones before it.
+        current = self.bucket_of(now or datetime.now(timezone.utc))
+        return current - self.window + self.bucket
+
+    def record(
+        self, added: Iterable[TagUse] = (), removed: Iterable[TagUse] = ()
+    ) -> None:
+        start = self.window_start()
+        for uses, delta in ((added, 1), (removed, -1)):
+            for tag, created_at in uses:
+                bucket = self.bucket_of(created_at)
+                if bucket >= start:
+                    self.add((bucket, tag), delta)
+
+    async def _apply(self, deltas: List[Tuple[Tuple[datetime, str], int]]) -> None:
+        start = self.window_start()
+        prune = self._pruned != start
+        deltas = [(key, delta) for key, delta in deltas if key[0] >= start]
+        if not deltas and not prune:
+            return
+        async with self._session_factory() as session:
+            async with session.begin():
+                if deltas:
+                    stmt = insert(HashtagCount).values(
+                        [
+                            {"bucket": bucket, "tag": tag, "uses": delta}
+                            for (bucket, tag), delta in deltas
+                        ]
+                    )
+                    await session.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=[HashtagCount.bucket, HashtagCount.tag],
+                            set_={"uses": HashtagCount.uses + stmt.excluded.uses},
+                        )
+                    )
+                if prune:
+                    await session.execute(
+                        delete(HashtagCount).where(HashtagCount.bucket < start)
+                    )
+        self._pruned = start
+
+
+like_counter = LikeCounter(async_session)
+trend_counter = TrendCounter(
+    async_session,
+    bucket_seconds=settings.trends_bucket_seconds,
+    window_seconds=settings.trends_window_seconds,
+)
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Literal, Optional, Set
+
+from database import async_session
+from imaging import render_variant
+from models import MediaVariant
+from PIL import Image, UnidentifiedImageError
+from settings import settings
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+VariantName = Literal["thumb", "feed"]
+
+# Variant name -> target width in pixels; smaller images are only re-encoded.
+VARIANTS: Dict[str, int] = {"thumb": 320, "feed": 1080}
+
+CONTENT_TYPES = {"WEBP": "image/webp", "AVIF": "image/avif"}
+
+# Originals that could not be decoded are not retried on every request.
+MAX_FAILED = 10_000
+
+
+class DerivativeGenerator:
+    # Renders the variants of an upload after it is stored. Decoding and
+    # encoding run in a process pool, the event loop only moves bytes.
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        workers: int,
+        image_format: str,
+    ) -> None:
+        self._session_factory = session_factory
+        self._workers = workers
+        self._image_format = image_format
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._in_flight: Set[str] = set()
+        self._failed: Set[str] = set()
+
+    def start(self) -> None:
+        if self._pool is None:
+            # spawn: forking a process that runs an event loop and threads
+            # is unsafe, and workers only need imaging.py.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    async def stop(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def schedule(self, content_hash: str, storage_path: str) -> None:
+        if self._pool is None:
+            return
+        if content_hash in self._in_flight or content_hash in self._failed:
+            return
+        self._in_flight.add(content_hash)
+        # A fresh context: the render outlives the request that scheduled it
+        # and its queries are not part of that request's accounting.
+        task = asyncio.create_task(
+            self._generate(content_hash, storage_path), context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, content_hash: str, storage_path: str) -> None:
+        try:
+            await self._render_missing(content_hash, storage_path)
+        except (UnidentifiedImageError, Image.DecompressionBombError) as exc:
+            logger.info("No variants for %s: %s", content_hash, exc)
+            if len(self._failed) >= MAX_FAILED:
+                self._failed.clear()
+            self._failed.add(content_hash)
+        except Exception:
+            logger.exception("Rendering variants of %s failed", content_hash)
+        finally:
+            self._in_flight.discard(content_hash)
+
+    async def _render_missing(self, content_hash: str, storage_path: str) -> None:
+        async with self._session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(MediaVariant.variant).where(
+                        MediaVariant.content_hash == content_hash
+                    )
+                )
+                existing = set(result.scalars())
+        missing = [name for name in VARIANTS if name not in existing]
+        if not missing:
+            return
+
+        storage = get_storage()
+        data = await storage.read(storage_path)
+        loop = asyncio.get_running_loop()
+        for name in missing:
+            rendered = await loop.run_in_executor(
+                self._pool, render_variant, data, VARIANTS[name], self._image_format
+            )
+            blob = await storage.save(rendered)
+            async with self._session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        insert(MediaVariant)
+                        .values(
+                            content_hash=content_hash,
+                            variant=name,
+                            variant_hash=blob.content_hash,
+                            size=blob.size,
+                            content_type=CONTENT_TYPES[self._image_format],
+                            storage_path=blob.path,
+                        )
+                        .on_conflict_do_nothing()
+                    )
+
+
+derivatives = DerivativeGenerator(
+    async_session,
+    workers=settings.media_variant_workers,
+    image_format=settings.media_variant_format,
+)
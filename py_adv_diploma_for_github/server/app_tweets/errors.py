@@ -0,0 +1,87 @@
+from http import HTTPStatus
+from typing import Mapping, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import Response
+
+
+class ApiError(Exception):
+    # Expected failures (missing rows, bad cursors), rendered as
+    # schemas.ErrorOut with their own status code.
+
+    def __init__(self, status_code: int, error_type: str, error_message: str) -> None:
+        super().__init__(error_message)
+        self.status_code = status_code
+        self.error_type = error_type
+        self.error_message = error_message
+
+
+def error_response(
+    status_code: int,
+    error_type: str,
+    error_message: str,
+    headers: Optional[Mapping[str, str]] = None,
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=status_code,
+        content={
+            "result": False,
+            "error_type": error_type,
+            "error_message": error_message,
+        },
+        headers=headers,
+    )
+
+
+def status_error_type(status_code: int) -> str:
+    # 404 -> "NotFound", the same names ApiError uses.
+    try:
+        return HTTPStatus(status_code).phrase.title().replace(" ", "")
+    except ValueError:
+        return "HTTPError"
+
+
+async def api_error_handler(request: Request, exc: Exception) -> ORJSONResponse:
+    assert isinstance(exc, ApiError)
+    return error_response(exc.status_code, exc.error_type, exc.error_message)
+
+
+async def http_error_handler(request: Request, exc: Exception) -> Response:
+    # Raised by FastAPI and the middlewares: 401 from auth, 404 and 405 from
+    # routing, 413 from body_limit.
+    assert isinstance(exc, StarletteHTTPException)
+    if exc.status_code in (204, 304):
+        return Response(status_code=exc.status_code, headers=exc.headers)
+    return error_response(
+        exc.status_code,
+        status_error_type(exc.status_code),
+        str(exc.detail),
+        headers=exc.headers,
+    )
+
+
+async def validation_error_handler(request: Request, exc: Exception) -> ORJSONResponse:
+    assert isinstance(exc, RequestValidationError)
+    message = "; ".join(
+        ".".join(str(part) for part in error["loc"]) + ": " + error["msg"]
+        for error in exc.errors()
+    )
+    return error_response(422, "ValidationError", message)
+
+
+async def unhandled_error_handler(request: Request, exc: Exception) -> ORJSONResponse:
+    # Runs in Starlette's outermost middleware, which re-raises the exception
+    # once the response is sent, so the server still logs the traceback; the
+    # client gets a generic message, exception text can carry SQL or paths.
+    # Responses rejected by their response model end up here too.
+    return error_response(500, "InternalServerError", "Internal server error")
+
+
+def install(app: FastAPI) -> None:
+    app.add_exception_handler(ApiError, api_error_handler)
+    app.add_exception_handler(StarletteHTTPException, http_error_handler)
+    app.add_exception_handler(RequestValidationError, validation_error_handler)
+    app.add_exception_handler(Exception, unhandled_error_handler)
@@ -0,0 +1,52 @@
+import io
+from typing import BinaryIO, Optional
+
+from PIL import ExifTags, Image, ImageOps
+
+# Kept free of application imports: it is loaded by every worker process of
+# the derivatives pool.
+
+# Uploads accepted, by Pillow format name. Raster only: an SVG or an HTML
+# page served from the application's origin could run scripts there.
+UPLOAD_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+def detect_image_type(file: BinaryIO) -> Optional[str]:
+    # From the bytes: the name and the Content-Type come from the client.
+    # The file is left at its start to be stored afterwards.
+    try:
+        with Image.open(file, formats=tuple(UPLOAD_TYPES)) as image:
+            image_format = image.format
+            image.verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+    return UPLOAD_TYPES.get(image_format or "")
+
+
+def render_variant(data: bytes, width: int, image_format: str) -> bytes:
+    with Image.open(io.BytesIO(data)) as original:
+        # Orientations 5 to 8 swap the axes: the width asked for is the
+        # stored height.
+        turned = original.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8)
+        shown_width, shown_height = original.size[::-1] if turned else original.size
+        if shown_width > width:
+            # JPEG can decode at 1/2, 1/4 or 1/8 scale, far cheaper than
+            # decoding everything and throwing most of it away.
+            height = max(1, shown_height * width // shown_width)
+            original.draft("RGB", (height, width) if turned else (width, height))
+        image = ImageOps.exif_transpose(original)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        out = io.BytesIO()
+        image.save(out, format=image_format, quality=80)
+        return out.getvalue()
@@ -1,4 +1,89 @@
+import argparse
+import logging
+import os
+from typing import Tuple
+
 import uvicorn
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Connections a worker holds outside its pool: the push hub's LISTEN.
+UNPOOLED_CONNECTIONS = 1
+
+
+def pool_limits(workers: int) -> Tuple[int, int]:
+    # DB_POOL_SIZE and DB_MAX_OVERFLOW stay the per-worker upper bound.
+    per_worker = settings.db_max_connections // workers - UNPOOLED_CONNECTIONS
+    if per_worker < 1:
+        raise ValueError(
+            f"DB_MAX_CONNECTIONS={settings.db_max_connections} cannot serve"
+            f" {workers} workers, each needs {UNPOOLED_CONNECTIONS + 1}"
+        )
+    pool_size = min(settings.db_pool_size, per_worker)
+    max_overflow = min(settings.db_max_overflow, per_worker - pool_size)
+    return pool_size, max_overflow
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the tweets API server.")
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="development mode: a single process restarted on code changes",
+    )
+    parser.add_argument("--workers", type=int, default=settings.server_workers)
+    args = parser.parse_args()
+
+    if args.reload:
+        uvicorn.run(
+            "routers:app",
+            host=settings.server_host,
+            port=settings.server_port,
+            reload=True,
+        )
+        return
+
+    workers = args.workers or os.cpu_count() or 1
+    try:
+        pool_size, max_overflow = pool_limits(workers)
+    except ValueError as exc:
+        parser.error(str(exc))
+    # Workers are spawned and build their settings from the environment; a
+    # single worker runs in this process and uses the settings object.
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+    settings.db_pool_size = pool_size
+    settings.db_max_overflow = max_overflow
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        # Files of a previous run would be summed into the new one.
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for name in os.listdir(multiproc_dir):
+            os.unlink(os.path.join(multiproc_dir, name))
+    if workers > 1 and not settings.redis_url:
+        # Per-process version counters would let other workers serve pages
+        # the change invalidated.
+        logger.warning("%d workers without REDIS_URL: timeline cache off", workers)
+        os.environ["TIMELINE_CACHE_SIZE"] = "0"
+
+    # On SIGTERM every worker ends its event streams with "evicted", stops
+    # accepting connections, waits up to server_graceful_timeout for
+    # in-flight requests, then runs the lifespan shutdown (flushes like
+    # counters, disposes the engine).
+    uvicorn.run(
+        "routers:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keep_alive,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+    )
+
 
 if __name__ == "__main__":
-    uvicorn.run("routers:app", port=5000, host="0.0.0.0", reload=True)
+    main()
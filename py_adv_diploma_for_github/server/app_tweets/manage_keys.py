@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+from typing import Optional
+
+from auth import issue_api_key, revoke_api_key
+from database import async_session, engine
+from models import ApiKey, User
+from sqlalchemy import select
+
+
+async def _user_id(session, name: str) -> Optional[int]:
+    result = await session.execute(select(User.id).where(User.name == name).limit(1))
+    return result.scalar()
+
+
+async def issue(name: str, api_key: Optional[str]) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            user_id = await _user_id(session, name)
+            if user_id is None:
+                raise SystemExit(f"User {name} not found")
+            key_id, api_key = await issue_api_key(session, user_id, api_key)
+    print(f"key {key_id} for {name}: {api_key}")
+
+
+async def revoke(key_id: int) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            revoked = await revoke_api_key(session, key_id)
+    print(f"key {key_id} revoked" if revoked else f"key {key_id} not found")
+
+
+async def list_keys(name: str) -> None:
+    async with async_session() as session:
+        result = await session.execute(
+            select(ApiKey.id, ApiKey.created_at, ApiKey.revoked_at)
+            .join(User, User.id == ApiKey.user_id)
+            .where(User.name == name)
+            .order_by(ApiKey.id)
+        )
+        for key_id, created_at, revoked_at in result:
+            state = f"revoked {revoked_at:%Y-%m-%d %H:%M}" if revoked_at else "active"
+            print(f"{key_id}\t{created_at:%Y-%m-%d %H:%M}\t{state}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage api keys of users.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    issue_cmd = commands.add_parser("issue", help="create a key for a user")
+    issue_cmd.add_argument("name")
+    issue_cmd.add_argument(
+        "--key", help="use this key instead of a random one (local setups only)"
+    )
+    revoke_cmd = commands.add_parser("revoke", help="revoke a key by its id")
+    revoke_cmd.add_argument("key_id", type=int)
+    list_cmd = commands.add_parser("list", help="list the keys of a user")
+    list_cmd.add_argument("name")
+    args = parser.parse_args()
+    try:
+        if args.command == "issue":
+            await issue(args.name, args.key)
+        elif args.command == "revoke":
+            await revoke(args.key_id)
+        else:
+            await list_keys(args.name)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from derivatives import CONTENT_TYPES as VARIANT_TYPES
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from imaging import UPLOAD_TYPES
+from metrics import MEDIA_BYTES
+from settings import settings
+from storage import DEFAULT_MEDIA_TYPE, get_storage
+
+# Blobs are content-addressed and never rewritten, so a URL's bytes never
+# change and can be cached for as long as caches allow. The original served
+# in place of a missing variant must be revalidated, the variant will come.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+CACHE_CONTROL_FALLBACK = "public, no-cache"
+
+# What uploads and their variants can be. Anything else recorded for a row
+# (files stored before uploads were checked) is only offered as a download,
+# never rendered by the browser on the application's origin.
+SERVED_TYPES = frozenset({*UPLOAD_TYPES.values(), *VARIANT_TYPES.values()})
+DOWNLOAD_MEDIA_TYPE = "application/octet-stream"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def type_headers(content_type: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    media_type = content_type or DEFAULT_MEDIA_TYPE
+    headers = {"X-Content-Type-Options": "nosniff"}
+    if media_type not in SERVED_TYPES:
+        media_type = DOWNLOAD_MEDIA_TYPE
+        headers["Content-Disposition"] = "attachment"
+    return media_type, headers
+
+
+def cache_headers(
+    content_hash: str, created_at: Optional[datetime], immutable: bool = True
+) -> Dict[str, str]:
+    headers = {
+        "ETag": f'"{content_hash}"',
+        "Cache-Control": CACHE_CONTROL if immutable else CACHE_CONTROL_FALLBACK,
+        "Accept-Ranges": "bytes",
+    }
+    if created_at is not None:
+        headers["Last-Modified"] = format_datetime(created_at, usegmt=True)
+    return headers
+
+
+def is_not_modified(
+    request: Request, etag: str, created_at: Optional[datetime]
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as required for If-None-Match.
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or created_at is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return created_at.replace(microsecond=0) <= since
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # Single "bytes=" ranges only; anything else is answered with the whole
+    # body, which a server is always allowed to do.
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+async def media_response(request: Request, media) -> Response:
+    media_type, headers = type_headers(media.content_type)
+    if media.storage_path is None:
+        # Rows written before the blob storage, until migrate_media.py runs.
+        return Response(content=media.file_body, headers=headers, media_type=media_type)
+
+    headers.update(
+        cache_headers(
+            media.content_hash, media.created_at, immutable=not media.fallback
+        )
+    )
+    if is_not_modified(request, headers["ETag"], media.created_at):
+        return Response(status_code=304, headers=headers)
+
+    storage = get_storage()
+    path = storage.local_path(media.storage_path)
+    if path is not None:
+        if settings.media_accel_redirect:
+            # nginx serves the file itself (sendfile, ranges) from an
+            # internal location mapped onto the media directory.
+            headers["X-Accel-Redirect"] = (
+                settings.media_accel_redirect.rstrip("/") + "/" + media.storage_path
+            )
+            # What nginx will send, a range request sends less.
+            MEDIA_BYTES.labels("nginx").inc(media.size)
+            return Response(headers=headers, media_type=media_type)
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    http_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if http_range is not None and if_range in (None, headers["ETag"]):
+        try:
+            byte_range = parse_range(http_range, media.size)
+        except RangeNotSatisfiable:
+            headers = {
+                "Content-Range": f"bytes */{media.size}",
+                "X-Content-Type-Options": "nosniff",
+            }
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{media.size}"
+            return Response(
+                content=await storage.read(media.storage_path, start, end),
+                status_code=206,
+                headers=headers,
+                media_type=media_type,
+            )
+    return Response(
+        content=await storage.read(media.storage_path),
+        headers=headers,
+        media_type=media_type,
+    )
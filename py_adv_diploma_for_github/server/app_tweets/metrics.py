@@ -0,0 +1,185 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional, Tuple
+
+from database import engine, pool_stats
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from replicas import replicas
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# With several workers set PROMETHEUS_MULTIPROC_DIR (main.py empties it on
+# start): request and SQL metrics are then summed over all workers, while
+# pool metrics describe the worker that answered the scrape.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+MEDIA_ROUTE = "/api/medias/{media_id}"
+# Requests that matched no route share one label, so scanners cannot blow up
+# the number of series.
+UNMATCHED = "<unmatched>"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request.",
+    ["method", "route", "status"],
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled.",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+REQUEST_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "SQL statements executed by a request.",
+    ["route"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 25, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time a request spent executing SQL.",
+    ["route"],
+)
+MEDIA_BYTES = Counter(
+    "media_bytes_served",
+    "Media bytes sent by the app, or handed to nginx by X-Accel-Redirect.",
+    ["via"],
+)
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+# SQLAlchemy runs statements in greenlets that share the caller's context,
+# so the cursor events find the request that issued them.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, many: Any
+) -> None:
+    if context is not None and current_request.get() is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, many: Any
+) -> None:
+    stats = current_request.get()
+    started = getattr(context, "metrics_started", None)
+    if stats is not None and started is not None:
+        stats.statements += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def instrument(target: AsyncEngine) -> None:
+    event.listen(target.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class PoolCollector:
+    # Read from the pools at scrape time; nothing is done per checkout.
+    GAUGES = ("size", "checked_in", "checked_out", "overflow")
+    COUNTERS = ("checkouts", "connects", "waits", "wait_seconds", "timeouts")
+
+    def collect(self) -> Iterator[Metric]:
+        targets = [("primary", engine)]
+        targets += [(replicas.name(replica), replica) for replica in replicas.replicas]
+        families: list[Any] = [
+            GaugeMetricFamily(f"db_pool_{name}", f"Pool {name}.", labels=["database"])
+            for name in self.GAUGES
+        ]
+        families += [
+            CounterMetricFamily(
+                f"db_pool_{name}", f"Pool {name} so far.", labels=["database"]
+            )
+            for name in self.COUNTERS
+        ]
+        for label, target in targets:
+            stats = pool_stats(target)
+            if "checked_out" not in stats:
+                continue
+            for family, name in zip(families, self.GAUGES + self.COUNTERS):
+                family.add_metric([label], stats[name])
+        yield from families
+
+
+pool_collector = PoolCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(pool_collector)
+
+
+def render() -> Tuple[bytes, str]:
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(pool_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    # Latency, in-flight requests and SQL statements per route. The route is
+    # the matched path template, known once the router has run.
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        sent = 0
+
+        async def counting_send(message: Message) -> None:
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        in_progress = IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            current_request.reset(token)
+            route = getattr(scope.get("route"), "path", UNMATCHED)
+            REQUEST_LATENCY.labels(method, route, status).observe(elapsed)
+            REQUEST_STATEMENTS.labels(route).observe(stats.statements)
+            REQUEST_DB_SECONDS.labels(route).observe(stats.db_seconds)
+            if route == MEDIA_ROUTE and sent:
+                MEDIA_BYTES.labels("app").inc(sent)
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import io
+
+from database import async_session, engine
+from imaging import detect_image_type
+from media_http import DOWNLOAD_MEDIA_TYPE
+from models import Media
+from sqlalchemy import select, update
+from storage import get_storage
+
+
+async def migrate_media(batch_size: int) -> int:
+    storage = get_storage()
+    moved = 0
+    last_id = 0
+    while True:
+        # Blobs are written between two short transactions, so no
+        # connection is held while the storage is busy.
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(Media.id, Media.file_body)
+                    .where(
+                        Media.id > last_id,
+                        Media.storage_path.is_(None),
+                        Media.file_body.is_not(None),
+                    )
+                    .order_by(Media.id)
+                    .limit(batch_size)
+                )
+                rows = result.all()
+        if not rows:
+            break
+
+        moved_rows = []
+        for media_id, file_body in rows:
+            blob = await storage.save(file_body)
+            # Typed from the bytes, like uploads; whatever is not an accepted
+            # image is only offered as a download.
+            content_type = await asyncio.to_thread(
+                detect_image_type, io.BytesIO(file_body)
+            )
+            moved_rows.append(
+                {
+                    "id": media_id,
+                    "content_hash": blob.content_hash,
+                    "size": blob.size,
+                    "content_type": content_type or DOWNLOAD_MEDIA_TYPE,
+                    "storage_path": blob.path,
+                    "file_body": None,
+                }
+            )
+
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(update(Media), moved_rows)
+
+        last_id = rows[-1].id
+        moved += len(rows)
+        print(f"moved {moved} medias")
+    return moved
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Move media blobs stored in the medias table to the "
+        "configured media storage and clear them from the database. "
+        "Run VACUUM on medias afterwards to give the space back."
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    try:
+        await migrate_media(args.batch_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00
+
+The tables exactly as the old Base.metadata.create_all call on startup
+created them. Databases created that way already have them; mark them with
+`alembic stamp 0001` instead of running this revision.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEQUENCES = ("user_id_seq", "follower_id_seq", "tweets_id_seq", "likes_id_seq")
+
+
+def upgrade() -> None:
+    for name in SEQUENCES:
+        op.execute(sa.schema.CreateSequence(sa.Sequence(name)))
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("name", sa.String(), nullable=False),
+    )
+    op.create_table(
+        "followers",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("users_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("id_in_users", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "tweets",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("author_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("tweet_data", sa.String(), nullable=False),
+        sa.Column("tweet_media_ids", postgresql.ARRAY(sa.Integer()), nullable=True),
+    )
+    op.create_table(
+        "likes",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column(
+            "tweets_id", sa.Integer(), sa.ForeignKey("tweets.id"), nullable=False
+        ),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("id_in_users", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "medias",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("file_body", sa.LargeBinary()),
+        sa.Column("file_name", sa.String()),
+        sa.Column("tweet_id", sa.Integer(), sa.ForeignKey("tweets.id"), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    for table in ("medias", "likes", "tweets", "followers", "users"):
+        op.drop_table(table)
+    for name in reversed(SEQUENCES):
+        op.execute(sa.schema.DropSequence(sa.Sequence(name)))
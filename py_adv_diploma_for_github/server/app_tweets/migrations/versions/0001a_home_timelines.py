@@ -0,0 +1,36 @@
+"""materialized home timelines
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-18 10:15:00
+
+Not part of the schema of the old application, so databases stamped at
+0001 get it here. It starts empty; 0010 fills it from the follow edges.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0001a"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "timelines",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("tweet_id", sa.Integer(), sa.ForeignKey("tweets.id")),
+        sa.Column("author_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "tweet_id"),
+    )
+    op.create_index("ix_timelines_tweet_id", "timelines", ["tweet_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_timelines_tweet_id", table_name="timelines")
+    op.drop_table("timelines")
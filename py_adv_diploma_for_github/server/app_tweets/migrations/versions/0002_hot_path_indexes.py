@@ -0,0 +1,81 @@
+"""hot path indexes and uniqueness of likes and follows
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2026-10-18 10:30:00
+
+Indexes are built with CREATE INDEX CONCURRENTLY outside of the
+migration transaction, so the tables stay writable while they build.
+Unique constraints are attached to the already built unique indexes,
+which only needs a short lock.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ("ix_users_name", "users", ["name"]),
+    ("ix_tweets_author_id_id", "tweets", ["author_id", "id"]),
+    ("ix_likes_tweets_id_name", "likes", ["tweets_id", "name"]),
+    ("ix_followers_id_in_users", "followers", ["id_in_users"]),
+    ("ix_medias_tweet_id", "medias", ["tweet_id"]),
+)
+
+UNIQUE_CONSTRAINTS = (
+    ("uq_likes_tweets_id_id_in_users", "likes", ["tweets_id", "id_in_users"]),
+    ("uq_followers_users_id_id_in_users", "followers", ["users_id", "id_in_users"]),
+)
+
+
+def upgrade() -> None:
+    # Duplicates were never prevented before, keep the oldest row of each pair.
+    for _, table, columns in UNIQUE_CONSTRAINTS:
+        condition = " AND ".join(f"a.{column} = b.{column}" for column in columns)
+        op.execute(
+            f"DELETE FROM {table} a USING {table} b WHERE {condition} AND a.id > b.id"
+        )
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        for name, table, columns in UNIQUE_CONSTRAINTS:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=True,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"
+        )
+
+
+def downgrade() -> None:
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        op.drop_constraint(name, table, type_="unique")
+
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
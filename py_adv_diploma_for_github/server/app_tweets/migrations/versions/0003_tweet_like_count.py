@@ -0,0 +1,34 @@
+"""denormalized like counter on tweets
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant default does not rewrite the table.
+    op.add_column(
+        "tweets",
+        sa.Column("like_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.execute(
+        "UPDATE tweets SET like_count = counted.likes "
+        "FROM (SELECT tweets_id, count(*) AS likes FROM likes GROUP BY tweets_id) "
+        "AS counted WHERE tweets.id = counted.tweets_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("tweets", "like_count")
@@ -0,0 +1,56 @@
+"""media metadata for blobs kept outside the database
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00
+
+Existing rows keep their file_body until migrate_media.py copies the
+blobs to the configured storage and clears the column.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("medias", sa.Column("content_hash", sa.String(64), nullable=True))
+    op.add_column("medias", sa.Column("size", sa.Integer(), nullable=True))
+    op.add_column("medias", sa.Column("content_type", sa.String(), nullable=True))
+    op.add_column("medias", sa.Column("storage_path", sa.String(), nullable=True))
+    op.add_column(
+        "medias",
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+        ),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_medias_content_hash",
+            "medias",
+            ["content_hash"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_medias_content_hash", table_name="medias")
+    for column in (
+        "created_at",
+        "storage_path",
+        "content_type",
+        "size",
+        "content_hash",
+    ):
+        op.drop_column("medias", column)
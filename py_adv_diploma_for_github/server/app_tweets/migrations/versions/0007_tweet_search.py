@@ -0,0 +1,43 @@
+"""full-text search index on tweets
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 15:00:00
+
+A GIN index on the expression models.search_vector rather than a stored
+column: nothing is added to tweets, so the table is not rewritten, and the
+index is built concurrently like 0002 while the table stays writable.
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_tweets_search_vector",
+            "tweets",
+            [sa.text("to_tsvector('simple'::regconfig, tweet_data)")],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_tweets_search_vector",
+            table_name="tweets",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
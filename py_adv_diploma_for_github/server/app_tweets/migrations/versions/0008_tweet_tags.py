@@ -0,0 +1,89 @@
+"""hashtag and mention index, hashtag counts per time bucket
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 18:00:00
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The patterns of tags.py in Postgres regex syntax, for the backfill.
+HASHTAG = r"(?<![[:alnum:]_#])#([[:alnum:]_]+)"
+MENTION = r"(?<![[:alnum:]_@])@([[:alnum:]_]+)"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "tweet_hashtags",
+        sa.Column("tag", sa.String(64), nullable=False),
+        sa.Column(
+            "tweet_id",
+            sa.Integer(),
+            sa.ForeignKey("tweets.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("tag", "tweet_id"),
+    )
+    op.create_index("ix_tweet_hashtags_tweet_id", "tweet_hashtags", ["tweet_id"])
+    op.create_table(
+        "tweet_mentions",
+        sa.Column(
+            "user_id",
+            sa.Integer(),
+            sa.ForeignKey("users.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column(
+            "tweet_id",
+            sa.Integer(),
+            sa.ForeignKey("tweets.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("user_id", "tweet_id"),
+    )
+    op.create_index("ix_tweet_mentions_tweet_id", "tweet_mentions", ["tweet_id"])
+    op.create_table(
+        "hashtag_counts",
+        sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("tag", sa.String(64), nullable=False),
+        sa.Column("uses", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("bucket", "tag"),
+    )
+
+    # Existing tweets are indexed in place. Their uses are dated at the epoch
+    # (tags.BACKFILLED_AT), before any trends window: hashtag_counts starts
+    # empty, and deleting one of these tweets later must not take its tags
+    # back from the current window.
+    op.execute(
+        "INSERT INTO tweet_hashtags (tag, tweet_id, created_at) "
+        "SELECT DISTINCT lower(m[1]), tweets.id, 'epoch'::timestamptz FROM tweets, "
+        f"regexp_matches(tweet_data, '{HASHTAG}', 'g') AS m "
+        "WHERE m[1] ~ '[[:alpha:]]' AND length(m[1]) <= 64"
+    )
+    op.execute(
+        "INSERT INTO tweet_mentions (user_id, tweet_id) "
+        "SELECT DISTINCT users.id, tweets.id FROM tweets, "
+        f"regexp_matches(tweet_data, '{MENTION}', 'g') AS m "
+        "JOIN users ON users.name = m[1]"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("hashtag_counts")
+    op.drop_table("tweet_mentions")
+    op.drop_table("tweet_hashtags")
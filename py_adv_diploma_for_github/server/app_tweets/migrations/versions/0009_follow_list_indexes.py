@@ -0,0 +1,60 @@
+"""indexes paging followers and followings in follow order
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 10:00:00
+
+Built concurrently like 0002. (id_in_users, id) replaces the index on
+id_in_users alone, which it covers.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ("ix_followers_users_id_id", "followers", ["users_id", "id"]),
+    ("ix_followers_id_in_users_id", "followers", ["id_in_users", "id"]),
+)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        op.drop_index(
+            "ix_followers_id_in_users",
+            table_name="followers",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_followers_id_in_users",
+            "followers",
+            ["id_in_users"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        for name, table, _ in INDEXES:
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,68 @@
+"""store follow edges as (followee, follower) and rebuild timelines
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 11:00:00
+
+The old application wrote a follow as users_id = the follower and
+id_in_users, name = the followed user. Since authentication by api-key the
+edge is users_id = the followed user and id_in_users, name = the follower,
+which is what fan-out, the profile lists and search read. Existing edges are
+swapped in place, keeping their ids so follow order is unchanged, and the
+home timelines built from the old edges are rebuilt.
+
+The unique constraint is dropped for the swap (a mutual follow would collide
+with itself halfway through) and put back afterwards; followers and
+timelines are locked until the revision commits. Timeline pages cached in
+Redis expire after TIMELINE_CACHE_TTL, flush them to drop them right away.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CONSTRAINT = "uq_followers_users_id_id_in_users"
+# service.TIMELINE_BACKFILL: what following a user copies into a timeline.
+BACKFILL = 200
+
+
+def swap() -> None:
+    # name goes with id_in_users, so it becomes the name of the user that
+    # was in users_id. The right-hand sides see the row before the update.
+    op.drop_constraint(CONSTRAINT, "followers", type_="unique")
+    op.execute(
+        "UPDATE followers f SET users_id = f.id_in_users,"
+        " id_in_users = f.users_id, name = u.name"
+        " FROM users u WHERE u.id = f.users_id"
+    )
+    op.create_unique_constraint(CONSTRAINT, "followers", ["users_id", "id_in_users"])
+
+
+def upgrade() -> None:
+    # id_in_users never had a foreign key; it becomes users_id, which has.
+    op.execute(
+        "DELETE FROM followers f"
+        " WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = f.id_in_users)"
+    )
+    swap()
+
+    op.execute("TRUNCATE timelines")
+    op.execute(
+        "INSERT INTO timelines (user_id, tweet_id, author_id)"
+        " SELECT f.id_in_users, t.id, t.author_id FROM followers f"
+        " CROSS JOIN LATERAL ("
+        "  SELECT id, author_id FROM tweets WHERE author_id = f.users_id"
+        f" ORDER BY id DESC LIMIT {BACKFILL}"
+        " ) t"
+        " UNION SELECT author_id, id, author_id FROM tweets"
+    )
+
+
+def downgrade() -> None:
+    swap()
@@ -1,34 +1,82 @@
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 from database import Base
-from sqlalchemy import Column, ForeignKey, Integer, LargeBinary, Sequence, String
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    Sequence,
+    String,
+    UniqueConstraint,
+    func,
+    literal_column,
+)
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import ColumnElement
+
+# No stemming: tweets mix Russian and English.
+SEARCH_CONFIG = "simple"
+
+
+def search_vector(document: Any) -> ColumnElement[Any]:
+    # The expression behind ix_tweets_search_vector. Queries must spell it
+    # the same way, the configuration inlined rather than bound, for
+    # Postgres to match them to the index.
+    return func.to_tsvector(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), document)
 
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_name", "name"),)
 
     id: Mapped[int] = mapped_column(Sequence("user_id_seq"), primary_key=True)
     name: Mapped[str] = mapped_column(nullable=False)
     followers: Mapped[List["Follower"]] = relationship(
-        back_populates="users", cascade="all, delete-orphan", lazy="selectin"
+        back_populates="users", cascade="all, delete-orphan", lazy="raise"
     )
     tweets: Mapped[List["Tweet"]] = relationship(
-        back_populates="authors", cascade="all, delete-orphan", lazy="selectin"
+        back_populates="authors", cascade="all, delete-orphan", lazy="raise"
     )
 
     def to_json(self) -> Dict[str, Any]:
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+class ApiKey(Base):
+    # Only the sha256 of a key is stored; the key itself is shown once.
+    __tablename__ = "api_keys"
+    __table_args__ = (Index("ix_api_keys_user_id", "user_id"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    key_hash: Mapped[str] = mapped_column(String(64), unique=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    revoked_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+
 class Follower(Base):
     __tablename__ = "followers"
+    __table_args__ = (
+        UniqueConstraint(
+            "users_id", "id_in_users", name="uq_followers_users_id_id_in_users"
+        ),
+        # Follower and following lists, newest follow first.
+        Index("ix_followers_users_id_id", "users_id", "id"),
+        Index("ix_followers_id_in_users_id", "id_in_users", "id"),
+    )
+
     id: Mapped[int] = mapped_column(Sequence("follower_id_seq"), primary_key=True)
     users_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     name: Mapped[str] = mapped_column(nullable=False)
     id_in_users: Mapped[int] = mapped_column(nullable=False)
-    users: Mapped[List["User"]] = relationship(back_populates="followers")
+    users: Mapped[List["User"]] = relationship(back_populates="followers", lazy="raise")
 
     def to_json(self) -> Dict[str, Any]:
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
@@ -36,29 +84,49 @@ class Follower(Base):
 
 class Tweet(Base):
     __tablename__ = "tweets"
+    __table_args__ = (Index("ix_tweets_author_id_id", "author_id", "id"),)
+
     id: Mapped[int] = mapped_column(Sequence("tweets_id_seq"), primary_key=True)
     author_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     tweet_data: Mapped[str] = mapped_column(nullable=False)
     tweet_media_ids: Mapped[List[int]] = mapped_column(ARRAY(Integer), nullable=True)
-    authors: Mapped[List["User"]] = relationship(back_populates="tweets")
+    # Maintained by counters.LikeCounter, lags the likes table by one flush.
+    like_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    authors: Mapped[List["User"]] = relationship(back_populates="tweets", lazy="raise")
     likes: Mapped[List["Like"]] = relationship(
-        back_populates="tweets_likes", cascade="all, delete-orphan", lazy="selectin"
+        back_populates="tweets_likes", cascade="all, delete-orphan", lazy="raise"
     )
     attachments: Mapped[List["Media"]] = relationship(
-        back_populates="tweet", cascade="all, delete-orphan", lazy="selectin"
+        back_populates="tweet", cascade="all, delete-orphan", lazy="raise"
     )
 
     def to_json(self) -> Dict[str, Any]:
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+Index(
+    "ix_tweets_search_vector",
+    search_vector(Tweet.tweet_data),
+    postgresql_using="gin",
+)
+
+
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        UniqueConstraint(
+            "tweets_id", "id_in_users", name="uq_likes_tweets_id_id_in_users"
+        ),
+        Index("ix_likes_tweets_id_name", "tweets_id", "name"),
+    )
+
     id: Mapped[int] = mapped_column(Sequence("likes_id_seq"), primary_key=True)
     tweets_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"))
     name: Mapped[str] = mapped_column(nullable=False)
     id_in_users: Mapped[int] = mapped_column(nullable=False)
-    tweets_likes: Mapped[List["Tweet"]] = relationship(back_populates="likes")
+    tweets_likes: Mapped[List["Tweet"]] = relationship(
+        back_populates="likes", lazy="raise"
+    )
 
     def to_json(self) -> Dict[str, Any]:
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
@@ -66,9 +134,87 @@ class Like(Base):
 
 class Media(Base):
     __tablename__ = "medias"
+    __table_args__ = (
+        Index("ix_medias_tweet_id", "tweet_id"),
+        Index("ix_medias_content_hash", "content_hash"),
+    )
 
     id = Column(Integer, primary_key=True)
-    file_body = Column(LargeBinary)
+    # Legacy inline blob, emptied by migrate_media.py once moved to storage.
+    file_body = Column(LargeBinary, nullable=True)
     file_name = Column(String)
+    content_hash = Column(String(64), nullable=True)
+    size = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    storage_path = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     tweet_id = Column(Integer, ForeignKey("tweets.id"), nullable=True)
-    tweet = relationship("Tweet", back_populates="attachments")
+    tweet = relationship("Tweet", back_populates="attachments", lazy="raise")
+
+
+class MediaVariant(Base):
+    # Resized derivatives, keyed by the original's content hash so uploads
+    # sharing a blob share their derivatives too.
+    __tablename__ = "media_variants"
+
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    variant: Mapped[str] = mapped_column(String(16), primary_key=True)
+    variant_hash: Mapped[str] = mapped_column(String(64))
+    size: Mapped[int]
+    content_type: Mapped[str]
+    storage_path: Mapped[str]
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class TimelineEntry(Base):
+    # Materialized home timeline: one row per (reader, tweet), filled by
+    # fan-out on write so the feed is read with a single range scan.
+    __tablename__ = "timelines"
+    __table_args__ = (Index("ix_timelines_tweet_id", "tweet_id"),)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"), primary_key=True)
+    author_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class TweetHashtag(Base):
+    # Hashtags of each tweet, extracted on write (tags.py). The primary key
+    # serves a tag's tweets newest first; created_at places a removed tag in
+    # the trend bucket it was counted in.
+    __tablename__ = "tweet_hashtags"
+    __table_args__ = (Index("ix_tweet_hashtags_tweet_id", "tweet_id"),)
+
+    tag: Mapped[str] = mapped_column(String(64), primary_key=True)
+    tweet_id: Mapped[int] = mapped_column(
+        ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class TweetMention(Base):
+    __tablename__ = "tweet_mentions"
+    __table_args__ = (Index("ix_tweet_mentions_tweet_id", "tweet_id"),)
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    tweet_id: Mapped[int] = mapped_column(
+        ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True
+    )
+
+
+class HashtagCount(Base):
+    # Uses of a tag per time bucket, kept by counters.TrendCounter; trends
+    # sum the buckets of the window only.
+    __tablename__ = "hashtag_counts"
+
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    tag: Mapped[str] = mapped_column(String(64), primary_key=True)
+    uses: Mapped[int]
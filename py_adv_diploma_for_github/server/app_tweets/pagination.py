@@ -0,0 +1,73 @@
+import base64
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select
+from sqlalchemy.orm import InstrumentedAttribute
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(*keys: Any) -> str:
+    raw = json.dumps(list(keys), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        keys = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(keys, list) or not keys:
+        raise ValueError("Invalid cursor")
+    return keys
+
+
+def decode_id_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    keys = decode_cursor(cursor)
+    if len(keys) != 1 or not isinstance(keys[0], int):
+        raise ValueError("Invalid cursor")
+    return keys[0]
+
+
+def decode_rank_cursor(cursor: Optional[str]) -> Optional[Tuple[float, int]]:
+    if cursor is None:
+        return None
+    keys = decode_cursor(cursor)
+    if len(keys) != 2:
+        raise ValueError("Invalid cursor")
+    rank, tweet_id = keys
+    if not isinstance(rank, (int, float)) or not isinstance(tweet_id, int):
+        raise ValueError("Invalid cursor")
+    return float(rank), tweet_id
+
+
+def keyset(
+    stmt: Select,
+    column: InstrumentedAttribute,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> Select:
+    # Newest first; the cursor becomes a range condition on an indexed column,
+    # so every page is an index seek no matter how deep the client scrolls.
+    # One extra row is fetched to know whether another page exists.
+    if after_id is not None:
+        return stmt.where(column > after_id).order_by(column.asc()).limit(limit + 1)
+    if before_id is not None:
+        stmt = stmt.where(column < before_id)
+    return stmt.order_by(column.desc()).limit(limit + 1)
+
+
+def page(
+    rows: Sequence[Any], limit: int, after_id: Optional[int] = None
+) -> Tuple[List[Any], bool]:
+    has_more = len(rows) > limit
+    items = list(rows[:limit])
+    if after_id is not None:
+        items.reverse()
+    return items, has_more
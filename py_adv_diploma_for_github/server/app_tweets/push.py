@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import signal
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set
+
+import asyncpg
+import orjson
+import service
+from database import async_session
+from models import TimelineEntry
+from settings import settings
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 1.0
+# Ids per NOTIFY; payloads are limited to 8000 bytes.
+PAYLOAD_ITEMS = 200
+EVICTED = b"event: evicted\ndata: {}\n\n"
+HEARTBEAT = b": ping\n\n"
+# What the server stops on (uvicorn handles the same).
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+def sse_event(name: str, data: Any) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+class Subscriber:
+    # One streaming connection. An idle one is these slots and an empty
+    # deque; the encoded events it is handed are shared with every other
+    # subscriber of the worker.
+
+    __slots__ = ("user_id", "evicted", "_events", "_max_pending", "_waiter")
+
+    def __init__(self, user_id: int, max_pending: int) -> None:
+        self.user_id = user_id
+        self.evicted = False
+        self._events: Deque[bytes] = deque()
+        self._max_pending = max_pending
+        self._waiter: Optional[asyncio.Future] = None
+
+    def offer(self, event: bytes) -> None:
+        # A consumer that lets max_pending events pile up is not reading its
+        # socket: it is dropped instead of buffering without bound, and the
+        # client reloads the timeline when it reconnects.
+        if self.evicted:
+            return
+        if len(self._events) >= self._max_pending:
+            self.close()
+            return
+        self._events.append(event)
+        self._wake()
+
+    def close(self) -> None:
+        self.evicted = True
+        self._events.clear()
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self, timeout: float) -> bytes:
+        # The next event, EVICTED once dropped, HEARTBEAT after timeout.
+        if not self._events and not self.evicted:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+        if self.evicted:
+            return EVICTED
+        if self._events:
+            return self._events.popleft()
+        return HEARTBEAT
+
+
+class PushHub:
+    # Pushes new tweets and like counts to the streaming connections of one
+    # worker. Writers publish tweet ids after commit; a background task sends
+    # them as NOTIFY on one channel, so every worker hears every write. Each
+    # worker then finds which of its own subscribers have the tweets in their
+    # timelines with one lookup per batch of notifications, renders new
+    # tweets once and hands the same bytes to all of them.
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        dsn: str,
+        channel: str,
+        max_pending: int,
+        max_connections: int,
+    ) -> None:
+        self._session_factory = session_factory
+        self._dsn = dsn
+        self.channel = channel
+        self.max_pending = max_pending
+        self.max_connections = max_connections
+        self.stats: Counter = Counter()
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._connections = 0
+        self._outgoing_tweets: List[int] = []
+        self._outgoing_likes: Dict[int, int] = {}
+        self._incoming_tweets: List[int] = []
+        self._incoming_likes: Dict[int, int] = {}
+        self._send = asyncio.Event()
+        self._dispatch = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.closing = False
+
+    @property
+    def connections(self) -> int:
+        return self._connections
+
+    def start(self) -> None:
+        self.closing = False
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run()),
+                asyncio.create_task(self._dispatch_loop()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self.close_streams()
+
+    def close_streams(self) -> None:
+        # Every stream gets "evicted" and ends; its client reconnects, to
+        # another worker once this one has stopped accepting connections.
+        self.closing = True
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.close()
+
+    @contextmanager
+    def closing_on_signals(self) -> Iterator[None]:
+        # The server lets open responses finish before the lifespan
+        # shutdown, and streams never finish by themselves: they are closed
+        # as soon as the shutdown signal arrives, then the server's own
+        # handler runs. Signals can only be handled in the main thread.
+        loop = asyncio.get_running_loop()
+        previous: Dict[int, Any] = {}
+
+        def handle(sig: int, frame: Optional[FrameType]) -> None:
+            loop.call_soon_threadsafe(self.close_streams)
+            handler = previous[sig]
+            if callable(handler):
+                handler(sig, frame)
+            else:
+                signal.signal(sig, handler or signal.SIG_DFL)
+                signal.raise_signal(sig)
+
+        if threading.current_thread() is threading.main_thread():
+            for sig in SHUTDOWN_SIGNALS:
+                previous[sig] = signal.signal(sig, handle)
+        try:
+            yield
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler or signal.SIG_DFL)
+
+    @contextmanager
+    def subscribe(self, user_id: int) -> Iterator[Subscriber]:
+        subscriber = Subscriber(user_id, self.max_pending)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        self._connections += 1
+        try:
+            yield subscriber
+        finally:
+            self._connections -= 1
+            subscribers = self._subscribers[user_id]
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_id]
+            if subscriber.evicted:
+                self.stats["evictions"] += 1
+
+    def publish_tweet(self, tweet_id: int) -> None:
+        self._outgoing_tweets.append(tweet_id)
+        self._send.set()
+
+    def publish_likes(self, counts: Dict[int, int]) -> None:
+        self._outgoing_likes.update(counts)
+        self._send.set()
+
+    def payloads(self) -> Iterator[bytes]:
+        tweets, self._outgoing_tweets = self._outgoing_tweets, []
+        likes, self._outgoing_likes = list(self._outgoing_likes.items()), {}
+        for key, items in (("tweets", tweets), ("likes", likes)):
+            for start in range(0, len(items), PAYLOAD_ITEMS):
+                end = start + PAYLOAD_ITEMS
+                yield orjson.dumps({key: items[start:end]})
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        message = orjson.loads(payload)
+        self._incoming_tweets.extend(message.get("tweets", ()))
+        self._incoming_likes.update(message.get("likes", ()))
+        self._dispatch.set()
+
+    async def _run(self) -> None:
+        # One connection outside the pool both listens and sends; it must
+        # reach Postgres directly, LISTEN does not survive pgbouncer in
+        # transaction mode. Notifications sent while it reconnects are lost,
+        # clients catch up by reloading the timeline.
+        while True:
+            try:
+                connection = await asyncpg.connect(self._dsn)
+            except (OSError, asyncpg.PostgresError):
+                logger.exception("Push hub cannot connect")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                connection.add_termination_listener(lambda _: self._send.set())
+                await connection.add_listener(self.channel, self._on_notify)
+                await self._send_loop(connection)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.exception("Push hub connection failed")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                await connection.close(timeout=RECONNECT_DELAY)
+
+    async def _send_loop(self, connection: asyncpg.Connection) -> None:
+        while True:
+            await self._send.wait()
+            self._send.clear()
+            if connection.is_closed():
+                raise ConnectionError("Push hub connection closed")
+            for payload in self.payloads():
+                await connection.execute(
+                    "SELECT pg_notify($1, $2)", self.channel, payload.decode()
+                )
+                self.stats["notifications_sent"] += 1
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            await self._dispatch.wait()
+            self._dispatch.clear()
+            tweets, self._incoming_tweets = self._incoming_tweets, []
+            likes, self._incoming_likes = self._incoming_likes, {}
+            if not self._subscribers:
+                continue
+            try:
+                await self._deliver(tweets, likes)
+            except Exception:
+                logger.exception("Push hub delivery failed")
+
+    async def _deliver(self, tweet_ids: List[int], likes: Dict[int, int]) -> None:
+        # Readers are looked up among the users connected to this worker
+        # only, through the (user_id, tweet_id) primary key of timelines.
+        user_ids = list(self._subscribers)
+        async with self._session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(TimelineEntry.user_id, TimelineEntry.tweet_id).where(
+                        TimelineEntry.user_id.in_(user_ids),
+                        TimelineEntry.tweet_id.in_([*tweet_ids, *likes]),
+                    )
+                )
+                readers = result.all()
+                new = {tweet_id for _, tweet_id in readers if tweet_id in tweet_ids}
+                rendered = await service.get_tweets_by_ids(session, sorted(new))
+
+        events: Dict[int, List[bytes]] = {tweet_id: [] for tweet_id in likes}
+        for tweet in rendered:
+            events[tweet["id"]] = [sse_event("tweet", tweet)]
+        for tweet_id, like_count in likes.items():
+            events[tweet_id].append(
+                sse_event("like_count", {"id": tweet_id, "like_count": like_count})
+            )
+        for user_id, tweet_id in readers:
+            for event in events.get(tweet_id, ()):
+                for subscriber in self._subscribers.get(user_id, ()):
+                    subscriber.offer(event)
+                    self.stats["events"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "connections": self._connections,
+            "users": len(self._subscribers),
+            **self.stats,
+        }
+
+
+hub = PushHub(
+    async_session,
+    dsn=make_url(settings.push_database_url or settings.database_url)
+    .set(drivername="postgresql")
+    .render_as_string(False),
+    channel=settings.push_channel,
+    max_pending=settings.push_queue_size,
+    max_connections=settings.push_max_connections,
+)
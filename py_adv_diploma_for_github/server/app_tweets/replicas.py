@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from auth import hash_key
+from database import async_session, engine, engine_options, pool_stats
+from settings import settings
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Unix time until which the browser's reads go to the primary.
+PRIMARY_COOKIE = "read_primary_until"
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# Seconds of replay lag. A replica that has replayed everything it received
+# counts as current, otherwise an idle primary would look like lag.
+LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """
+)
+
+
+class ReplicaSet:
+    # Sessions for read-only handlers. Replicas are taken round-robin; one
+    # that fails a health check, lags more than max_lag or loses a connection
+    # is ejected until a later check passes (at least eject_seconds without
+    # the checker running). Without a usable replica reads go to the primary.
+    #
+    # A user who just wrote reads from the primary for stick_seconds, so
+    # their own follow or tweet never vanishes on the next page load: a
+    # replica further behind than that is ejected by the checker.
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: List[AsyncEngine],
+        check_interval: float,
+        max_lag: float,
+        eject_seconds: float,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.eject_seconds = eject_seconds
+        self.stick_seconds = max_lag + check_interval
+        self.stats: Counter = Counter()
+        self.reads: Counter = Counter()
+        self._sessions = {
+            replica: async_sessionmaker(
+                replica, expire_on_commit=False, class_=AsyncSession
+            )
+            for replica in replicas
+        }
+        self._ejected_until: Dict[AsyncEngine, float] = {}
+        self._lag: Dict[AsyncEngine, float] = {}
+        self._next = 0
+        # api-key hash -> monotonic deadline, in deadline order.
+        self._writers: "OrderedDict[str, float]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        for replica in replicas:
+            event.listen(replica.sync_engine, "handle_error", self._on_error(replica))
+
+    def _on_error(self, replica: AsyncEngine) -> Any:
+        def handle_error(context: Any) -> None:
+            if context.is_disconnect or context.connection is None:
+                self.eject(replica, str(context.original_exception))
+
+        return handle_error
+
+    @staticmethod
+    def name(replica: AsyncEngine) -> str:
+        return replica.url.render_as_string(hide_password=True)
+
+    def is_ejected(self, replica: AsyncEngine) -> bool:
+        return self._ejected_until.get(replica, 0.0) > time.monotonic()
+
+    def pick(self) -> AsyncEngine:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if not self.is_ejected(replica):
+                self.reads[replica] += 1
+                return replica
+        self.stats["primary_reads"] += 1
+        return self.primary
+
+    def mark_write(self, key_hash: str) -> None:
+        now = time.monotonic()
+        self._writers[key_hash] = now + self.stick_seconds
+        self._writers.move_to_end(key_hash)
+        while next(iter(self._writers.values())) <= now:
+            self._writers.popitem(last=False)
+
+    def wrote_recently(self, key_hash: str) -> bool:
+        return self._writers.get(key_hash, 0.0) > time.monotonic()
+
+    def reads_primary(self, request: Request) -> bool:
+        if not self.replicas:
+            return False
+        api_key = request.headers.get("api-key")
+        if api_key and self.wrote_recently(hash_key(api_key)):
+            return True
+        cookie = request.cookies.get(PRIMARY_COOKIE)
+        return primary_cookie_fresh(cookie, self.stick_seconds)
+
+    def session(self, primary: bool = False) -> AsyncSession:
+        if primary and self.replicas:
+            self.stats["sticky_reads"] += 1
+            return async_session()
+        replica = self.pick()
+        if replica is self.primary:
+            return async_session()
+        return self._sessions[replica]()
+
+    def eject(self, replica: AsyncEngine, reason: str) -> None:
+        if not self.is_ejected(replica):
+            logger.warning("Replica %s ejected: %s", self.name(replica), reason)
+            self.stats["ejections"] += 1
+        self._ejected_until[replica] = time.monotonic() + self.eject_seconds
+
+    async def check(self, replica: AsyncEngine) -> None:
+        try:
+            async with replica.connect() as connection:
+                lag = await asyncio.wait_for(
+                    connection.scalar(LAG_QUERY), self.check_interval
+                )
+        except Exception as exc:
+            self.eject(replica, repr(exc))
+            return
+        self._lag[replica] = float(lag)
+        if lag > self.max_lag:
+            self.eject(replica, f"lag {lag:.1f}s")
+        elif self._ejected_until.pop(replica, None) is not None:
+            logger.info("Replica %s is back", self.name(replica))
+
+    def start(self) -> None:
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "replicas": [
+                {
+                    "url": self.name(replica),
+                    "healthy": not self.is_ejected(replica),
+                    "lag_seconds": self._lag.get(replica),
+                    "reads": self.reads[replica],
+                    "pool": pool_stats(replica),
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+def primary_cookie_fresh(value: Optional[str], stick_seconds: float) -> bool:
+    # The cookie comes from the client: a time further away than the
+    # middleware ever sets, or not a number at all, is ignored.
+    try:
+        until = float(value or 0)
+    except ValueError:
+        return False
+    now = time.time()
+    return math.isfinite(until) and now < until <= now + stick_seconds
+
+
+class ReadYourWritesMiddleware:
+    # Marks the sender of a successful write, so ReplicaSet.reads_primary
+    # sends their reads to the primary for stick_seconds: in this process by
+    # api-key and in every worker through a cookie, which browsers send back
+    # without being asked.
+
+    def __init__(self, app: ASGIApp, replica_set: ReplicaSet) -> None:
+        self.app = app
+        self.replica_set = replica_set
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def marking_send(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                stick = self.replica_set.stick_seconds
+                api_key = Headers(scope=scope).get("api-key")
+                if api_key:
+                    self.replica_set.mark_write(hash_key(api_key))
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{PRIMARY_COOKIE}={time.time() + stick:.3f}; Max-Age={stick:g};"
+                    " Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, marking_send)
+
+
+replicas = ReplicaSet(
+    engine,
+    [
+        create_async_engine(url, **engine_options())
+        for url in settings.database_replica_urls
+    ],
+    check_interval=settings.replica_check_interval,
+    max_lag=settings.replica_max_lag,
+    eject_seconds=settings.replica_eject_seconds,
+)
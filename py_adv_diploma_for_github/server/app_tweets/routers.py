@@ -1,29 +1,70 @@
-import json
-import sys
+import asyncio
 from contextlib import asynccontextmanager
-from typing import Annotated, Any
+from typing import Annotated, Literal, Optional
 
+import errors
+import metrics
 import models
+import pagination
 import schemas
 import service
-from database import async_session, engine, session
-from fastapi import Depends, FastAPI, Request, Response, UploadFile
-from fastapi.exceptions import ResponseValidationError
-from fastapi.responses import JSONResponse
-from sqlalchemy import select, update
+import tags
+from auth import CurrentUser, StreamUser, issue_api_key, revoke_api_key
+from body_limit import BodySizeLimitMiddleware
+from cache import timeline_cache
+from counters import like_counter, trend_counter
+from database import async_session, engine, pool_stats
+from derivatives import VariantName, derivatives
+from errors import ApiError
+from fastapi import Depends, FastAPI, Query, Request, Response, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from imaging import detect_image_type
+from media_http import media_response
+from push import EVICTED, hub, sse_event
+from replicas import ReadYourWritesMiddleware, replicas
+from settings import settings
+from sqlalchemy import literal, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from storage import iter_chunks
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
-    yield
-    await session.close()
+    # The schema is owned by the Alembic migrations (alembic upgrade head).
+    like_counter.start()
+    trend_counter.start()
+    hub.start()
+    derivatives.start()
+    replicas.start()
+    with hub.closing_on_signals():
+        yield
+    await replicas.stop()
+    await derivatives.stop()
+    await hub.stop()
+    await trend_counter.stop()
+    await like_counter.stop()
+    await timeline_cache.close()
     await engine.dispose()
+    metrics.mark_process_dead()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    responses={
+        422: {"model": schemas.ErrorOut},
+        500: {"model": schemas.ErrorOut},
+    },
+)
+errors.install(app)
+app.add_middleware(BodySizeLimitMiddleware, max_size=settings.max_upload_size)
+if replicas.replicas:
+    app.add_middleware(ReadYourWritesMiddleware, replica_set=replicas)
+if settings.metrics_enabled:
+    # Outermost, so requests rejected by the middlewares above count too.
+    app.add_middleware(metrics.MetricsMiddleware)
+    for target in [engine, *replicas.replicas]:
+        metrics.instrument(target)
 
 
 async def get_async_session():
@@ -34,614 +75,599 @@ async def get_async_session():
 SessionDep = Annotated[AsyncSession, Depends(get_async_session)]
 
 
-@app.exception_handler(ResponseValidationError)
-async def validation_exception_handler(request: Request, exc: ResponseValidationError):
-    return JSONResponse(
-        status_code=422,
-        content={"detail": exc.errors(), "body": exc.body},
-    )
+async def get_read_session(request: Request):
+    # A replica when one is healthy, the primary for a caller who has just
+    # written (see ReadYourWritesMiddleware). Rows others wrote moments ago
+    # may not be there yet: handlers that miss look again on the primary.
+    async with replicas.session(replicas.reads_primary(request)) as session:
+        yield session
+
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
 
 
 @app.post("/api/user", response_model=schemas.UserOut)
-async def add_user(
-    user: schemas.UserIn,
-    response: Response,
-    session: SessionDep
-) -> models.User | str:
+async def add_user(user: schemas.UserIn, session: SessionDep) -> models.User:
     new_user = models.User(**user.model_dump())
 
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            session.add(new_user)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
+    async with session.begin():
+        session.add(new_user)
+        await session.commit()
     return new_user
 
 
-@app.post("/api/tweets", response_model=schemas.TweetOut)
+@app.post("/api/tweets", response_model=schemas.TweetCreatedOut)
 async def add_tweet(
     tweet: schemas.TweetIn,
-    response: Response,
     session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
+    me: CurrentUser,
+) -> ORJSONResponse:
     new_tweet = models.Tweet(**tweet.model_dump())
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
-            me_ = me.fetchone()
-
-            if me_ is not None:
-                # new_tweet = models.Tweet(content=tweet.content)
-                me_[0].tweets.append(new_tweet)
-
-                # session.add(new_tweet)
-            await session.commit()
-        async with session.begin():
-            tweets = await session.execute(
-                select(models.Tweet).where(models.Tweet.id == new_tweet.id)
+    readers: list[int] = []
+    added_tags: list[tags.TagUse] = []
+    async with session.begin():
+        new_tweet.author_id = me.id
+        session.add(new_tweet)
+        await session.commit()
+    async with session.begin():
+        tweets = await session.execute(
+            select(models.Tweet.tweet_media_ids, models.Tweet.author_id).where(
+                models.Tweet.id == new_tweet.id
             )
-            tweets_ = tweets.fetchone()
-            if tweets_ is not None:
+        )
+        tweets_ = tweets.fetchone()
+        if tweets_ is not None:
+            if tweets_.tweet_media_ids:
                 media_update = (
                     update(models.Media)
-                    .where(models.Media.id.in_(tweets_[0].tweet_media_ids))
+                    .where(
+                        models.Media.id.in_(tweets_.tweet_media_ids),
+                        # A media row attached to a tweet stays with it.
+                        models.Media.tweet_id.is_(None),
+                    )
                     .values(tweet_id=new_tweet.id)
-                    .execution_options(synchronize_session="fetch")
+                    .execution_options(synchronize_session=False)
                 )
                 await session.execute(media_update)
-            await session.commit()
-
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+            readers = await service.fan_out_tweet(
+                session, tweet_id=new_tweet.id, author_id=tweets_.author_id
+            )
+            added_tags, _ = await service.index_tweet_tags(
+                session, tweet_id=new_tweet.id, text=tweet.tweet_data
+            )
+        await session.commit()
+    trend_counter.record(added=added_tags)
+    await timeline_cache.bump(readers)
+    if readers:
+        hub.publish_tweet(new_tweet.id)
+
+    return ORJSONResponse(
         status_code=201,
         content={"result": True, "tweet_id": new_tweet.id},
     )
 
 
-@app.delete("/api/tweets/{id}", response_model=schemas.TweetOut)
+@app.delete("/api/tweets/{id}", response_model=schemas.ResultOut)
 async def delete_tweet_by_id(
-    id: int,
-    response: Response,
-    session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
-
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
-
-            me_ = me.fetchone()
-            if me_ is not None:
-                tweet = await session.execute(
-                    select(models.Tweet).where(
-                        models.Tweet.author_id == me_[0].id, models.Tweet.id == id
-                    )
-                )
-
-                tweet_ = tweet.scalar_one_or_none()
-                if tweet_ is not None:
-                    await session.delete(tweet_)
-        await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    id: int, session: SessionDep, me: CurrentUser
+) -> ORJSONResponse:
+
+    async with session.begin():
+        deleted = await service.delete_tweet(session, tweet_id=id, author_id=me.id)
+    await session.commit()
+    if deleted is not None:
+        readers, removed_tags = deleted
+        trend_counter.record(removed=removed_tags)
+        await timeline_cache.bump([me.id, *readers])
+
+    return ORJSONResponse(
         status_code=202,
         content={"result": True},
     )
 
 
-@app.patch("/api/tweets/{id}", response_model=schemas.TweetUpdateOut)
+@app.patch("/api/tweets/{id}", response_model=schemas.ResultOut)
 async def update_tweet_by_id(
     id: int,
     content: schemas.TweetUpdateIn,
-    response: Response,
     session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
+    me: CurrentUser,
+) -> ORJSONResponse:
     update_tweets = models.Tweet(**content.model_dump())
 
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
+    async with session.begin():
+        tweet = await session.execute(
+            select(
+                models.Tweet.id,
+                models.Tweet.tweet_data,
+                models.Tweet.tweet_media_ids,
+            ).where(models.Tweet.author_id == me.id, models.Tweet.id == id)
+        )
 
-            me_ = me.fetchone()
-            if me_ is not None:
-                tweet = await session.execute(
-                    select(models.Tweet).where(
-                        models.Tweet.author_id == me_[0].id, models.Tweet.id == id
-                    )
+        tweet_ = tweet.fetchone()
+        if tweet_ is not None:
+
+            if update_tweets.tweet_data:
+                update_tweets_data = update_tweets.tweet_data
+            if update_tweets.tweet_media_ids:
+                update_tweet_media_ids = update_tweets.tweet_media_ids
+            if not update_tweets.tweet_data:
+                update_tweets_data = tweet_.tweet_data
+            if not update_tweets.tweet_media_ids:
+                update_tweet_media_ids = tweet_.tweet_media_ids
+            tweet_update = (
+                update(models.Tweet)
+                .where(models.Tweet.id == tweet_.id)
+                .values(
+                    tweet_data=update_tweets_data,
+                    tweet_media_ids=update_tweet_media_ids,
                 )
+                .execution_options(synchronize_session=False)
+            )
+            await session.execute(tweet_update)
+            added_tags, removed_tags = await service.index_tweet_tags(
+                session,
+                tweet_id=tweet_.id,
+                text=update_tweets_data,
+                old_text=tweet_.tweet_data,
+            )
+            readers = await service.tweet_readers(session, tweet_id=tweet_.id)
+        await session.commit()
+    if tweet_ is not None:
+        trend_counter.record(added=added_tags, removed=removed_tags)
+        await timeline_cache.bump([me.id, *readers])
 
-                tweet_ = tweet.fetchone()
-                if tweet_ is not None:
-
-                    if update_tweets.tweet_data:
-                        update_tweets_data = update_tweets.tweet_data
-                    if update_tweets.tweet_media_ids:
-                        update_tweet_media_ids = update_tweets.tweet_media_ids
-                    if not update_tweets.tweet_data:
-                        update_tweets_data = tweet_[0].tweet_data
-                    if not update_tweets.tweet_media_ids:
-                        update_tweet_media_ids = tweet_[0].tweet_media_ids
-                    tweet_update = (
-                        update(models.Tweet)
-                        .where(models.Tweet.id == tweet_[0].id)
-                        .values(
-                            tweet_data=update_tweets_data,
-                            tweet_media_ids=update_tweet_media_ids,
-                        )
-                        .execution_options(synchronize_session="fetch")
-                    )
-                    await session.execute(tweet_update)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=201,
         content={"result": True},
     )
 
 
-@app.post("/api/tweets/{id}/likes", response_model=schemas.LikeOut)
-async def add_like(
-    id: int,
-    response: Response,
-    session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
-    # new_like = models.Like(**like.model_dump())
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            tweet = await session.execute(
-                select(models.Tweet).where(models.Tweet.id == id)
-            )
-
-            tweet_ = tweet.fetchone()
-            if tweet_ is not None:
-                liker = await session.execute(
-                    select(models.User).where(models.User.name == user_name)
-                )
+@app.post("/api/tweets/{id}/likes", response_model=schemas.ResultOut)
+async def add_like(id: int, session: SessionDep, me: CurrentUser) -> ORJSONResponse:
+    async with session.begin():
+        liked = await service.add_like(
+            session, tweet_id=id, user_id=me.id, user_name=me.name
+        )
+    if liked:
+        like_counter.add(id, 1)
+        await timeline_cache.bump([me.id])
 
-                liker_ = liker.fetchone()
-                if liker_ is not None:
-
-                    new_like = models.Like(name=user_name, id_in_users=liker_[0].id)
-                    tweet_[0].likes.append(new_like)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=201,
         content={"result": True},
     )
 
 
-@app.delete("/api/tweets/{id}/likes", response_model=schemas.LikeOut)
-async def delete_like(
-    id: int,
-    response: Response,
-    session: SessionDep,
-    user_name: str = "pavel"
-) -> JSONResponse | str:
-    # new_like = models.Like(**like.model_dump())
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            tweet = await session.execute(
-                select(models.Tweet).where(models.Tweet.id == id)
-            )
+@app.delete("/api/tweets/{id}/likes", response_model=schemas.ResultOut)
+async def delete_like(id: int, session: SessionDep, me: CurrentUser) -> ORJSONResponse:
+    async with session.begin():
+        unliked = await service.delete_like(session, tweet_id=id, user_id=me.id)
+    if unliked:
+        like_counter.add(id, -1)
+        await timeline_cache.bump([me.id])
 
-            tweet_ = tweet.fetchone()
-            if tweet_ is not None:
-
-                like = await session.execute(
-                    select(models.Like).where(
-                        models.Like.tweets_id == tweet_[0].id, models.Like.name == user_name
-                    )
-                )
-
-                like_ = like.scalar_one_or_none()
-                if like_ is not None:
-
-                    await session.delete(like_)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=202,
         content={"result": True},
     )
 
 
-@app.post("/api/users/{id}/follow", response_model=schemas.FollowerOut)
-async def add_follow(
-    id: int,
-    response: Response,
-    session: SessionDep,
-    user_name: str = "oleg"
-) -> JSONResponse | str:
-    # new_follow = models.Follower(**follow.model_dump())
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
-
-            me_ = me.fetchone()
-            if me_ is not None:
-                follower = await session.execute(
-                    select(models.User).where(models.User.id == id)
-                )
-
-                follower_ = follower.fetchone()
-                if follower_ is not None:
+@app.post("/api/users/{id}/follow", response_model=schemas.ResultOut)
+async def add_follow(id: int, session: SessionDep, me: CurrentUser) -> ORJSONResponse:
+    async with session.begin():
+        followed = await service.add_follow(
+            session, user_id=id, follower_id=me.id, follower_name=me.name
+        )
+    if followed:
+        await timeline_cache.bump([me.id])
 
-                    new_follow = models.Follower(
-                        name=follower_[0].name, id_in_users=follower_[0].id
-                    )
-                    me_[0].followers.append(new_follow)
-                    # session.add(new_tweet)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=201,
         content={"result": True},
     )
 
 
-@app.delete("/api/users/{id}/follow", response_model=schemas.FollowerOut)
+@app.delete("/api/users/{id}/follow", response_model=schemas.ResultOut)
 async def delete_follow(
-    id: int,
-    response: Response,
-    session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
+    id: int, session: SessionDep, me: CurrentUser
+) -> ORJSONResponse:
 
-    try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
-            me_ = me.fetchone()
-            if me_ is not None:
+    async with session.begin():
+        unfollowed = await service.delete_follow(session, user_id=id, follower_id=me.id)
+    if unfollowed:
+        await timeline_cache.bump([me.id])
 
-                follow = await session.execute(
-                    select(models.Follower).where(
-                        models.Follower.users_id == me_[0].id,
-                        models.Follower.id_in_users == id,
-                    )
-                )
-
-                follow_ = follow.scalar_one_or_none()
-                if follow_ is not None:
-                    await session.delete(follow_)
-            await session.commit()
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=202,
         content={"result": True},
     )
 
 
-@app.get("/api/tweets", response_model=schemas.TweetOut)
+@app.get("/api/tweets", response_model=schemas.TimelineOut)
 async def get_tweets(
-    response: Response,
     session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
-    tweets_list: list[Any] = []
-    # new_tweet = models.Tweet(**tweet.model_dump())
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    mode: Literal["user", "home"] = "user",
+    limit: Annotated[int, Query(ge=1, le=pagination.MAX_PAGE_SIZE)] = (
+        pagination.DEFAULT_PAGE_SIZE
+    ),
+    before_id: str | None = None,
+    after_id: str | None = None,
+) -> ORJSONResponse:
     try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
+        before = pagination.decode_id_cursor(before_id)
+        after = pagination.decode_id_cursor(after_id)
+    except ValueError as exc:
+        raise ApiError(400, "InvalidCursor", str(exc)) from None
+    # The version is read before the page is built: a write landing in
+    # between bumps it, and the page is stored under the old one.
+    version = await timeline_cache.version(me.id)
+    cache_key = f"tweets:{me.id}:{version}:{mode}:{limit}:{before_id}:{after_id}"
+    cached = await timeline_cache.get(cache_key) if version is not None else None
+    if cached is not None:
+        tweets_list, next_cursor, prev_cursor = cached
+        async with replica.begin():
+            counts = await service.like_counts(
+                replica, [tweet["id"] for tweet in tweets_list]
+            )
+        for tweet in tweets_list:
+            tweet["like_count"] = counts.get(tweet["id"], tweet["like_count"])
+    else:
+        # On the primary only when the page is cached under a version that
+        # was just bumped: a lagging replica could pin it without the write.
+        db = replica
+        if version is not None and replicas.replicas:
+            if await timeline_cache.needs_primary(me.id):
+                db = session
+        async with db.begin():
+            tweets_list, next_cursor, prev_cursor = await service.get_timeline(
+                db,
+                reader_id=me.id,
+                mode=mode,
+                limit=limit,
+                before_id=before,
+                after_id=after,
             )
+    if cached is None and version is not None:
+        await timeline_cache.set(cache_key, [tweets_list, next_cursor, prev_cursor])
+
+    return ORJSONResponse(
+        status_code=200,
+        content={
+            "result": True,
+            "tweets": tweets_list,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        },
+    )
 
-            me_ = me.fetchone()
-            if me_ is not None:
 
-                tweets = await session.execute(
-                    select(models.Tweet).where(models.Tweet.author_id == me_[0].id)
-                )
-                tweets_ = tweets.fetchall()
-                if tweets_ is not None:
-
-                    tweets_list = []
-                    attachments_list = []
-                    likes_list = []
-                    for tweet in tweets_:
-                        for like in tweet[0].likes:
-                            likes_list.append({"user_id": like.id_in_users, "name": like.name})
-                        for attachment in tweet[0].tweet_media_ids:
-                            attachments_list.append(f"/api/medias/{attachment}")
-                        tweets_list.append(
-                            {
-                                "id": tweet[0].id,
-                                "content": tweet[0].tweet_data,
-                                "attachments": attachments_list,
-                                "author": {"id": me_[0].id, "name": me_[0].name},
-                                "likes": likes_list,
-                            }
-                        )
-                        attachments_list = []
-                        likes_list = []
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+@app.get("/api/tweets/search", response_model=schemas.SearchOut)
+async def search_tweets(
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    q: Annotated[str, Query(min_length=1, max_length=256)],
+    scope: Literal["all", "following"] = "all",
+    limit: Annotated[int, Query(ge=1, le=pagination.MAX_PAGE_SIZE)] = (
+        pagination.DEFAULT_PAGE_SIZE
+    ),
+    cursor: str | None = None,
+) -> ORJSONResponse:
+    try:
+        after = pagination.decode_rank_cursor(cursor)
+    except ValueError as exc:
+        raise ApiError(400, "InvalidCursor", str(exc)) from None
+    async with replica.begin():
+        tweets_list, next_cursor = await service.search_tweets(
+            replica,
+            reader_id=me.id,
+            query=q,
+            following=scope == "following",
+            limit=limit,
+            after=after,
+        )
+
+    return ORJSONResponse(
         status_code=200,
-        content={"result": True, "tweets": tweets_list},
+        content={"result": True, "tweets": tweets_list, "next_cursor": next_cursor},
     )
 
 
-@app.get("/api/users/me", response_model=schemas.FollowerOut)
-async def get_me(
-    response: Response,
-    session: SessionDep,
-    user_name: str = "sergey"
-) -> JSONResponse | str:
-    # new_follow = models.Follower(**follow.model_dump())
-    user = {}
-    followers_list = []
-    followings_list = []
+@app.get("/api/hashtags/{tag}", response_model=schemas.TimelineOut)
+async def get_hashtag_tweets(
+    tag: str,
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    limit: Annotated[int, Query(ge=1, le=pagination.MAX_PAGE_SIZE)] = (
+        pagination.DEFAULT_PAGE_SIZE
+    ),
+    before_id: str | None = None,
+    after_id: str | None = None,
+) -> ORJSONResponse:
     try:
-        response.headers["Api-Key"] = "tests"
-        async with session.begin():
-            me = await session.execute(
-                select(models.User).where(models.User.name == user_name)
-            )
-            me_ = me.fetchone()
-            if me_ is not None:
-                user_id = me_[0].id
-                user_name = me_[0].name
+        before = pagination.decode_id_cursor(before_id)
+        after = pagination.decode_id_cursor(after_id)
+    except ValueError as exc:
+        raise ApiError(400, "InvalidCursor", str(exc)) from None
+    async with replica.begin():
+        tweets_list, next_cursor, prev_cursor = await service.get_tagged_tweets(
+            replica,
+            reader_id=me.id,
+            tag=tags.normalize_tag(tag),
+            limit=limit,
+            before_id=before,
+            after_id=after,
+        )
 
-                followers = await session.execute(
-                    select(models.Follower).where(models.Follower.users_id == me_[0].id)
-                )
+    return ORJSONResponse(
+        status_code=200,
+        content={
+            "result": True,
+            "tweets": tweets_list,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        },
+    )
 
-                followers_ = followers.fetchall()
-                if followers_ is not None:
 
-                    for follower in followers_:
-                        followers_list.append(
-                            {"id": follower[0].id_in_users, "name": follower[0].name}
-                        )
+@app.get("/api/trends", response_model=schemas.TrendsOut)
+async def get_trends(
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+) -> ORJSONResponse:
+    async with replica.begin():
+        trends = await service.trending_tags(
+            replica, since=trend_counter.window_start(), limit=limit
+        )
 
-                followings = await session.execute(
-                    select(models.Follower).where(models.Follower.name == me_[0].name)
-                )
+    return ORJSONResponse(
+        status_code=200,
+        content={
+            "result": True,
+            "trends": trends,
+            "window_seconds": settings.trends_window_seconds,
+        },
+    )
+
+
+@app.get("/api/users/me/mentions", response_model=schemas.TimelineOut)
+async def get_my_mentions(
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    limit: Annotated[int, Query(ge=1, le=pagination.MAX_PAGE_SIZE)] = (
+        pagination.DEFAULT_PAGE_SIZE
+    ),
+    before_id: str | None = None,
+    after_id: str | None = None,
+) -> ORJSONResponse:
+    try:
+        before = pagination.decode_id_cursor(before_id)
+        after = pagination.decode_id_cursor(after_id)
+    except ValueError as exc:
+        raise ApiError(400, "InvalidCursor", str(exc)) from None
+    async with replica.begin():
+        tweets_list, next_cursor, prev_cursor = await service.get_mentions(
+            replica,
+            reader_id=me.id,
+            limit=limit,
+            before_id=before,
+            after_id=after,
+        )
 
-                followings_ = followings.fetchall()
-                if followings_ is not None:
-                    for following_user_ in followings_:
-
-                        following_user = await session.execute(
-                            select(models.User).where(
-                                models.User.id == following_user_[0].users_id
-                            )
-                        )
-                        follow_user = following_user.fetchone()
-                        if follow_user is not None:
-                            followings_list.append(
-                                {
-                                    "id": follow_user[0].id,
-                                    "name": follow_user[0].name,
-                                }
-                            )
-        user = {
-            "id": user_id,
-            "name": user_name,
-            "followers": followers_list,
-            "following": followings_list,
-        }
-
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
+        status_code=200,
+        content={
+            "result": True,
+            "tweets": tweets_list,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        },
+    )
+
+
+@app.get(
+    "/api/users/me",
+    response_model=schemas.UserProfileOut,
+    responses={404: {"model": schemas.ErrorOut}},
+)
+async def get_me(
+    session: SessionDep, replica: ReadSessionDep, me: CurrentUser
+) -> ORJSONResponse:
+    async with replica.begin():
+        user = await service.get_user_profile(replica, user_id=me.id)
+    if user is None:
+        async with session.begin():
+            user = await service.get_user_profile(session, user_id=me.id)
+
+    if user is None:
+        raise ApiError(404, "NotFound", "User not found")
+
+    return ORJSONResponse(
         status_code=200,
         content={"result": True, "user": user},
     )
 
 
-@app.get("/api/users/{id}", response_model=schemas.FollowerOut)
+@app.post("/api/users/me/api_keys", response_model=schemas.ApiKeyOut)
+async def create_api_key(session: SessionDep, me: CurrentUser) -> ORJSONResponse:
+    async with session.begin():
+        key_id, api_key = await issue_api_key(session, user_id=me.id)
+
+    # The key is only ever shown here, the database keeps its hash.
+    return ORJSONResponse(
+        status_code=201,
+        content={"result": True, "key_id": key_id, "api_key": api_key},
+    )
+
+
+@app.delete(
+    "/api/users/me/api_keys/{key_id}",
+    response_model=schemas.ResultOut,
+    responses={404: {"model": schemas.ErrorOut}},
+)
+async def delete_api_key(
+    key_id: int, session: SessionDep, me: CurrentUser
+) -> ORJSONResponse:
+    async with session.begin():
+        revoked = await revoke_api_key(session, key_id=key_id, user_id=me.id)
+
+    if not revoked:
+        raise ApiError(404, "NotFound", "Api key not found")
+
+    return ORJSONResponse(
+        status_code=202,
+        content={"result": True},
+    )
+
+
+@app.get(
+    "/api/users/{id}",
+    response_model=schemas.UserProfileOut,
+    responses={404: {"model": schemas.ErrorOut}},
+)
 async def get_user_by_id(
-    id: int, response: Response, session: SessionDep
-) -> JSONResponse | str:
-    result = {}
-    followers_list = []
-    followings_list = []
-    try:
-        response.headers["Api-Key"] = "tests"
+    id: int, session: SessionDep, replica: ReadSessionDep, me: CurrentUser
+) -> ORJSONResponse:
+    async with replica.begin():
+        result = await service.get_user_profile(replica, user_id=id)
+    if result is None:
         async with session.begin():
-            user = await session.execute(
-                select(models.User).where(models.User.id == id)
-            )
+            result = await service.get_user_profile(session, user_id=id)
 
-            user_ = user.fetchone()
-            if user_ is not None:
-                user_id = user_[0].id
-                user_name = user_[0].name
-
-                followers = await session.execute(
-                    select(models.Follower).where(models.Follower.users_id == user_[0].id)
-                )
-                followers_ = followers.fetchall()
-                if followers_ is not None:
-                    for follower in followers_:
-                        followers_list.append(
-                            {"id": follower[0].id_in_users, "name": follower[0].name}
-                        )
-
-                followings = await session.execute(
-                    select(models.Follower).where(models.Follower.name == user_[0].name)
-                )
+    if result is None:
+        raise ApiError(404, "NotFound", "User not found")
 
-                followings_ = followings.fetchall()
-                if followings_ is not None:
-                    for following_user_ in followings_:
-
-                        following_user = await session.execute(
-                                select(models.User).where(
-                                    models.User.id == following_user_[0].users_id
-                                )
-                            )
-                        follow_user = following_user.fetchone()
-                        if follow_user is not None:
-
-                            followings_list.append(
-                                {
-                                    "id": follow_user[0].id,
-                                    "name": follow_user[0].name,
-                                }
-                            )
-        result = {
-            "id": user_id,
-            "name": user_name,
-            "followers": followers_list,
-            "following": followings_list,
-        }
-
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=200,
         content={"result": True, "user": result},
     )
 
 
+@app.get(
+    "/api/users/{id}/{direction}",
+    response_model=schemas.UserListOut,
+    responses={400: {"model": schemas.ErrorOut}},
+)
+async def get_follow_list(
+    id: int,
+    direction: Literal["followers", "following"],
+    replica: ReadSessionDep,
+    me: CurrentUser,
+    limit: Annotated[int, Query(ge=1, le=pagination.MAX_PAGE_SIZE)] = (
+        pagination.DEFAULT_PAGE_SIZE
+    ),
+    before_id: str | None = None,
+) -> ORJSONResponse:
+    try:
+        before = pagination.decode_id_cursor(before_id)
+    except ValueError as exc:
+        raise ApiError(400, "InvalidCursor", str(exc)) from None
+    async with replica.begin():
+        users, next_cursor = await service.get_follow_list(
+            replica, user_id=id, direction=direction, limit=limit, before_id=before
+        )
+
+    return ORJSONResponse(
+        status_code=200,
+        content={"result": True, "users": users, "next_cursor": next_cursor},
+    )
+
+
+@app.get(
+    "/api/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        503: {"model": schemas.ErrorOut},
+    },
+)
+async def stream_events(me: StreamUser) -> StreamingResponse:
+    # Server-sent events: "tweet" for a new tweet in the home timeline (the
+    # shape of a timeline item), "like_count" for a new total of a tweet in
+    # it. "evicted" ends a stream that fell behind; the client then reloads
+    # the timeline and reconnects.
+    if hub.connections >= hub.max_connections:
+        raise ApiError(503, "TooManyStreams", "Too many open streams, retry later")
+    if hub.closing:
+        raise ApiError(503, "ShuttingDown", "The server is shutting down, retry later")
+
+    async def events():
+        with hub.subscribe(me.id) as subscriber:
+            yield b"retry: 3000\n\n" + sse_event("ready", {"user_id": me.id})
+            while True:
+                event = await subscriber.next(settings.push_heartbeat_seconds)
+                yield event
+                if event is EVICTED:
+                    return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # No buffering in nginx, events go out as they come.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/stream/stats")
+async def get_stream_stats(me: CurrentUser) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=200,
+        content={"result": True, "stream": hub.snapshot()},
+    )
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats(me: CurrentUser) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=200,
+        content={"result": True, "timeline": timeline_cache.snapshot()},
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    content, media_type = metrics.render()
+    return Response(content=content, media_type=media_type)
+
+
+@app.get("/api/db/pool/stats")
+async def get_pool_stats(me: CurrentUser) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=200,
+        content={"result": True, "pool": pool_stats(), "replicas": replicas.snapshot()},
+    )
+
 
 @app.post(
     "/api/medias",
     response_model=schemas.MediaOut,
-    responses={404: {"model": schemas.ErrorOut}},
+    responses={415: {"model": schemas.ErrorOut}},
 )
 async def create_media(
-    file: UploadFile, session: SessionDep
-):
-
-    file_body = await file.read()
-    try:
-        media = await service.create_media(  # тут описываете логику создания картинки
-            session, file_name=file.filename, file_body=file_body    # type: ignore[arg-type]
+    file: UploadFile, session: SessionDep, me: CurrentUser
+) -> ORJSONResponse:
+
+    content_type = await asyncio.to_thread(detect_image_type, file.file)
+    if content_type is None:
+        raise ApiError(
+            415,
+            "UnsupportedMediaType",
+            "Only JPEG, PNG, GIF and WebP images are accepted",
         )
+    media_id, blob = await service.create_media(  # тут логика создания картинки
+        session,
+        file_name=file.filename,  # type: ignore[arg-type]
+        content_type=content_type,
+        chunks=iter_chunks(file),
+    )
+    derivatives.schedule(blob.content_hash, blob.path)
 
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
-
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=201,
-        content={"result": True, "media_id": media.id},
+        content={"result": True, "media_id": media_id},
     )
 
 
@@ -652,23 +678,23 @@ async def create_media(
     response_model=None,
 )
 async def get_media(
-    media_id: int, session: SessionDep
-) -> Response | str:
-
-    try:
-        media = await service.get_media_by_id(session, media_id)
-    except Exception:
-        exc_type, exc_value, _ = sys.exc_info()
-        if exc_type:
-            errors = {
-                "result": False,
-                "error_type": exc_type.__name__,
-                "error_message": str(exc_value),
-            }
-            return json.dumps(errors)
+    media_id: int,
+    request: Request,
+    session: SessionDep,
+    replica: ReadSessionDep,
+    variant: Optional[VariantName] = None,
+) -> Response:
+    media = await service.get_media_by_id(replica, media_id, variant=variant)
+    if not media or media.fallback:
+        # Just uploaded or rendered, not replicated yet.
+        media = await service.get_media_by_id(session, media_id, variant=variant)
 
     if not media:
-        error = {"result": False, "message": "Media not found"}
-        return json.dumps(error)
-
-    return Response(content=media.file_body, media_type="image/webp")
+        raise ApiError(404, "NotFound", "Media not found")
+
+    is_image = (media.content_type or "").startswith("image/")
+    if media.fallback and media.original_path is not None and is_image:
+        # Rendering was lost (restart) or is still running; the original is
+        # served meanwhile.
+        derivatives.schedule(media.original_hash, media.original_path)
+    return await media_response(request, media)
@@ -1,8 +1,11 @@
 from typing import List, Optional
 
-from fastapi import UploadFile
 from pydantic import BaseModel
 
+# The *Out models describe the payloads for the OpenAPI schema. Handlers
+# return ORJSONResponse directly, so FastAPI does not validate and re-encode
+# the plain dicts they are built from.
+
 
 class User(BaseModel):
     name: str
@@ -31,97 +34,84 @@ class TweetUpdate(BaseModel):
 class TweetUpdateIn(TweetUpdate): ...
 
 
-class TweetUpdateOut(TweetUpdate):
-    id: int
-    tweet_data: str
-    tweet_media_ids: List[int]
-
-    class Config:
-        from_attributes = True
-
-
 class TweetIn(Tweet): ...
 
 
-class TweetOut(Tweet):
-    id: int
-    tweet_data: str
-    tweet_media_ids: Optional[List[int]] = None
-
-    class Config:
-        from_attributes = True
+class ResultOut(BaseModel):
+    result: bool = True
 
 
-class Like(BaseModel):
-    name: str
+class ErrorOut(BaseModel):
+    result: bool = False
+    error_type: str
+    error_message: str
 
 
-class LikeIn(Like): ...
+class TweetCreatedOut(ResultOut):
+    tweet_id: int
 
 
-class LikeOut(Like):
+class UserRef(BaseModel):
     id: int
     name: str
 
-    class Config:
-        from_attributes = True
-
-
-class Follower(BaseModel): ...
 
-
-class FollowerIn(Follower): ...
-
-
-class FollowerOut(Follower):
-    id: int
+class LikeRef(BaseModel):
+    user_id: int
     name: str
 
-    class Config:
-        from_attributes = True
-
-
-class Attachment(BaseModel):
-    attachments: Optional[str] = None
 
-
-class AttachmentIn(Attachment): ...
+class TimelineTweetOut(BaseModel):
+    id: int
+    content: str
+    attachments: List[str]
+    thumbnails: List[str]
+    author: UserRef
+    like_count: int
+    # Only the reader's own like, see service.get_timeline.
+    likes: List[LikeRef]
 
 
-class AttachmentOut(Attachment):
-    id: int
-    attachments: Optional[str] = None
+class TimelineOut(ResultOut):
+    tweets: List[TimelineTweetOut]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
-    class Config:
-        from_attributes = True
 
+class SearchOut(ResultOut):
+    tweets: List[TimelineTweetOut]
+    next_cursor: Optional[str] = None
 
-class TweetMedia(BaseModel):
-    file: UploadFile
 
+class TrendOut(BaseModel):
+    tag: str
+    count: int
 
-class TweetMediaIn(TweetMedia): ...
 
+class TrendsOut(ResultOut):
+    trends: List[TrendOut]
+    window_seconds: int
 
-class TweetMediaOut(TweetMedia):
-    id: int
 
-    class Config:
-        from_attributes = True
+class UserProfile(UserRef):
+    # The newest service.PROFILE_LIST_SIZE of each, see UserListOut.
+    followers: List[UserRef]
+    following: List[UserRef]
 
 
-class ErrorOut(BaseModel):
-    status: int = 404
-    reason: str = "Error"
-    details: str | None = None
+class UserProfileOut(ResultOut):
+    user: UserProfile
 
 
-class MediaIn(BaseModel):
-    file: UploadFile
+class UserListOut(ResultOut):
+    users: List[UserRef]
+    next_cursor: Optional[str] = None
 
 
-class MediaOut(MediaIn):
+class MediaOut(ResultOut):
     media_id: int
 
-    class Config:
-        from_attributes = True
+
+class ApiKeyOut(ResultOut):
+    key_id: int
+    api_key: str
@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import asyncpg
+import tags
+from settings import settings
+from sqlalchemy.engine import make_url
+
+WORDS = (
+    "the a of and to in is it for on with as at by this that from new day "
+    "time people today good love work life home city music game news team "
+    "world coffee weekend photo trip book movie code release update night "
+    "morning python postgres fast slow great friends family"
+).split()
+HASHTAGS = ["python", "fastapi", "postgres", "music", "travel", "news", "coffee"]
+SEQUENCES = {
+    "users": "user_id_seq",
+    "followers": "follower_id_seq",
+    "tweets": "tweets_id_seq",
+    "likes": "likes_id_seq",
+    "medias": "medias_id_seq",
+}
+
+
+@dataclass(frozen=True)
+class Plan:
+    dsn: str
+    seed: int
+    users: int
+    follows_per_user: int
+    follow_skew: float
+    tweets_per_user: int
+    likes_per_tweet: int
+    like_skew: float
+    media_ratio: float
+    batch_size: int
+    timelines: int = 0
+    media: Optional[Tuple[str, int, str]] = None
+
+    @property
+    def tweets(self) -> int:
+        return self.users * self.tweets_per_user
+
+    # Row ids are fixed slots (follows of user u start at (u - 1) * max), so
+    # any batch can be generated on its own, in any process, in any order.
+    @property
+    def max_follows(self) -> int:
+        return 2 * self.follows_per_user
+
+    @property
+    def max_likes(self) -> int:
+        return 2 * self.likes_per_tweet
+
+
+def skewed(rng: random.Random, size: int, skew: float) -> int:
+    # With skew > 1 low ids collect most edges, like celebrities do.
+    return int(size * rng.random() ** skew) + 1
+
+
+def tweet_text(rng: random.Random, users: int) -> str:
+    words = rng.choices(WORDS, k=rng.randint(4, 16))
+    if rng.random() < 0.2:
+        words.append("#" + rng.choice(HASHTAGS))
+    if rng.random() < 0.1:
+        words.insert(0, f"@user{rng.randint(1, users)}")
+    return " ".join(words)
+
+
+def user_rows(plan: Plan, start: int, stop: int) -> Iterator[Tuple[Any, ...]]:
+    for user_id in range(start, stop):
+        yield user_id, f"user{user_id}"
+
+
+def follow_rows(plan: Plan, start: int, stop: int) -> Iterator[Tuple[Any, ...]]:
+    rng = random.Random(f"{plan.seed}:followers:{start}")
+    for user_id in range(start, stop):
+        count = rng.randint(0, plan.max_follows)
+        followees = {skewed(rng, plan.users, plan.follow_skew) for _ in range(count)}
+        followees.discard(user_id)
+        first = (user_id - 1) * plan.max_follows + 1
+        for slot, followee in enumerate(sorted(followees)):
+            # users_id is the followee, id_in_users and name the follower.
+            yield first + slot, followee, f"user{user_id}", user_id
+
+
+def tweet_batch(plan: Plan, start: int, stop: int) -> Dict[str, List[Tuple[Any, ...]]]:
+    rng = random.Random(f"{plan.seed}:tweets:{start}")
+    tweets, likes, medias = [], [], []
+    hashtags: List[Tuple[Any, ...]] = []
+    mentions: List[Tuple[Any, ...]] = []
+    for tweet_id in range(start, stop):
+        author = skewed(rng, plan.users, 1.5)
+        likers = {
+            skewed(rng, plan.users, plan.like_skew)
+            for _ in range(rng.randint(0, plan.max_likes))
+        }
+        first = (tweet_id - 1) * plan.max_likes + 1
+        for slot, liker in enumerate(sorted(likers)):
+            likes.append((first + slot, tweet_id, f"user{liker}", liker))
+        media_ids = None
+        if plan.media is not None and rng.random() < plan.media_ratio:
+            # One attachment per tweet, sharing the tweet's id.
+            content_hash, size, path = plan.media
+            medias.append(
+                (tweet_id, "seed.png", content_hash, size, "image/png", path, tweet_id)
+            )
+            media_ids = [tweet_id]
+        text = tweet_text(rng, plan.users)
+        tweets.append((tweet_id, author, text, media_ids, len(likers)))
+        # What service.index_tweet_tags would have written, dated like the
+        # backfill of existing tweets; seeded names are user{id}.
+        hashtags.extend(
+            (tag, tweet_id, tags.BACKFILLED_AT) for tag in tags.hashtags(text)
+        )
+        mentions.extend((int(name[4:]), tweet_id) for name in tags.mentions(text))
+    return {
+        "tweets": tweets,
+        "medias": medias,
+        "likes": likes,
+        "tweet_hashtags": hashtags,
+        "tweet_mentions": mentions,
+    }
+
+
+COLUMNS = {
+    "users": ["id", "name"],
+    "followers": ["id", "users_id", "name", "id_in_users"],
+    "tweets": ["id", "author_id", "tweet_data", "tweet_media_ids", "like_count"],
+    "medias": [
+        "id",
+        "file_name",
+        "content_hash",
+        "size",
+        "content_type",
+        "storage_path",
+        "tweet_id",
+    ],
+    "likes": ["id", "tweets_id", "name", "id_in_users"],
+    "tweet_hashtags": ["tag", "tweet_id", "created_at"],
+    "tweet_mentions": ["user_id", "tweet_id"],
+}
+
+# Home timelines of readers start..stop as fan-out on write would have left
+# them, limited to the latest tweets of each followee: a celebrity's whole
+# history times all its followers would dwarf every other table.
+TIMELINES = """
+    INSERT INTO timelines (user_id, tweet_id, author_id)
+    SELECT f.id_in_users, t.id, t.author_id
+    FROM followers f
+    CROSS JOIN LATERAL (
+        SELECT id, author_id FROM tweets WHERE author_id = f.users_id
+        ORDER BY id DESC LIMIT $3
+    ) t
+    WHERE f.id_in_users >= $1 AND f.id_in_users < $2
+    UNION ALL
+    SELECT author_id, id, author_id FROM tweets
+    WHERE author_id >= $1 AND author_id < $2
+"""
+
+
+async def _copy(plan: Plan, kind: str, start: int, stop: int) -> Dict[str, int]:
+    connection = await asyncpg.connect(plan.dsn)
+    try:
+        if kind == "timelines":
+            status = await connection.execute(TIMELINES, start, stop, plan.timelines)
+            return {"timelines": int(status.split()[-1])}
+        if kind == "users":
+            tables = {"users": list(user_rows(plan, start, stop))}
+        elif kind == "followers":
+            tables = {"followers": list(follow_rows(plan, start, stop))}
+        else:
+            # In FK order: the other tables point at the tweets of the batch.
+            tables = tweet_batch(plan, start, stop)
+        for table, records in tables.items():
+            if records:
+                await connection.copy_records_to_table(
+                    table, records=records, columns=COLUMNS[table]
+                )
+    finally:
+        await connection.close()
+    return {table: len(records) for table, records in tables.items()}
+
+
+def copy_batch(plan: Plan, kind: str, start: int, stop: int) -> Dict[str, int]:
+    return asyncio.run(_copy(plan, kind, start, stop))
+
+
+def batches(total: int, size: int) -> Iterator[Tuple[int, int]]:
+    for start in range(1, total + 1, size):
+        yield start, min(start + size, total + 1)
+
+
+def run_phase(
+    pool: ProcessPoolExecutor, plan: Plan, kind: str, total: int
+) -> Dict[str, int]:
+    started = time.monotonic()
+    futures = [
+        pool.submit(copy_batch, plan, kind, start, stop)
+        for start, stop in batches(total, plan.batch_size)
+    ]
+    counts: Dict[str, int] = {}
+    for future in futures:
+        for table, count in future.result().items():
+            counts[table] = counts.get(table, 0) + count
+    elapsed = time.monotonic() - started
+    for table, count in counts.items():
+        print(f"{table}: {count} rows, {count / elapsed:,.0f} rows/s")
+    return counts
+
+
+async def prepare(dsn: str, truncate: bool) -> None:
+    connection = await asyncpg.connect(dsn)
+    try:
+        if truncate:
+            await connection.execute(
+                "TRUNCATE users, api_keys, followers, tweets, likes, medias,"
+                " media_variants, timelines, tweet_hashtags, tweet_mentions,"
+                " hashtag_counts CASCADE"
+            )
+        elif await connection.fetchval("SELECT EXISTS (SELECT FROM users)"):
+            raise SystemExit("users is not empty, pass --truncate to replace it")
+    finally:
+        await connection.close()
+
+
+async def finish(dsn: str, api_key_prefix: Optional[str]) -> None:
+    connection = await asyncpg.connect(dsn)
+    try:
+        for table, sequence in SEQUENCES.items():
+            await connection.execute(
+                f"SELECT setval('{sequence}', GREATEST((SELECT max(id) FROM {table}), 1))"
+            )
+        if api_key_prefix is not None:
+            await connection.execute(
+                "INSERT INTO api_keys (user_id, key_hash)"
+                " SELECT id, encode(sha256(convert_to($1 || id, 'UTF8')), 'hex')"
+                " FROM users",
+                api_key_prefix,
+            )
+        await connection.execute("ANALYZE")
+    finally:
+        await connection.close()
+
+
+async def placeholder_media() -> Tuple[str, int, str]:
+    from PIL import Image
+    from storage import get_storage
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 600), "teal").save(buffer, "PNG")
+    blob = await get_storage().save(buffer.getvalue())
+    return blob.content_hash, blob.size, blob.path
+
+
+def seed(
+    plan: Plan,
+    jobs: int,
+    truncate: bool = False,
+    api_key_prefix: Optional[str] = None,
+) -> Dict[str, int]:
+    asyncio.run(prepare(plan.dsn, truncate))
+    counts: Dict[str, int] = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Users first: followers and tweets reference them.
+        counts.update(run_phase(pool, plan, "users", plan.users))
+        counts.update(run_phase(pool, plan, "followers", plan.users))
+        counts.update(run_phase(pool, plan, "tweets", plan.tweets))
+        if plan.timelines:
+            counts.update(run_phase(pool, plan, "timelines", plan.users))
+    asyncio.run(finish(plan.dsn, api_key_prefix))
+    return counts
+
+
+def asyncpg_dsn(url: str) -> str:
+    return make_url(url).set(drivername="postgresql").render_as_string(False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Fill an empty database with a synthetic social graph "
+        "using COPY. The same --seed gives the same rows."
+    )
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--follows-per-user", type=int, default=50)
+    parser.add_argument("--follow-skew", type=float, default=3.0)
+    parser.add_argument("--tweets-per-user", type=int, default=20)
+    parser.add_argument("--likes-per-tweet", type=int, default=5)
+    parser.add_argument("--like-skew", type=float, default=1.0)
+    parser.add_argument("--media-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument(
+        "--timelines",
+        type=int,
+        default=0,
+        help="materialize home timelines with the latest N tweets of each followee",
+    )
+    parser.add_argument(
+        "--api-key-prefix", help="give every user the api-key <prefix><id>"
+    )
+    parser.add_argument("--truncate", action="store_true")
+    args = parser.parse_args()
+
+    media = asyncio.run(placeholder_media()) if args.media_ratio > 0 else None
+    plan = Plan(
+        dsn=asyncpg_dsn(settings.database_url),
+        seed=args.seed,
+        users=args.users,
+        follows_per_user=args.follows_per_user,
+        follow_skew=args.follow_skew,
+        tweets_per_user=args.tweets_per_user,
+        likes_per_tweet=args.likes_per_tweet,
+        like_skew=args.like_skew,
+        media_ratio=args.media_ratio,
+        batch_size=args.batch_size,
+        timelines=args.timelines,
+        media=media,
+    )
+    started = time.monotonic()
+    counts = seed(plan, args.jobs, args.truncate, args.api_key_prefix)
+    total = sum(counts.values())
+    print(f"{total} rows in {time.monotonic() - started:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
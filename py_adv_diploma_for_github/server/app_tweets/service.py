@@ -1,23 +1,660 @@
-from models import Media
-from sqlalchemy import LargeBinary, select
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import pagination
+import tags
+from models import (
+    SEARCH_CONFIG,
+    Follower,
+    HashtagCount,
+    Like,
+    Media,
+    MediaVariant,
+    TimelineEntry,
+    Tweet,
+    TweetHashtag,
+    TweetMention,
+    User,
+    search_vector,
+)
+from sqlalchemy import (
+    JSON,
+    Float,
+    String,
+    and_,
+    case,
+    cast,
+    delete,
+    exists,
+    func,
+    literal,
+    literal_column,
+    select,
+    text,
+    true,
+    tuple_,
+    union,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement, Select
+from storage import StoredBlob, get_storage
+from tags import TagUse
+
+# How many of the followed user's latest tweets land in a new follower's feed.
+TIMELINE_BACKFILL = 200
+# How many of the newest matching tweets a search ranks.
+SEARCH_CANDIDATES = 2000
+# Followers and followings embedded in a profile, newest follow first; the
+# rest are paged through get_follow_list.
+PROFILE_LIST_SIZE = 100
 
 
-async def create_media(session: AsyncSession, file_name: str, file_body: LargeBinary):
-    new_media = Media(file_body=file_body, file_name=file_name)
+async def create_media(
+    session: AsyncSession,
+    file_name: str,
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+) -> Tuple[int, StoredBlob]:
+    # The blob is stored before its row exists: a failure can leave an
+    # unreferenced blob behind, never a row pointing at a missing one.
+    # Identical files share one blob in the content-addressed storage, but
+    # every upload gets its own row: a row belongs to the one tweet that
+    # attaches it and goes away with that tweet.
+    blob = await get_storage().save_stream(chunks)
     async with session.begin():
+        new_media = Media(
+            file_name=file_name,
+            content_hash=blob.content_hash,
+            size=blob.size,
+            content_type=content_type,
+            storage_path=blob.path,
+        )
         session.add(new_media)
-        await session.commit()
+        await session.flush()
+        media_id = new_media.id
 
-    return new_media
+    return media_id, blob
 
 
-async def get_media_by_id(session: AsyncSession, media_id: int):
-
+async def get_media_by_id(
+    session: AsyncSession, media_id: int, variant: Optional[str] = None
+) -> Optional[Row]:
+    # Metadata only; the inline body is read just for rows that have not been
+    # moved to the storage yet. A requested variant replaces the original's
+    # fields once it has been rendered, "fallback" tells it has not.
+    if variant is None:
+        fields: Tuple[ColumnElement, ...] = (
+            Media.storage_path,
+            Media.content_type,
+            Media.content_hash,
+            Media.size,
+            Media.created_at,
+            literal(False).label("fallback"),
+        )
+    else:
+        fields = (
+            func.coalesce(MediaVariant.storage_path, Media.storage_path).label(
+                "storage_path"
+            ),
+            func.coalesce(MediaVariant.content_type, Media.content_type).label(
+                "content_type"
+            ),
+            func.coalesce(MediaVariant.variant_hash, Media.content_hash).label(
+                "content_hash"
+            ),
+            func.coalesce(MediaVariant.size, Media.size).label("size"),
+            func.coalesce(MediaVariant.created_at, Media.created_at).label(
+                "created_at"
+            ),
+            MediaVariant.variant.is_(None).label("fallback"),
+        )
+    query = select(
+        *fields,
+        Media.content_hash.label("original_hash"),
+        Media.storage_path.label("original_path"),
+        case((Media.storage_path.is_(None), Media.file_body)).label("file_body"),
+    ).where(Media.id == media_id)
+    if variant is not None:
+        query = query.outerjoin(
+            MediaVariant,
+            and_(
+                MediaVariant.content_hash == Media.content_hash,
+                MediaVariant.variant == variant,
+            ),
+        )
     async with session.begin():
-        media = await session.execute(select(Media).where(Media.id == media_id))
+        result = await session.execute(query)
+        return result.first()
+
+
+async def delete_tweet(
+    session: AsyncSession, tweet_id: int, author_id: int
+) -> Optional[Tuple[List[int], List[TagUse]]]:
+    # Dependent rows are removed with set-based deletes instead of an ORM
+    # cascade, which would have to load every like of the tweet first.
+    # Returns the users whose timelines held the tweet and the hashtag uses
+    # taken back, None if not owned.
+    owned = await session.execute(
+        select(Tweet.id).where(Tweet.id == tweet_id, Tweet.author_id == author_id)
+    )
+    if owned.first() is None:
+        return None
+
+    readers = await remove_from_timelines(session, tweet_id=tweet_id)
+    removed = await session.execute(
+        delete(TweetHashtag)
+        .where(TweetHashtag.tweet_id == tweet_id)
+        .returning(TweetHashtag.tag, TweetHashtag.created_at)
+    )
+    removed_tags = [(tag, created_at) for tag, created_at in removed]
+    for dependent in (
+        delete(TweetMention).where(TweetMention.tweet_id == tweet_id),
+        delete(Like).where(Like.tweets_id == tweet_id),
+        delete(Media).where(Media.tweet_id == tweet_id),
+        delete(Tweet).where(Tweet.id == tweet_id),
+    ):
+        await session.execute(dependent.execution_options(synchronize_session=False))
+    return readers, removed_tags
+
+
+async def index_tweet_tags(
+    session: AsyncSession, tweet_id: int, text: str, old_text: Optional[str] = None
+) -> Tuple[List[TagUse], List[TagUse]]:
+    # Keeps tweet_hashtags and tweet_mentions in step with the text of the
+    # tweet. Only the difference to old_text is written, so an edit that
+    # leaves the tags alone costs no statement. Returns the hashtag uses
+    # added and removed, for counters.TrendCounter.
+    new_tags = tags.hashtags(text)
+    old_tags = tags.hashtags(old_text) if old_text is not None else []
+    added: List[TagUse] = []
+    removed: List[TagUse] = []
+    gone = [tag for tag in old_tags if tag not in new_tags]
+    if gone:
+        result = await session.execute(
+            delete(TweetHashtag)
+            .where(TweetHashtag.tweet_id == tweet_id, TweetHashtag.tag.in_(gone))
+            .returning(TweetHashtag.tag, TweetHashtag.created_at)
+        )
+        removed = [(tag, created_at) for tag, created_at in result]
+    new = [tag for tag in new_tags if tag not in old_tags]
+    if new:
+        result = await session.execute(
+            insert(TweetHashtag)
+            .values([{"tag": tag, "tweet_id": tweet_id} for tag in new])
+            .on_conflict_do_nothing()
+            .returning(TweetHashtag.tag, TweetHashtag.created_at)
+        )
+        added = [(tag, created_at) for tag, created_at in result]
+
+    names = tags.mentions(text)
+    old_names = tags.mentions(old_text) if old_text is not None else []
+    if set(names) != set(old_names):
+        if old_names:
+            await session.execute(
+                delete(TweetMention).where(TweetMention.tweet_id == tweet_id)
+            )
+        if names:
+            # Names are not unique: every user of a mentioned name is listed.
+            mentioned = select(User.id, literal(tweet_id)).where(User.name.in_(names))
+            await session.execute(
+                insert(TweetMention)
+                .from_select(["user_id", "tweet_id"], mentioned)
+                .on_conflict_do_nothing()
+            )
+    return added, removed
+
+
+async def fan_out_tweet(
+    session: AsyncSession, tweet_id: int, author_id: int
+) -> List[int]:
+    readers = union(
+        select(Follower.id_in_users, literal(tweet_id), literal(author_id)).where(
+            Follower.users_id == author_id
+        ),
+        select(literal(author_id), literal(tweet_id), literal(author_id)),
+    )
+    result = await session.execute(
+        insert(TimelineEntry)
+        .from_select(["user_id", "tweet_id", "author_id"], readers)
+        .on_conflict_do_nothing()
+        .returning(TimelineEntry.user_id)
+    )
+    return list(result.scalars())
+
+
+async def add_like(
+    session: AsyncSession, tweet_id: int, user_id: int, user_name: str
+) -> bool:
+    # One INSERT ... SELECT keyed on ids: the unique (tweets_id, id_in_users)
+    # constraint makes it idempotent and existing likes are never loaded.
+    liker = select(literal(tweet_id), literal(user_name), literal(user_id)).where(
+        exists().where(Tweet.id == tweet_id)
+    )
+    result = await session.execute(
+        insert(Like)
+        .from_select(["tweets_id", "name", "id_in_users"], liker)
+        .on_conflict_do_nothing(constraint="uq_likes_tweets_id_id_in_users")
+        .returning(Like.id)
+    )
+    return result.first() is not None
+
+
+async def delete_like(session: AsyncSession, tweet_id: int, user_id: int) -> bool:
+    result = await session.execute(
+        delete(Like)
+        .where(Like.tweets_id == tweet_id, Like.id_in_users == user_id)
+        .returning(Like.id)
+    )
+    return result.first() is not None
+
+
+async def add_follow(
+    session: AsyncSession,
+    user_id: int,
+    follower_id: int,
+    follower_name: str,
+    backfill: int = TIMELINE_BACKFILL,
+) -> bool:
+    # The follow edge and the backfill of the new follower's timeline are
+    # written by one statement (data-modifying CTEs), so the cost does not
+    # depend on how many followers the user already has.
+    new_follow = (
+        insert(Follower)
+        .from_select(
+            ["users_id", "name", "id_in_users"],
+            select(User.id, literal(follower_name), literal(follower_id)).where(
+                User.id == user_id
+            ),
+        )
+        .on_conflict_do_nothing(constraint="uq_followers_users_id_id_in_users")
+        .returning(Follower.users_id, Follower.id_in_users)
+        .cte("new_follow")
+    )
+    latest = (
+        select(new_follow.c.id_in_users, Tweet.id, Tweet.author_id)
+        .join(Tweet, Tweet.author_id == new_follow.c.users_id)
+        .order_by(Tweet.id.desc())
+        .limit(backfill)
+    )
+    backfilled = (
+        insert(TimelineEntry)
+        .from_select(["user_id", "tweet_id", "author_id"], latest)
+        .on_conflict_do_nothing()
+        .cte("backfill")
+    )
+    result = await session.execute(select(new_follow.c.users_id).add_cte(backfilled))
+    return result.first() is not None
+
+
+async def delete_follow(session: AsyncSession, user_id: int, follower_id: int) -> bool:
+    removed = (
+        delete(Follower)
+        .where(Follower.users_id == user_id, Follower.id_in_users == follower_id)
+        .returning(Follower.users_id, Follower.id_in_users)
+        .cte("removed")
+    )
+    pruned = (
+        delete(TimelineEntry)
+        .where(
+            TimelineEntry.user_id == removed.c.id_in_users,
+            TimelineEntry.author_id == removed.c.users_id,
+        )
+        .cte("pruned")
+    )
+    result = await session.execute(select(removed.c.users_id).add_cte(pruned))
+    return result.first() is not None
+
+
+async def remove_from_timelines(session: AsyncSession, tweet_id: int) -> List[int]:
+    result = await session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.tweet_id == tweet_id)
+        .returning(TimelineEntry.user_id)
+    )
+    return list(result.scalars())
+
+
+async def tweet_readers(session: AsyncSession, tweet_id: int) -> List[int]:
+    result = await session.execute(
+        select(TimelineEntry.user_id).where(TimelineEntry.tweet_id == tweet_id)
+    )
+    return list(result.scalars())
+
+
+async def like_counts(session: AsyncSession, tweet_ids: List[int]) -> Dict[int, int]:
+    # Counts are not part of the timeline cache versioning (a like would
+    # otherwise invalidate every reader of the tweet); cached pages take the
+    # current values from this primary key lookup.
+    if not tweet_ids:
+        return {}
+    result = await session.execute(
+        select(Tweet.id, Tweet.like_count).where(Tweet.id.in_(tweet_ids))
+    )
+    return {tweet_id: like_count for tweet_id, like_count in result}
+
+
+def _attachments_column():
+    media = (
+        func.unnest(Tweet.tweet_media_ids)
+        .table_valued("media_id", with_ordinality="position")
+        .render_derived()
+    )
+    urls = select(
+        func.array_agg(
+            aggregate_order_by(
+                literal("/api/medias/") + cast(media.c.media_id, String),
+                media.c.position,
+            )
+        )
+    ).scalar_subquery()
+    return func.coalesce(urls, cast(literal_column("'{}'"), ARRAY(String)))
+
+
+def _json_list(item, order_by, query: Select) -> ColumnElement:
+    # Correlated subquery folding the matching rows into a JSON array.
+    items = query.with_only_columns(
+        func.json_agg(aggregate_order_by(item, order_by))
+    ).scalar_subquery()
+    return func.coalesce(items, cast(literal_column("'[]'"), JSON), type_=JSON)
+
+
+def _likes_column(reader_id: int) -> ColumnElement:
+    # Only the reader's own like is listed (one unique-index probe); the total
+    # comes from the denormalized tweets.like_count.
+    return _json_list(
+        func.json_build_object("user_id", Like.id_in_users, "name", Like.name),
+        Like.id,
+        select(Like).where(Like.tweets_id == Tweet.id, Like.id_in_users == reader_id),
+    )
+
+
+def _tweet_columns(reader_id: int) -> Tuple[ColumnElement, ...]:
+    return (
+        Tweet.id,
+        Tweet.tweet_data,
+        _attachments_column(),
+        User.id,
+        User.name,
+        Tweet.like_count,
+        _likes_column(reader_id),
+    )
+
+
+def _tweet_dict(row: Row) -> Dict[str, Any]:
+    # The shape of schemas.TimelineTweetOut, from a row led by _tweet_columns.
+    tweet_id, content, attachments, author_id, author_name, like_count, likes = row[:7]
+    return {
+        "id": tweet_id,
+        "content": content,
+        "attachments": attachments,
+        # Served as the original until the thumbnail has been rendered.
+        "thumbnails": [f"{url}?variant=thumb" for url in attachments],
+        "author": {"id": author_id, "name": author_name},
+        "like_count": like_count,
+        "likes": likes,
+    }
+
+
+async def _tweet_page(
+    session: AsyncSession,
+    query: Select,
+    sort_key: ColumnElement,
+    limit: int,
+    before_id: Optional[int],
+    after_id: Optional[int],
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    # One keyset page of a query led by _tweet_columns, with its cursors.
+    result = await session.execute(
+        pagination.keyset(query, sort_key, limit, before_id, after_id)
+    )
+    rows, has_more = pagination.page(result.all(), limit, after_id)
+    tweets = [_tweet_dict(row) for row in rows]
+
+    next_cursor = None
+    prev_cursor = None
+    if tweets:
+        prev_cursor = pagination.encode_cursor(tweets[0]["id"])
+        if has_more or after_id is not None:
+            next_cursor = pagination.encode_cursor(tweets[-1]["id"])
+    return tweets, next_cursor, prev_cursor
+
+
+async def get_timeline(
+    session: AsyncSession,
+    reader_id: int,
+    mode: str = "user",
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    # The whole page (attachments URLs, author and likes included) comes back
+    # from one statement as plain rows, without hydrating ORM objects.
+    query = select(*_tweet_columns(reader_id)).join(User, User.id == Tweet.author_id)
+    sort_key: ColumnElement
+    if mode == "home":
+        query = query.join(TimelineEntry, TimelineEntry.tweet_id == Tweet.id).where(
+            TimelineEntry.user_id == reader_id
+        )
+        sort_key = TimelineEntry.tweet_id
+    else:
+        query = query.where(Tweet.author_id == reader_id)
+        sort_key = Tweet.id
+    return await _tweet_page(session, query, sort_key, limit, before_id, after_id)
+
+
+async def get_tweets_by_ids(
+    session: AsyncSession, tweet_ids: List[int]
+) -> List[Dict[str, Any]]:
+    # The same shape as a timeline page for any reader, so the likes list
+    # is left empty.
+    if not tweet_ids:
+        return []
+    result = await session.execute(
+        select(
+            *_tweet_columns(reader_id=0)[:6],
+            cast(literal_column("'[]'"), JSON),
+        )
+        .join(User, User.id == Tweet.author_id)
+        .where(Tweet.id.in_(tweet_ids))
+        .order_by(Tweet.id)
+    )
+    return [_tweet_dict(row) for row in result]
+
+
+async def get_tagged_tweets(
+    session: AsyncSession,
+    reader_id: int,
+    tag: str,
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    # Pages walk the (tag, tweet_id) primary key of tweet_hashtags.
+    query = (
+        select(*_tweet_columns(reader_id))
+        .join(TweetHashtag, TweetHashtag.tweet_id == Tweet.id)
+        .join(User, User.id == Tweet.author_id)
+        .where(TweetHashtag.tag == tag)
+    )
+    return await _tweet_page(
+        session, query, TweetHashtag.tweet_id, limit, before_id, after_id
+    )
+
+
+async def get_mentions(
+    session: AsyncSession,
+    reader_id: int,
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    query = (
+        select(*_tweet_columns(reader_id))
+        .join(TweetMention, TweetMention.tweet_id == Tweet.id)
+        .join(User, User.id == Tweet.author_id)
+        .where(TweetMention.user_id == reader_id)
+    )
+    return await _tweet_page(
+        session, query, TweetMention.tweet_id, limit, before_id, after_id
+    )
+
+
+async def trending_tags(
+    session: AsyncSession, since: datetime, limit: int = 10
+) -> List[Dict[str, Any]]:
+    # Sums the buckets of the window kept by counters.TrendCounter: at most
+    # window / bucket rows per tag, however many tweets used it.
+    uses = func.sum(HashtagCount.uses)
+    result = await session.execute(
+        select(HashtagCount.tag, uses)
+        .where(HashtagCount.bucket >= since)
+        .group_by(HashtagCount.tag)
+        .having(uses > 0)
+        .order_by(uses.desc(), HashtagCount.tag)
+        .limit(limit)
+    )
+    return [{"tag": tag, "count": count} for tag, count in result]
+
+
+async def search_tweets(
+    session: AsyncSession,
+    reader_id: int,
+    query: str,
+    following: bool = False,
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    after: Optional[Tuple[float, int]] = None,
+    candidates: int = SEARCH_CANDIDATES,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # Only the newest matches are ranked. Postgres picks the GIN index for
+    # rare terms and a backward primary key scan, which stops after
+    # `candidates` matches, for common ones: either way the cost does not
+    # grow with the table. Best rank first, newer first among equal ranks;
+    # the cursor is the (rank, id) of the last row, ranks being exact float4.
+    tsquery = func.websearch_to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query
+    )
+    document = search_vector(Tweet.tweet_data)
+    matches = select(Tweet.id).where(document.op("@@")(tsquery))
+    if following:
+        # Per author along (author_id, id): a filter on the author would be
+        # misestimated and walk the primary key of the whole table.
+        authors = union_all(
+            select(Follower.users_id.label("id")).where(
+                Follower.id_in_users == reader_id
+            ),
+            select(literal(reader_id).label("id")),
+        ).subquery()
+        per_author = (
+            matches.where(Tweet.author_id == authors.c.id)
+            .order_by(Tweet.id.desc())
+            .limit(candidates)
+            .lateral()
+        )
+        matches = select(per_author.c.id).select_from(authors.join(per_author, true()))
+    newest = (
+        matches.order_by(matches.selected_columns[0].desc())
+        .limit(candidates)
+        .subquery()
+    )
+
+    # Recomputed for the candidates only, the index does not store vectors.
+    rank = func.ts_rank(document, tsquery, type_=Float)
+    stmt = (
+        select(*_tweet_columns(reader_id), rank)
+        .join(newest, newest.c.id == Tweet.id)
+        .join(User, User.id == Tweet.author_id)
+    )
+    if after is not None:
+        after_rank, after_id = after
+        stmt = stmt.where(
+            tuple_(rank, Tweet.id) < tuple_(literal(after_rank), literal(after_id))
+        )
+    # The plan depends on how common the terms are: a generic plan of the
+    # prepared statement, made for some rare term, would scan all matches of
+    # a common one. Needs the caller's transaction.
+    await session.execute(text("SET LOCAL plan_cache_mode = force_custom_plan"))
+    result = await session.execute(
+        stmt.order_by(rank.desc(), Tweet.id.desc()).limit(limit + 1)
+    )
+    rows, has_more = pagination.page(result.all(), limit)
+    next_cursor = None
+    if has_more:
+        next_cursor = pagination.encode_cursor(rows[-1][-1], rows[-1][0])
+    return [_tweet_dict(row) for row in rows], next_cursor
+
+
+def _follow_query(user_id: int, direction: str) -> Select:
+    # (edge id, user id, name) of the user's followers or followings.
+    if direction == "followers":
+        return select(
+            Follower.id, Follower.id_in_users.label("user_id"), Follower.name
+        ).where(Follower.users_id == user_id)
+    return (
+        select(Follower.id, User.id.label("user_id"), User.name)
+        .join(User, User.id == Follower.users_id)
+        .where(Follower.id_in_users == user_id)
+    )
+
+
+def _follow_list_column(user_id: int, direction: str, limit: int) -> ColumnElement:
+    newest = (
+        _follow_query(user_id, direction)
+        .order_by(Follower.id.desc())
+        .limit(limit)
+        .subquery()
+    )
+    items = select(
+        func.json_agg(
+            aggregate_order_by(
+                func.json_build_object("id", newest.c.user_id, "name", newest.c.name),
+                newest.c.id.desc(),
+            )
+        )
+    ).scalar_subquery()
+    return func.coalesce(items, cast(literal_column("'[]'"), JSON), type_=JSON)
+
+
+async def get_user_profile(
+    session: AsyncSession, user_id: int, list_size: int = PROFILE_LIST_SIZE
+) -> Optional[Dict[str, Any]]:
+    # One statement regardless of the size of the follow graph: both lists
+    # are the newest list_size (id, name) pairs, aggregated next to the user
+    # row along the (users_id, id) and (id_in_users, id) indexes.
+    result = await session.execute(
+        select(
+            User.id,
+            User.name,
+            _follow_list_column(user_id, "followers", list_size),
+            _follow_list_column(user_id, "following", list_size),
+        ).where(User.id == user_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "name": row[1],
+        "followers": row[2],
+        "following": row[3],
+    }
 
-        media_ = media.fetchone()
-        if media_ is not None:
 
-            return media_[0]
+async def get_follow_list(
+    session: AsyncSession,
+    user_id: int,
+    direction: str,
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    before_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # Newest follow first; the cursor is the id of the follow edge.
+    result = await session.execute(
+        pagination.keyset(
+            _follow_query(user_id, direction), Follower.id, limit, before_id
+        )
+    )
+    rows, has_more = pagination.page(result.all(), limit)
+    next_cursor = pagination.encode_cursor(rows[-1][0]) if has_more else None
+    return [{"id": row[1], "name": row[2]} for row in rows], next_cursor
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import AsyncIterator, BinaryIO, Optional
+
+from fastapi import UploadFile
+from settings import settings
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # the S3 backend is optional
+    boto3 = None
+
+# What every media was served as before content types were recorded.
+DEFAULT_MEDIA_TYPE = "image/webp"
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    content_hash: str
+    size: int
+    path: str
+
+
+def blob_path(content_hash: str) -> str:
+    # Two levels of fan-out keep directories (and S3 listings) small.
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"
+
+
+class MediaStorage(ABC):
+    # Content-addressed: a blob's path is derived from its sha256, so saving
+    # the same bytes twice is a no-op and blobs never change once written.
+    # Uploads are spooled chunk by chunk to a temporary file while hashing,
+    # then committed under their final path.
+
+    async def save(self, data: bytes) -> StoredBlob:
+        async def single() -> AsyncIterator[bytes]:
+            yield data
+
+        return await self.save_stream(single())
+
+    async def save_stream(self, chunks: AsyncIterator[bytes]) -> StoredBlob:
+        digest = hashlib.sha256()
+        size = 0
+        directory = self._spool_dir()
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    await asyncio.to_thread(_write_chunk, f, digest, chunk)
+            content_hash = digest.hexdigest()
+            path = blob_path(content_hash)
+            await self._commit(tmp, path)
+        finally:
+            with suppress(FileNotFoundError):
+                os.unlink(tmp)
+        return StoredBlob(content_hash=content_hash, size=size, path=path)
+
+    def _spool_dir(self) -> str:
+        return tempfile.gettempdir()
+
+    @abstractmethod
+    async def _commit(self, tmp: str, path: str) -> None:
+        # Moves the spooled file tmp to path, keeping a blob already stored there.
+        ...
+
+    @abstractmethod
+    async def read(
+        self, path: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> bytes:
+        # start and end are an inclusive byte range, like HTTP Range.
+        ...
+
+    def local_path(self, path: str) -> Optional[str]:
+        # Backends on the local disk expose the file so it can be streamed.
+        return None
+
+
+class LocalFileStorage(MediaStorage):
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+
+    def local_path(self, path: str) -> Optional[str]:
+        return os.path.join(self.root, path)
+
+    def _spool_dir(self) -> str:
+        # Same filesystem as the blobs, so committing is an atomic rename.
+        return os.path.join(self.root, ".uploads")
+
+    async def _commit(self, tmp: str, path: str) -> None:
+        await asyncio.to_thread(self._move, tmp, os.path.join(self.root, path))
+
+    @staticmethod
+    def _move(tmp: str, target: str) -> None:
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp, target)
+
+    async def read(
+        self, path: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> bytes:
+        return await asyncio.to_thread(
+            self._read, os.path.join(self.root, path), start, end
+        )
+
+    @staticmethod
+    def _read(target: str, start: Optional[int], end: Optional[int]) -> bytes:
+        with open(target, "rb") as f:
+            if start is None:
+                return f.read()
+            f.seek(start)
+            return f.read(-1 if end is None else end - start + 1)
+
+
+class S3Storage(MediaStorage):
+    # Any S3-compatible service; point endpoint_url at MinIO to run locally.
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+    ) -> None:
+        if boto3 is None:
+            raise RuntimeError("The s3 media backend requires boto3")
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+
+    async def _commit(self, tmp: str, path: str) -> None:
+        await asyncio.to_thread(self._upload, tmp, path)
+
+    def _upload(self, tmp: str, path: str) -> None:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=path)
+            return
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+        # upload_file switches to a multipart upload for large files.
+        self.client.upload_file(tmp, self.bucket, path)
+
+    async def read(
+        self, path: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> bytes:
+        kwargs = {}
+        if start is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=path, **kwargs
+        )
+        return await asyncio.to_thread(response["Body"].read)
+
+
+def _write_chunk(f: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    # hashlib releases the GIL on large buffers, so both run off the loop.
+    digest.update(chunk)
+    f.write(chunk)
+
+
+async def iter_chunks(
+    file: UploadFile, chunk_size: int = settings.media_chunk_size
+) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> MediaStorage:
+    if settings.media_backend == "s3":
+        return S3Storage(
+            bucket=settings.s3_bucket,
+            endpoint_url=settings.s3_endpoint_url,
+            region=settings.s3_region,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+        )
+    return LocalFileStorage(settings.media_root)
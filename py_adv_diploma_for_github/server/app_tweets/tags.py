@@ -0,0 +1,37 @@
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+
+# Hashtags are matched case-insensitively and need a letter, so "#1" stays
+# plain text; mentions are user names as written.
+HASHTAG = re.compile(r"(?<![\w#])#(\w+)")
+MENTION = re.compile(r"(?<![\w@])@(\w+)")
+MAX_LENGTH = 64
+
+# A hashtag and when its tweet_hashtags row was written.
+TagUse = Tuple[str, datetime]
+
+# created_at of uses indexed after the fact (migration 0008, seed_data).
+# Tweets carry no timestamp to take it from; the epoch keeps these uses out
+# of every trends window, so deleting such a tweet takes nothing back.
+BACKFILLED_AT = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _unique(words: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(word for word in words if len(word) <= MAX_LENGTH))
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.lstrip("#").lower()
+
+
+def hashtags(text: str) -> List[str]:
+    return _unique(
+        tag.lower()
+        for tag in HASHTAG.findall(text)
+        if any(char.isalpha() for char in tag)
+    )
+
+
+def mentions(text: str) -> List[str]:
+    return _unique(MENTION.findall(text))
@@ -0,0 +1,467 @@
+# Load benchmark: seeds a synthetic social graph into a scratch database,
+# boots the server (python main.py) against it and drives a mixed workload
+# at a fixed concurrency. Reports client-side p50/p95/p99 latency and
+# throughput per operation plus server-side SQL statements per request (from
+# /metrics), and writes everything to a JSON file that --compare reads back.
+#
+#     python load.py --database-url postgresql+asyncpg://.../scratch
+#     python load.py --database-url ... --compare results/<previous>.json
+#
+# The database is migrated and all its tables are truncated, then filled by
+# app_tweets/seed_data.py.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "app_tweets"))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+SEARCH_WORDS = ["coffee", "python", "weekend", "music", "release", "friends"]
+# The hashtags of seed_data.HASHTAGS.
+HASHTAGS = ["python", "fastapi", "postgres", "music", "travel", "news", "coffee"]
+DEFAULT_MIX = "home=45,user=10,like=15,follow=5,post=10,media=15"
+
+
+@dataclass
+class Graph:
+    users: List[int]
+    tweets: List[int]
+    medias: List[int]
+    rows: Dict[str, int]
+
+
+@dataclass
+class OpStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def seed(args: argparse.Namespace) -> Graph:
+    import seed_data
+
+    plan = seed_data.Plan(
+        dsn=seed_data.asyncpg_dsn(args.database_url),
+        seed=args.seed,
+        users=args.users,
+        follows_per_user=args.follows_per_user,
+        follow_skew=args.follow_skew,
+        tweets_per_user=args.tweets_per_user,
+        likes_per_tweet=args.likes_per_tweet,
+        like_skew=1.0,
+        media_ratio=args.media_ratio,
+        batch_size=args.seed_batch_size,
+        timelines=args.timelines,
+        media=asyncio.run(seed_data.placeholder_media()),
+    )
+    # Every user gets the api-key load-<id>.
+    rows = seed_data.seed(plan, args.seed_jobs, truncate=True, api_key_prefix="load-")
+    return asyncio.run(graph_of(plan.dsn, rows))
+
+
+async def graph_of(dsn: str, rows: Dict[str, int]) -> Graph:
+    import asyncpg
+
+    connection = await asyncpg.connect(dsn)
+    try:
+
+        async def ids(table: str) -> List[int]:
+            return [
+                row["id"]
+                for row in await connection.fetch(f"SELECT id FROM {table} ORDER BY id")
+            ]
+
+        return Graph(
+            users=await ids("users"),
+            tweets=await ids("tweets"),
+            medias=await ids("medias"),
+            rows=rows,
+        )
+    finally:
+        await connection.close()
+
+
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+def home(rng: random.Random, graph: Graph) -> Request:
+    return "GET", "/api/tweets", {"params": {"mode": "home"}}
+
+
+def user(rng: random.Random, graph: Graph) -> Request:
+    return "GET", "/api/tweets", {"params": {"mode": "user"}}
+
+
+def like(rng: random.Random, graph: Graph) -> Request:
+    return "POST", f"/api/tweets/{rng.choice(graph.tweets)}/likes", {}
+
+
+def follow(rng: random.Random, graph: Graph) -> Request:
+    return "POST", f"/api/users/{rng.choice(graph.users)}/follow", {}
+
+
+def post(rng: random.Random, graph: Graph) -> Request:
+    text = f"load {rng.random()}"
+    if rng.random() < 0.2:
+        text += f" #{rng.choice(HASHTAGS)}"
+    body = {"tweet_data": text, "tweet_media_ids": []}
+    return "POST", "/api/tweets", {"json": body}
+
+
+def media(rng: random.Random, graph: Graph) -> Request:
+    params = {"variant": "thumb"} if rng.random() < 0.8 else {}
+    return "GET", f"/api/medias/{rng.choice(graph.medias)}", {"params": params}
+
+
+def search(rng: random.Random, graph: Graph) -> Request:
+    # Common words of the seeded tweets, or a rare @mention.
+    terms = [*SEARCH_WORDS, f"user{rng.choice(graph.users)}"]
+    params = {"q": " ".join(rng.sample(terms, rng.randint(1, 2)))}
+    if rng.random() < 0.3:
+        params["scope"] = "following"
+    return "GET", "/api/tweets/search", {"params": params}
+
+
+def hashtag(rng: random.Random, graph: Graph) -> Request:
+    return "GET", f"/api/hashtags/{rng.choice(HASHTAGS)}", {}
+
+
+def trends(rng: random.Random, graph: Graph) -> Request:
+    return "GET", "/api/trends", {}
+
+
+OPERATIONS: Dict[str, Callable[[random.Random, Graph], Request]] = {
+    "home": home,
+    "user": user,
+    "like": like,
+    "follow": follow,
+    "post": post,
+    "media": media,
+    "search": search,
+    "hashtag": hashtag,
+    "trends": trends,
+}
+
+
+def failed(response: httpx.Response) -> bool:
+    return response.status_code >= 400
+
+
+async def virtual_user(
+    index: int,
+    args: argparse.Namespace,
+    graph: Graph,
+    deadline: float,
+    warmup_until: float,
+    stats: Dict[str, OpStats],
+) -> None:
+    # Each virtual user is one keep-alive connection acting as a random user
+    # per request. Same seed, same sequence of requests.
+    rng = random.Random(f"{args.seed}-{index}")
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    limits = httpx.Limits(max_connections=1)
+    async with httpx.AsyncClient(
+        base_url=args.target, limits=limits, timeout=30
+    ) as client:
+        while time.monotonic() < deadline:
+            headers = {"api-key": f"load-{rng.choice(graph.users)}"}
+            name = rng.choices(names, weights)[0]
+            method, url, kwargs = OPERATIONS[name](rng, graph)
+            started = time.monotonic()
+            try:
+                response = await client.request(method, url, headers=headers, **kwargs)
+                error = failed(response)
+            except httpx.HTTPError:
+                error = True
+            if started < warmup_until:
+                continue
+            op = stats[name]
+            op.latencies.append(time.monotonic() - started)
+            op.errors += error
+
+
+def percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value, "mean_ms": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+    }
+
+
+async def scrape(target: str) -> Dict[str, Dict[str, float]]:
+    async with httpx.AsyncClient(base_url=target, timeout=30) as client:
+        response = await client.get("/metrics")
+    routes: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for family in text_string_to_metric_families(response.text):
+        if family.name not in ("http_request_db_statements", "http_request_db_seconds"):
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(("_sum", "_count")):
+                suffix = sample.name.rsplit("_", 1)[1]
+                routes[sample.labels["route"]][
+                    f"{family.name}_{suffix}"
+                ] += sample.value
+    return routes
+
+
+def server_side(
+    before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]
+) -> Dict[str, Dict[str, float]]:
+    result = {}
+    for route, values in after.items():
+        if route == "/metrics":
+            continue
+        delta = {
+            key: value - before.get(route, {}).get(key, 0.0)
+            for key, value in values.items()
+        }
+        requests = delta.get("http_request_db_statements_count", 0.0)
+        if requests:
+            result[route] = {
+                "requests": int(requests),
+                "db_statements_per_request": round(
+                    delta["http_request_db_statements_sum"] / requests, 3
+                ),
+                "db_ms_per_request": round(
+                    delta["http_request_db_seconds_sum"] / requests * 1000, 3
+                ),
+            }
+    return result
+
+
+async def drive(args: argparse.Namespace, graph: Graph) -> Dict[str, Any]:
+    before = await scrape(args.target)
+    stats: Dict[str, OpStats] = defaultdict(OpStats)
+    started = time.monotonic()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    await asyncio.gather(
+        *(
+            virtual_user(i, args, graph, deadline, warmup_until, stats)
+            for i in range(args.concurrency)
+        )
+    )
+    elapsed = time.monotonic() - warmup_until
+    after = await scrape(args.target)
+
+    total = sum(len(op.latencies) for op in stats.values())
+    everything = [latency for op in stats.values() for latency in op.latencies]
+    return {
+        "summary": {
+            "requests": total,
+            "errors": sum(op.errors for op in stats.values()),
+            "throughput_rps": round(total / elapsed, 2),
+            **percentiles(everything),
+        },
+        "operations": {
+            name: {
+                "requests": len(op.latencies),
+                "errors": op.errors,
+                "throughput_rps": round(len(op.latencies) / elapsed, 2),
+                **percentiles(op.latencies),
+            }
+            for name, op in sorted(stats.items())
+        },
+        "server": server_side(before, after),
+    }
+
+
+def start_server(args: argparse.Namespace, workdir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url,
+        SERVER_PORT=str(args.port),
+        MEDIA_ROOT=os.path.join(workdir, "media"),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "metrics"),
+    )
+    return subprocess.Popen(
+        [sys.executable, "main.py", "--workers", str(args.workers)],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+
+
+async def wait_ready(target: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=target) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            try:
+                if (await client.get("/metrics")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start in time")
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*command: str) -> str:
+        return subprocess.run(
+            ["git", *command], cwd=BENCH_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain")),
+    }
+
+
+def print_report(result: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    def row_of(data: Dict[str, Any], name: str) -> Dict[str, Any]:
+        return data["summary"] if name == "all" else data["operations"].get(name, {})
+
+    def cell(name: str, key: str, width: int) -> str:
+        new = row_of(result, name)[key]
+        text = str(new)
+        old = row_of(previous, name).get(key) if previous is not None else None
+        if old and new is not None:
+            text += f" ({(new - old) / old:+.0%})"
+        return f"{text:>{width}}"
+
+    print(
+        f"{'operation':10} {'requests':>9} {'errors':>7} {'rps':>14} "
+        f"{'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16}"
+    )
+    for name in ["all", *result["operations"]]:
+        row = row_of(result, name)
+        cells = [cell(name, "throughput_rps", 14)]
+        cells += [cell(name, key, 16) for key in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:10} {row['requests']:>9} {row['errors']:>7} " + " ".join(cells))
+    print(f"\n{'route':32} {'requests':>9} {'statements/req':>15} {'db ms/req':>10}")
+    for route, row in sorted(result["server"].items()):
+        print(
+            f"{route:32} {row['requests']:>9} {row['db_statements_per_request']:>15} "
+            f"{row['db_ms_per_request']:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load benchmark of the tweets API.")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--follows-per-user", type=int, default=20)
+    parser.add_argument(
+        "--follow-skew",
+        type=float,
+        default=3.0,
+        help="power-law exponent of followee popularity, 1 is uniform",
+    )
+    parser.add_argument("--tweets-per-user", type=int, default=10)
+    parser.add_argument("--likes-per-tweet", type=int, default=3)
+    parser.add_argument("--media-ratio", type=float, default=0.2)
+    parser.add_argument(
+        "--timelines",
+        type=int,
+        default=50,
+        help="materialize home timelines with the latest N tweets of each followee",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed-batch-size", type=int, default=20_000)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="an earlier result file")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+    args.target = f"http://127.0.0.1:{args.port}"
+
+    for name in ("output", "compare"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    workdir = tempfile.mkdtemp(prefix="load-")
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["MEDIA_ROOT"] = os.path.join(workdir, "media")
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+
+    from alembic import command
+    from alembic.config import Config
+
+    command.upgrade(Config("alembic.ini"), "head")
+    graph = seed(args)
+    print(
+        "seeded", ", ".join(f"{table} {count}" for table, count in graph.rows.items())
+    )
+
+    server = start_server(args, workdir)
+    try:
+        asyncio.run(wait_ready(args.target, server, timeout=60))
+        measured = asyncio.run(drive(args, graph))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    options = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("database_url", "output", "compare", "verbose", "target")
+    }
+    result = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        **git_revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "rows": graph.rows,
+        **measured,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{datetime.now():%Y%m%d-%H%M%S}-{(result['commit'] or 'unknown')[:8]}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(result, previous)
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# Query budget check for every endpoint: seeds follow graphs of increasing
+# size into a scratch database, calls each endpoint in-process and counts the
+# SQL statements it issues. Fails when a count grows with the data (an N+1)
+# or exceeds the endpoint's budget, and prints the statements of the failing
+# calls. The database is migrated and all its tables are truncated.
+#
+#     python query_budget.py --database-url postgresql+asyncpg://.../scratch
+#
+# tests/test_query_budget.py runs the same check under pytest when
+# TEST_DATABASE_URL is set.
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app_tweets")
+SIZES = [10, 1_000, 10_000]
+
+# Statements per call, warm caches (auth, prepared statements) excluded.
+BUDGETS = {
+    "GET /api/tweets?mode=user": 1,
+    "GET /api/tweets?mode=home": 1,
+    # SET LOCAL plan_cache_mode, then the search.
+    "GET /api/tweets/search": 2,
+    "GET /api/tweets/search?scope=following": 2,
+    "GET /api/hashtags/{tag}": 1,
+    "GET /api/trends": 1,
+    "GET /api/users/me": 1,
+    "GET /api/users/me/mentions": 1,
+    "GET /api/users/{id}": 1,
+    "GET /api/users/{id}/followers": 1,
+    "GET /api/users/{id}/following": 1,
+    "GET /api/medias/{id}": 1,
+    # Tweets with a hashtag and a mention, one statement per side table.
+    "POST /api/tweets": 5,
+    "PATCH /api/tweets/{id}": 4,
+    "DELETE /api/tweets/{id}": 7,
+    "POST /api/tweets/{id}/likes": 1,
+    "DELETE /api/tweets/{id}/likes": 1,
+    "DELETE /api/users/{id}/follow": 1,
+    "POST /api/users/{id}/follow": 1,
+    "POST /api/medias": 1,
+    "POST /api/users/me/api_keys": 1,
+}
+
+SEED = [
+    "TRUNCATE users, api_keys, followers, tweets, likes, medias, media_variants,"
+    " timelines, tweet_hashtags, tweet_mentions, hashtag_counts CASCADE",
+    "INSERT INTO users (id, name)"
+    " SELECT nextval('user_id_seq'), 'user' || g FROM generate_series(1, :n) g",
+    # The reader follows everybody and everybody follows the reader.
+    "INSERT INTO followers (id, users_id, name, id_in_users)"
+    " SELECT nextval('follower_id_seq'), id, 'reader', :reader"
+    " FROM users WHERE id <> :reader",
+    "INSERT INTO followers (id, users_id, name, id_in_users)"
+    " SELECT nextval('follower_id_seq'), :reader, name, id"
+    " FROM users WHERE id <> :reader",
+    "INSERT INTO tweets (id, author_id, tweet_data, like_count)"
+    " SELECT nextval('tweets_id_seq'), id, 'hello from ' || name || ' #hello', 1"
+    " FROM users WHERE id <> :reader",
+    "INSERT INTO tweets (id, author_id, tweet_data)"
+    " SELECT nextval('tweets_id_seq'), :reader, 'tweet ' || g"
+    " FROM generate_series(1, :n) g",
+    "INSERT INTO likes (id, tweets_id, name, id_in_users)"
+    " SELECT nextval('likes_id_seq'), id, 'reader', :reader"
+    " FROM tweets WHERE author_id <> :reader",
+    "INSERT INTO medias (file_name, content_hash, size, content_type,"
+    " storage_path, tweet_id)"
+    " SELECT 'seed.png', :hash, :size, 'image/png', :path, id"
+    " FROM tweets WHERE author_id = :reader",
+    "UPDATE tweets SET tweet_media_ids = ARRAY[medias.id]"
+    " FROM medias WHERE medias.tweet_id = tweets.id",
+    "INSERT INTO timelines (user_id, tweet_id, author_id)"
+    " SELECT :reader, id, author_id FROM tweets",
+    "INSERT INTO tweet_hashtags (tag, tweet_id)"
+    " SELECT 'hello', id FROM tweets WHERE author_id <> :reader",
+    "INSERT INTO tweet_mentions (user_id, tweet_id)"
+    " SELECT :reader, id FROM tweets WHERE author_id <> :reader",
+    # One use of n tags in every bucket of the last hour.
+    "INSERT INTO hashtag_counts (bucket, tag, uses)"
+    " SELECT date_bin('5 minutes', now(), 'epoch') - b * interval '5 minutes',"
+    " 'tag' || g, 1 FROM generate_series(1, :n) g, generate_series(0, 11) b",
+    "ANALYZE",
+]
+
+_statements: ContextVar[Optional[List[str]]] = ContextVar("statements", default=None)
+
+
+class QueryCounter:
+    # Records the statements issued from the current context only, so
+    # background tasks (like counter flushes, renders) do not count.
+
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+
+    def __enter__(self) -> "QueryCounter":
+        self._token = _statements.set(self.statements)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _statements.reset(self._token)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+def _record(conn, cursor, statement, parameters, context, executemany) -> None:
+    statements = _statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+
+@dataclass
+class Graph:
+    reader: int
+    others: List[int]
+    reader_tweets: List[int]
+    other_tweets: List[int]
+    medias: List[int]
+    api_key: str
+    png: bytes
+
+
+@dataclass
+class Result:
+    counts: Dict[int, int] = field(default_factory=dict)
+    statements: Dict[int, List[str]] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+
+
+Call = Callable[[Any, Graph, int], Awaitable[Any]]
+
+
+def cases() -> Dict[str, Call]:
+    # Each case is called twice with i = 0 (warm-up) and i = 1 (counted), on
+    # different rows. Unfollow runs before follow so the follow is a new edge.
+    def headers(graph: Graph) -> Dict[str, str]:
+        return {"api-key": graph.api_key}
+
+    return {
+        "GET /api/tweets?mode=user": lambda c, g, i: c.get(
+            "/api/tweets", params={"mode": "user"}, headers=headers(g)
+        ),
+        "GET /api/tweets?mode=home": lambda c, g, i: c.get(
+            "/api/tweets", params={"mode": "home"}, headers=headers(g)
+        ),
+        "GET /api/tweets/search": lambda c, g, i: c.get(
+            "/api/tweets/search", params={"q": "hello"}, headers=headers(g)
+        ),
+        "GET /api/tweets/search?scope=following": lambda c, g, i: c.get(
+            "/api/tweets/search",
+            params={"q": "hello", "scope": "following"},
+            headers=headers(g),
+        ),
+        "GET /api/hashtags/{tag}": lambda c, g, i: c.get(
+            "/api/hashtags/hello", headers=headers(g)
+        ),
+        "GET /api/trends": lambda c, g, i: c.get("/api/trends", headers=headers(g)),
+        "GET /api/users/me": lambda c, g, i: c.get("/api/users/me", headers=headers(g)),
+        "GET /api/users/me/mentions": lambda c, g, i: c.get(
+            "/api/users/me/mentions", headers=headers(g)
+        ),
+        "GET /api/users/{id}": lambda c, g, i: c.get(
+            f"/api/users/{g.others[i]}", headers=headers(g)
+        ),
+        "GET /api/users/{id}/followers": lambda c, g, i: c.get(
+            f"/api/users/{g.reader}/followers", headers=headers(g)
+        ),
+        "GET /api/users/{id}/following": lambda c, g, i: c.get(
+            f"/api/users/{g.reader}/following", headers=headers(g)
+        ),
+        "GET /api/medias/{id}": lambda c, g, i: c.get(f"/api/medias/{g.medias[i]}"),
+        "POST /api/tweets": lambda c, g, i: c.post(
+            "/api/tweets",
+            json={"tweet_data": "budget #budget @user1", "tweet_media_ids": []},
+            headers=headers(g),
+        ),
+        "PATCH /api/tweets/{id}": lambda c, g, i: c.patch(
+            f"/api/tweets/{g.reader_tweets[i]}",
+            json={"tweet_data": "edited #budget"},
+            headers=headers(g),
+        ),
+        "DELETE /api/tweets/{id}": lambda c, g, i: c.delete(
+            f"/api/tweets/{g.reader_tweets[-1 - i]}", headers=headers(g)
+        ),
+        "POST /api/tweets/{id}/likes": lambda c, g, i: c.post(
+            f"/api/tweets/{g.reader_tweets[i]}/likes", headers=headers(g)
+        ),
+        "DELETE /api/tweets/{id}/likes": lambda c, g, i: c.delete(
+            f"/api/tweets/{g.other_tweets[i]}/likes", headers=headers(g)
+        ),
+        "DELETE /api/users/{id}/follow": lambda c, g, i: c.delete(
+            f"/api/users/{g.others[i]}/follow", headers=headers(g)
+        ),
+        "POST /api/users/{id}/follow": lambda c, g, i: c.post(
+            f"/api/users/{g.others[i]}/follow", headers=headers(g)
+        ),
+        "POST /api/medias": lambda c, g, i: c.post(
+            "/api/medias",
+            files={"file": (f"budget{i}.png", g.png + bytes([i]), "image/png")},
+            headers=headers(g),
+        ),
+        "POST /api/users/me/api_keys": lambda c, g, i: c.post(
+            "/api/users/me/api_keys", headers=headers(g)
+        ),
+    }
+
+
+def error_of(response: Any) -> Optional[str]:
+    if response.status_code >= 400:
+        return f"{response.status_code} {response.text[:200]}"
+    return None
+
+
+async def seed(size: int) -> Graph:
+    from auth import issue_api_key
+    from database import async_session
+    from PIL import Image
+    from sqlalchemy import text
+    from storage import get_storage
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 32), "teal").save(buffer, "PNG")
+    png = buffer.getvalue()
+    blob = await get_storage().save(png)
+    params = {
+        "n": size,
+        "hash": blob.content_hash,
+        "size": blob.size,
+        "path": blob.path,
+    }
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(text(SEED[0]))
+            reader = await session.scalar(
+                text(
+                    "INSERT INTO users (id, name)"
+                    " VALUES (nextval('user_id_seq'), 'reader') RETURNING id"
+                )
+            )
+            params["reader"] = reader
+        for statement in SEED[1:]:
+            async with session.begin():
+                await session.execute(text(statement), params)
+
+        async with session.begin():
+            _, api_key = await issue_api_key(
+                session, reader, api_key=f"query-budget-{size}"
+            )
+
+        async def ids(query: str) -> List[int]:
+            result = await session.execute(text(query), params)
+            return list(result.scalars())
+
+        return Graph(
+            reader=reader,
+            others=await ids("SELECT id FROM users WHERE id <> :reader ORDER BY id"),
+            reader_tweets=await ids(
+                "SELECT id FROM tweets WHERE author_id = :reader ORDER BY id"
+            ),
+            other_tweets=await ids(
+                "SELECT id FROM tweets WHERE author_id <> :reader ORDER BY id"
+            ),
+            medias=await ids("SELECT id FROM medias ORDER BY id"),
+            api_key=api_key,
+            png=png,
+        )
+
+
+async def run(sizes: List[int]) -> Dict[str, Result]:
+    import httpx
+    import routers
+    from database import engine
+    from replicas import replicas
+    from sqlalchemy import event
+
+    for target in [engine, *replicas.replicas]:
+        event.listen(target.sync_engine, "before_cursor_execute", _record)
+
+    results = {name: Result() for name in cases()}
+    app = routers.app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://budget"
+        ) as c:
+            for size in sizes:
+                graph = await seed(size)
+                for name, call in cases().items():
+                    result = results[name]
+                    for i in (0, 1):
+                        with QueryCounter() as counter:
+                            response = await call(c, graph, i)
+                        error = error_of(response)
+                        if error is not None:
+                            result.errors.append(f"size {size}: {error}")
+                    result.counts[size] = counter.count
+                    result.statements[size] = counter.statements
+    return results
+
+
+def problems_of(name: str, result: Result, sizes: List[int]) -> List[str]:
+    budget = BUDGETS[name]
+    counts = [result.counts[size] for size in sizes]
+    problems = list(result.errors)
+    if max(counts) > budget:
+        problems.append(f"over budget: {max(counts)} > {budget}")
+    if counts[-1] > counts[0]:
+        problems.append("statement count grows with the data")
+    return problems
+
+
+def statements_of(result: Result, sizes: List[int]) -> List[str]:
+    size = max(sizes, key=lambda s: result.counts[s])
+    return [f"statements at size {size}:"] + [
+        "  " + " ".join(statement.split()) for statement in result.statements[size]
+    ]
+
+
+def report(results: Dict[str, Result], sizes: List[int]) -> bool:
+    ok = True
+    width = max(len(name) for name in results)
+    print(f"{'endpoint':{width}}  budget  " + "  ".join(f"{s:>6}" for s in sizes))
+    for name, result in results.items():
+        budget = BUDGETS[name]
+        counts = [result.counts[size] for size in sizes]
+        problems = problems_of(name, result, sizes)
+        row = "  ".join(f"{count:>6}" for count in counts)
+        print(f"{name:{width}}  {budget:>6}  {row}  {'FAIL' if problems else 'ok'}")
+        if problems:
+            ok = False
+            for line in problems + statements_of(result, sizes):
+                print(f"    {line}")
+    return ok
+
+
+def configure(database_url: str) -> None:
+    # Before any app module is imported: they read their settings on import.
+    os.environ["DATABASE_URL"] = database_url
+    # Every timeline request builds its page, cache hits would hide queries.
+    os.environ["TIMELINE_CACHE_SIZE"] = "0"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ.setdefault("MEDIA_ROOT", tempfile.mkdtemp(prefix="query-budget-"))
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+
+
+def migrate() -> None:
+    # Run from APP_DIR, the paths in alembic.ini are relative to it.
+    from alembic import command
+    from alembic.config import Config
+
+    command.upgrade(Config("alembic.ini"), "head")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check the SQL statement budget of every endpoint."
+    )
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=SIZES,
+    )
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    os.chdir(APP_DIR)
+    migrate()
+    results = asyncio.run(run(args.sizes))
+    sys.exit(0 if report(results, args.sizes) else 1)
+
+
+if __name__ == "__main__":
+    main()
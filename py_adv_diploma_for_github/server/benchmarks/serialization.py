@@ -0,0 +1,81 @@
+# Serialization cost of one timeline page, without the database: a page of
+# --tweets tweets shaped like service.get_timeline builds them is encoded
+# the way the handlers used to (JSONResponse, json.dumps), the way FastAPI
+# would with response_model validation, and the way they do now
+# (ORJSONResponse). The encoded body is checked against schemas.TimelineOut.
+#
+#     python serialization.py --tweets 1000
+
+import argparse
+import asyncio
+import os
+import sys
+import timeit
+from typing import Any, Callable, Dict
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app_tweets")
+
+
+def page(size: int) -> Dict[str, Any]:
+    tweets = []
+    for tweet_id in range(size, 0, -1):
+        attachments = [f"/api/medias/{tweet_id}"] if tweet_id % 5 == 0 else []
+        tweets.append(
+            {
+                "id": tweet_id,
+                "content": f"tweet {tweet_id} about #python and the weekend ☕",
+                "attachments": attachments,
+                "thumbnails": [f"{url}?variant=thumb" for url in attachments],
+                "author": {"id": tweet_id % 97, "name": f"user{tweet_id % 97}"},
+                "like_count": tweet_id % 13,
+                "likes": (
+                    [{"user_id": 1, "name": "reader"}] if tweet_id % 3 == 0 else []
+                ),
+            }
+        )
+    return {
+        "result": True,
+        "tweets": tweets,
+        "next_cursor": "WzFd",
+        "prev_cursor": "WzEwMDBd",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Timeline serialization benchmark.")
+    parser.add_argument("--tweets", type=int, default=1_000)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+
+    import schemas
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_model_field
+
+    content = page(args.tweets)
+    field = create_model_field("response", schemas.TimelineOut, mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def validated() -> bytes:
+        # What returning the dict with response_model=TimelineOut costs.
+        checked = loop.run_until_complete(
+            serialize_response(field=field, response_content=content)
+        )
+        return JSONResponse(checked).body
+
+    ways: Dict[str, Callable[[], bytes]] = {
+        "JSONResponse (before)": lambda: JSONResponse(content).body,
+        "response_model + JSONResponse": validated,
+        "ORJSONResponse (now)": lambda: ORJSONResponse(content).body,
+    }
+    body = ORJSONResponse(content).body
+    schemas.TimelineOut.model_validate_json(body)
+    print(f"{args.tweets} tweets, {len(body)} bytes")
+    for name, encode in ways.items():
+        seconds = timeit.timeit(encode, number=args.number) / args.number
+        print(f"{name:32} {seconds * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
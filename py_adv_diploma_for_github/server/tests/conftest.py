@@ -0,0 +1,17 @@
+import os
+import sys
+
+# The app modules import each other by bare name, as when run from
+# app_tweets (see the Dockerfile).
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app_tweets")
+BENCHMARKS_DIR = os.path.join(os.path.dirname(APP_DIR), "benchmarks")
+sys.path.insert(0, os.path.abspath(APP_DIR))
+sys.path.insert(0, os.path.abspath(BENCHMARKS_DIR))
+
+# A scratch database for the tests that need Postgres; they are skipped
+# without it. All its tables are truncated.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    import query_budget
+
+    query_budget.configure(TEST_DATABASE_URL)
@@ -0,0 +1,79 @@
+import asyncio
+
+import auth
+import pytest
+from auth import Principal, PrincipalCache
+from fastapi import HTTPException
+
+ALICE = Principal(1, "alice")
+BOB = Principal(2, "bob")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_until_ttl(clock):
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    cache.put("a", ALICE)
+    clock[0] += 60
+    assert cache.get("a") == ALICE
+    clock[0] += 0.001
+    assert cache.get("a") is None
+    assert "a" not in cache._entries
+
+
+def test_put_refreshes_ttl(clock):
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    cache.put("a", ALICE)
+    clock[0] += 50
+    cache.put("a", BOB)
+    clock[0] += 50
+    assert cache.get("a") == BOB
+
+
+def test_evicts_least_recently_used():
+    cache = PrincipalCache(maxsize=2, ttl=60)
+    cache.put("a", ALICE)
+    cache.put("b", BOB)
+    assert cache.get("a") == ALICE
+    cache.put("c", ALICE)
+    assert cache.get("b") is None
+    assert cache.get("a") == ALICE
+    assert cache.get("c") == ALICE
+
+
+def test_invalidate():
+    cache = PrincipalCache(maxsize=2, ttl=60)
+    cache.put("a", ALICE)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+
+
+def test_hash_key():
+    assert auth.hash_key("test") == auth.hash_key("test")
+    assert auth.hash_key("test") != auth.hash_key("tests")
+    assert len(auth.hash_key("test")) == 64
+
+
+@pytest.mark.parametrize(
+    "header, cookie, query, used",
+    [("h", "c", "q", "h"), (None, "c", "q", "c"), (None, None, "q", "q")],
+)
+def test_stream_key_sources(monkeypatch, header, cookie, query, used):
+    async def authenticate(api_key):
+        return Principal(1, api_key)
+
+    monkeypatch.setattr(auth, "authenticate", authenticate)
+    principal = asyncio.run(auth.get_stream_user(header, query, cookie))
+    assert principal.name == used
+
+
+def test_stream_without_key():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(auth.get_stream_user(None, None, None))
+    assert error.value.status_code == 401
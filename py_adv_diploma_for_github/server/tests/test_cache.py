@@ -0,0 +1,123 @@
+import asyncio
+
+import cache
+import pytest
+from cache import TimelineCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000]
+    monkeypatch.setattr(cache.time, "time_ns", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_version_is_stable_until_bumped(clock):
+    timeline_cache = TimelineCache(maxsize=10, redis_url=None, shared_ttl=60)
+    first = run(timeline_cache.version(1))
+    clock[0] += 5
+    assert run(timeline_cache.version(1)) == first
+    run(timeline_cache.bump([1, 1]))
+    assert run(timeline_cache.version(1)) == first + 1
+    assert timeline_cache.stats["invalidations"] == 1
+
+
+def test_bump_skips_readers_without_counter(clock):
+    timeline_cache = TimelineCache(maxsize=10, redis_url=None, shared_ttl=60)
+    run(timeline_cache.bump([1, 2, 3]))
+    assert not timeline_cache._versions
+    clock[0] += 5
+    assert run(timeline_cache.version(1)) == clock[0]
+
+
+def test_evicts_least_recently_read_counter(clock):
+    timeline_cache = TimelineCache(maxsize=2, redis_url=None, shared_ttl=60)
+    first = run(timeline_cache.version(1))
+    run(timeline_cache.version(2))
+    run(timeline_cache.version(1))
+    run(timeline_cache.version(3))
+    assert list(timeline_cache._versions) == [1, 3]
+    assert run(timeline_cache.version(1)) == first
+
+
+def test_evicted_counter_restarts_above_its_last_value(clock):
+    timeline_cache = TimelineCache(maxsize=1, redis_url=None, shared_ttl=60)
+    first = run(timeline_cache.version(1))
+    run(timeline_cache.bump([1]))
+    clock[0] += 1_000
+    run(timeline_cache.version(2))
+    assert run(timeline_cache.version(1)) > first + 1
+
+
+def test_pages_are_keyed_by_version(clock):
+    timeline_cache = TimelineCache(maxsize=10, redis_url=None, shared_ttl=60)
+
+    async def page(user_id):
+        key = f"tweets:{user_id}:{await timeline_cache.version(user_id)}"
+        return key, await timeline_cache.get(key)
+
+    key, cached = run(page(1))
+    assert cached is None
+    run(timeline_cache.set(key, ["tweet"]))
+    assert run(page(1)) == (key, ["tweet"])
+    run(timeline_cache.bump([1]))
+    assert run(page(1))[1] is None
+
+
+def test_disabled_cache_keeps_nothing(clock):
+    timeline_cache = TimelineCache(maxsize=0, redis_url=None, shared_ttl=60)
+    run(timeline_cache.version(1))
+    run(timeline_cache.set("tweets:1", ["tweet"]))
+    assert not timeline_cache._versions
+    assert run(timeline_cache.get("tweets:1")) is None
+
+
+def test_needs_primary_right_after_a_bump(monotonic):
+    timeline_cache = TimelineCache(
+        maxsize=10, redis_url=None, shared_ttl=60, bump_window=10
+    )
+    assert not run(timeline_cache.needs_primary(1))
+    run(timeline_cache.bump([1]))
+    assert run(timeline_cache.needs_primary(1))
+    assert not run(timeline_cache.needs_primary(2))
+    monotonic[0] += 10
+    assert run(timeline_cache.needs_primary(1))
+    monotonic[0] += 0.001
+    assert not run(timeline_cache.needs_primary(1))
+    run(timeline_cache.bump([2]))
+    assert list(timeline_cache._bumped) == [2]
+
+
+def test_disabled_cache_never_needs_primary(monotonic):
+    # Nothing built now is kept, a replica that lags only delays the write.
+    timeline_cache = TimelineCache(
+        maxsize=0, redis_url=None, shared_ttl=60, bump_window=10
+    )
+    run(timeline_cache.bump([1]))
+    assert not run(timeline_cache.needs_primary(1))
+
+
+def test_forgotten_bumps_send_everyone_to_primary(monotonic):
+    timeline_cache = TimelineCache(
+        maxsize=2, redis_url=None, shared_ttl=60, bump_window=10
+    )
+    run(timeline_cache.bump([1]))
+    monotonic[0] += 5
+    run(timeline_cache.bump([2, 3]))
+    assert len(timeline_cache._bumped) == 2
+    assert run(timeline_cache.needs_primary(1))
+    assert run(timeline_cache.needs_primary(4))
+    monotonic[0] += 5.001
+    assert not run(timeline_cache.needs_primary(4))
+    assert run(timeline_cache.needs_primary(2))
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, List, Tuple
+
+import pytest
+from counters import DeltaBuffer
+
+
+class RecordingBuffer(DeltaBuffer):
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(None, **kwargs)  # type: ignore[arg-type]
+        self.applied: List[List[Tuple[Any, int]]] = []
+        self.fail = False
+
+    async def _apply(self, deltas: List[Tuple[Any, int]]) -> None:
+        if self.fail:
+            raise RuntimeError("database is down")
+        self.applied.append(deltas)
+
+
+def test_coalesces_deltas_per_key():
+    buffer = RecordingBuffer()
+    for _ in range(3):
+        buffer.add(1, 1)
+    buffer.add(2, 1)
+    buffer.add(2, -1)
+    buffer.add(3, -2)
+    asyncio.run(buffer.flush())
+    # Keys whose deltas cancel out are not written at all.
+    assert buffer.applied == [[(1, 3), (3, -2)]]
+    asyncio.run(buffer.flush())
+    assert buffer.applied[-1] == []
+
+
+def test_requeues_deltas_after_failed_flush():
+    buffer = RecordingBuffer()
+    buffer.add(1, 2)
+    buffer.fail = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(buffer.flush())
+    assert buffer.applied == []
+    buffer.add(1, 1)
+    buffer.add(2, 1)
+    buffer.fail = False
+    asyncio.run(buffer.flush())
+    assert buffer.applied == [[(1, 3), (2, 1)]]
+
+
+def test_stop_flushes_pending_deltas():
+    buffer = RecordingBuffer(flush_interval=3600)
+
+    async def scenario() -> None:
+        buffer.start()
+        buffer.add(1, 1)
+        await asyncio.sleep(0)
+        assert buffer.applied == []
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert buffer.applied == [[(1, 1)]]
+
+
+def test_full_buffer_wakes_the_flusher():
+    buffer = RecordingBuffer(flush_interval=3600, max_pending=2)
+
+    async def scenario() -> None:
+        buffer.start()
+        buffer.add(1, 1)
+        buffer.add(2, 1)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert buffer.applied == [[(1, 1), (2, 1)]]
+        await buffer.stop()
+
+    asyncio.run(scenario())
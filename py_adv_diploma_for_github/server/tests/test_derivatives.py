@@ -0,0 +1,122 @@
+import asyncio
+import io
+import os
+
+import derivatives
+import pytest
+import query_budget
+from derivatives import DerivativeGenerator
+from PIL import Image, UnidentifiedImageError
+
+needs_database = pytest.mark.skipif(
+    not os.environ.get("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set"
+)
+
+
+class FailingGenerator(DerivativeGenerator):
+    def __init__(self, error: Exception) -> None:
+        super().__init__(None, workers=1, image_format="WEBP")  # type: ignore[arg-type]
+        self._pool = object()  # type: ignore[assignment]
+        self.error = error
+        self.calls = 0
+
+    async def _render_missing(self, content_hash: str, storage_path: str) -> None:
+        self.calls += 1
+        raise self.error
+
+
+def schedule_and_wait(generator: DerivativeGenerator, content_hash: str) -> None:
+    async def scenario() -> None:
+        generator.schedule(content_hash, "path")
+        await asyncio.gather(*generator._tasks)
+
+    asyncio.run(scenario())
+
+
+def test_schedule_without_pool_renders_nothing():
+    generator = FailingGenerator(RuntimeError())
+    generator._pool = None
+    schedule_and_wait(generator, "abc")
+    assert generator.calls == 0
+
+
+@pytest.mark.parametrize(
+    "error", [UnidentifiedImageError("not an image"), Image.DecompressionBombError()]
+)
+def test_undecodable_original_is_not_retried(error):
+    generator = FailingGenerator(error)
+    schedule_and_wait(generator, "abc")
+    schedule_and_wait(generator, "abc")
+    assert generator.calls == 1
+    assert generator._failed == {"abc"}
+    assert not generator._in_flight
+
+
+def test_other_failures_are_retried():
+    generator = FailingGenerator(RuntimeError("storage is down"))
+    schedule_and_wait(generator, "abc")
+    schedule_and_wait(generator, "abc")
+    assert generator.calls == 2
+    assert not generator._failed
+    assert not generator._in_flight
+
+
+def test_failed_set_is_bounded(monkeypatch):
+    monkeypatch.setattr(derivatives, "MAX_FAILED", 2)
+    generator = FailingGenerator(UnidentifiedImageError())
+    for content_hash in ("a", "b", "c"):
+        schedule_and_wait(generator, content_hash)
+    assert generator._failed == {"c"}
+
+
+@needs_database
+def test_original_is_served_until_the_variant_is_rendered():
+    import service
+    from database import async_session, engine
+    from models import Media
+    from sqlalchemy import text
+    from storage import get_storage
+
+    async def scenario() -> None:
+        out = io.BytesIO()
+        Image.new("RGB", (640, 480), "red").save(out, format="PNG")
+        blob = await get_storage().save(out.getvalue())
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(text("TRUNCATE medias, media_variants"))
+                media = Media(
+                    file_name="a.png",
+                    content_hash=blob.content_hash,
+                    size=blob.size,
+                    content_type="image/png",
+                    storage_path=blob.path,
+                )
+                session.add(media)
+            media_id = media.id
+
+        async with async_session() as session:
+            before = await service.get_media_by_id(session, media_id, variant="thumb")
+        assert before.fallback
+        assert (before.content_type, before.storage_path) == ("image/png", blob.path)
+
+        generator = DerivativeGenerator(async_session, workers=1, image_format="WEBP")
+        generator.start()
+        try:
+            generator.schedule(blob.content_hash, blob.path)
+        finally:
+            await generator.stop()
+        async with async_session() as session:
+            after = await service.get_media_by_id(session, media_id, variant="thumb")
+        assert not after.fallback
+        assert after.content_type == "image/webp"
+        assert after.original_hash == blob.content_hash
+        with Image.open(
+            io.BytesIO(await get_storage().read(after.storage_path))
+        ) as thumb:
+            assert thumb.size == (320, 240)
+        await engine.dispose()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(query_budget.APP_DIR)
+        query_budget.migrate()
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+import asyncio
+
+import orjson
+import pytest
+from errors import (
+    http_error_handler,
+    status_error_type,
+    unhandled_error_handler,
+    validation_error_handler,
+)
+from fastapi.exceptions import RequestValidationError
+from starlette.exceptions import HTTPException
+
+
+def body(response):
+    return orjson.loads(response.body)
+
+
+@pytest.mark.parametrize(
+    "status_code, error_type",
+    [
+        (401, "Unauthorized"),
+        (404, "NotFound"),
+        (405, "MethodNotAllowed"),
+        (599, "HTTPError"),
+    ],
+)
+def test_status_error_type(status_code, error_type):
+    assert status_error_type(status_code) == error_type
+
+
+def test_http_error_keeps_status_and_headers():
+    exc = HTTPException(405, headers={"Allow": "GET"})
+    response = asyncio.run(http_error_handler(None, exc))
+    assert response.status_code == 405
+    assert response.headers["allow"] == "GET"
+    assert body(response) == {
+        "result": False,
+        "error_type": "MethodNotAllowed",
+        "error_message": "Method Not Allowed",
+    }
+
+
+def test_validation_error_lists_fields():
+    exc = RequestValidationError(
+        [
+            {"loc": ("query", "limit"), "msg": "too big", "type": "x"},
+            {"loc": ("body",), "msg": "missing", "type": "y"},
+        ]
+    )
+    response = asyncio.run(validation_error_handler(None, exc))
+    assert response.status_code == 422
+    assert body(response)["error_message"] == "query.limit: too big; body: missing"
+
+
+def test_unhandled_error_hides_the_message():
+    response = asyncio.run(unhandled_error_handler(None, RuntimeError("SELECT 1")))
+    assert response.status_code == 500
+    assert "SELECT" not in response.body.decode()
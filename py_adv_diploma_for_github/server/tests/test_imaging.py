@@ -0,0 +1,96 @@
+import io
+
+import pytest
+from imaging import detect_image_type, render_variant
+from PIL import Image
+
+
+def encode(image_format: str, size=(8, 6), mode: str = "RGB", color="red") -> bytes:
+    out = io.BytesIO()
+    Image.new(mode, size, color).save(out, format=image_format)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    "image_format, content_type",
+    [
+        ("JPEG", "image/jpeg"),
+        ("PNG", "image/png"),
+        ("GIF", "image/gif"),
+        ("WEBP", "image/webp"),
+    ],
+)
+def test_detect_image_type(image_format, content_type):
+    file = io.BytesIO(encode(image_format))
+    file.seek(3)
+    assert detect_image_type(file) == content_type
+    assert file.tell() == 0
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"<html><script>alert(document.cookie)</script></html>",
+        b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>',
+        b"",
+        encode("BMP"),
+        encode("TIFF"),
+        encode("PNG")[:40],
+    ],
+)
+def test_detect_image_type_rejects(data):
+    file = io.BytesIO(data)
+    assert detect_image_type(file) is None
+    assert file.tell() == 0
+
+
+def render(data: bytes, width: int = 320) -> Image.Image:
+    image = Image.open(io.BytesIO(render_variant(data, width, "WEBP")))
+    assert image.format == "WEBP"
+    return image
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "JPEG"])
+def test_render_variant_resizes_to_width(image_format):
+    assert render(encode(image_format, size=(1600, 800))).size == (320, 160)
+
+
+def test_render_variant_does_not_upscale():
+    assert render(encode("PNG", size=(100, 40))).size == (100, 40)
+
+
+def test_render_variant_applies_exif_orientation():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+    out = io.BytesIO()
+    Image.new("RGB", (40, 20), "red").save(out, format="JPEG", exif=exif)
+    assert render(out.getvalue()).size == (20, 40)
+    # The width is measured once turned, also when JPEG decodes at a scale.
+    out = io.BytesIO()
+    Image.new("RGB", (1000, 500), "red").save(out, format="JPEG", exif=exif)
+    assert render(out.getvalue(), width=250).size == (250, 500)
+
+
+@pytest.mark.parametrize(
+    "image_format, mode, expected",
+    [
+        ("PNG", "L", "RGB"),
+        ("PNG", "LA", "RGBA"),
+        ("PNG", "RGBA", "RGBA"),
+        ("GIF", "P", "RGB"),
+        ("JPEG", "CMYK", "RGB"),
+    ],
+)
+def test_render_variant_converts_mode(image_format, mode, expected):
+    # Half transparent where there is an alpha channel: WebP drops an
+    # opaque one.
+    color = {"LA": (255, 128), "RGBA": (255, 0, 0, 128)}.get(mode, "red")
+    assert render(encode(image_format, mode=mode, color=color)).mode == expected
+
+
+def test_render_variant_keeps_palette_transparency():
+    image = Image.new("P", (8, 6), 0)
+    image.info["transparency"] = 0
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    assert render(out.getvalue()).mode == "RGBA"
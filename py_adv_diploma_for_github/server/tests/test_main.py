@@ -0,0 +1,40 @@
+import pytest
+from main import pool_limits
+from settings import settings
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_size", 10)
+    monkeypatch.setattr(settings, "db_max_overflow", 5)
+
+    def set_budget(connections: int) -> None:
+        monkeypatch.setattr(settings, "db_max_connections", connections)
+
+    return set_budget
+
+
+@pytest.mark.parametrize(
+    "connections, workers, expected",
+    [
+        (80, 1, (10, 5)),
+        (80, 4, (10, 5)),
+        (80, 8, (9, 0)),
+        (80, 16, (4, 0)),
+        (80, 40, (1, 0)),
+        (20, 2, (9, 0)),
+    ],
+)
+def test_pool_limits(budget, connections, workers, expected):
+    budget(connections)
+    pool_size, max_overflow = pool_limits(workers)
+    assert (pool_size, max_overflow) == expected
+    # Pools plus one LISTEN connection per worker stay within the budget.
+    assert workers * (pool_size + max_overflow + 1) <= connections
+
+
+@pytest.mark.parametrize("connections, workers", [(80, 41), (80, 80), (1, 1)])
+def test_pool_limits_refuses_uncoverable_workers(budget, connections, workers):
+    budget(connections)
+    with pytest.raises(ValueError, match="cannot serve"):
+        pool_limits(workers)
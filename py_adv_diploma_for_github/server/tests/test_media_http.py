@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+
+import pytest
+from media_http import (
+    DOWNLOAD_MEDIA_TYPE,
+    RangeNotSatisfiable,
+    cache_headers,
+    is_not_modified,
+    parse_range,
+    type_headers,
+)
+from starlette.requests import Request
+
+CREATED_AT = datetime(2026, 10, 18, 12, 30, 15, 123456, tzinfo=timezone.utc)
+ETAG = '"abc"'
+
+
+def request(**headers: str) -> Request:
+    raw = [
+        (name.replace("_", "-").encode(), value.encode())
+        for name, value in headers.items()
+    ]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes=900-5000", (900, 999)),
+        (" bytes = 1-2", (1, 2)),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header", ["items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=1-x"]
+)
+def test_parse_range_ignores_unsupported(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5-4", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 1000)
+
+
+def test_cache_headers():
+    headers = cache_headers("abc", CREATED_AT)
+    assert headers["ETag"] == ETAG
+    assert "immutable" in headers["Cache-Control"]
+    assert headers["Last-Modified"] == "Sun, 18 Oct 2026 12:30:15 GMT"
+    fallback = cache_headers("abc", None, immutable=False)
+    assert "immutable" not in fallback["Cache-Control"]
+    assert "Last-Modified" not in fallback
+
+
+@pytest.mark.parametrize("content_type", ["image/png", "image/avif", None])
+def test_type_headers_serve_images_inline(content_type):
+    media_type, headers = type_headers(content_type)
+    assert media_type == content_type or media_type == "image/webp"
+    assert headers == {"X-Content-Type-Options": "nosniff"}
+
+
+@pytest.mark.parametrize("content_type", ["text/html", "image/svg+xml", "text/plain"])
+def test_type_headers_send_anything_else_as_download(content_type):
+    media_type, headers = type_headers(content_type)
+    assert media_type == DOWNLOAD_MEDIA_TYPE
+    assert headers["X-Content-Type-Options"] == "nosniff"
+    assert headers["Content-Disposition"] == "attachment"
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        (ETAG, True),
+        ('W/"abc"', True),
+        ('"x", "abc"', True),
+        ("*", True),
+        ('"x"', False),
+    ],
+)
+def test_if_none_match(if_none_match, expected):
+    assert (
+        is_not_modified(request(if_none_match=if_none_match), ETAG, CREATED_AT)
+        is expected
+    )
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    headers = {
+        "if_none_match": '"x"',
+        "if_modified_since": "Mon, 19 Oct 2026 00:00:00 GMT",
+    }
+    assert not is_not_modified(request(**headers), ETAG, CREATED_AT)
+
+
+@pytest.mark.parametrize(
+    "since, expected",
+    [
+        # Second precision: the microseconds of created_at do not count.
+        ("Sun, 18 Oct 2026 12:30:15 GMT", True),
+        ("Sun, 18 Oct 2026 12:30:14 GMT", False),
+        ("not a date", False),
+    ],
+)
+def test_if_modified_since(since, expected):
+    assert (
+        is_not_modified(request(if_modified_since=since), ETAG, CREATED_AT) is expected
+    )
+
+
+def test_no_validators():
+    assert not is_not_modified(request(), ETAG, CREATED_AT)
+    assert not is_not_modified(
+        request(if_modified_since="Sun, 18 Oct 2026 12:30:15 GMT"), ETAG, None
+    )
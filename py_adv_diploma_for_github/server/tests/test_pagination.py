@@ -0,0 +1,54 @@
+import pytest
+from pagination import (
+    decode_cursor,
+    decode_id_cursor,
+    decode_rank_cursor,
+    encode_cursor,
+    page,
+)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(0.0607927, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == [0.0607927, 42]
+    assert decode_id_cursor(encode_cursor(7)) == 7
+    assert decode_rank_cursor(cursor) == (0.0607927, 42)
+
+
+def test_missing_cursor():
+    assert decode_id_cursor(None) is None
+    assert decode_rank_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", ["", "zz", "!!!", encode_cursor(), "bnVsbA"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize(
+    "cursor", [encode_cursor("7"), encode_cursor(1, 2), encode_cursor(1.5)]
+)
+def test_invalid_id_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_id_cursor(cursor)
+
+
+@pytest.mark.parametrize(
+    "cursor", [encode_cursor(1), encode_cursor("a", 1), encode_cursor(0.5, 1.5)]
+)
+def test_invalid_rank_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_rank_cursor(cursor)
+
+
+def test_rank_cursor_accepts_integral_rank():
+    assert decode_rank_cursor(encode_cursor(1, 5)) == (1.0, 5)
+
+
+def test_page():
+    assert page([5, 4, 3], 2) == ([5, 4], True)
+    assert page([5, 4], 2) == ([5, 4], False)
+    # Pages fetched after a cursor come oldest first and are turned around.
+    assert page([6, 7, 8], 2, after_id=5) == ([7, 6], True)
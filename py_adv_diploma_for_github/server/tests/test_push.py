@@ -0,0 +1,141 @@
+import asyncio
+import os
+import signal
+
+import orjson
+import pytest
+from push import EVICTED, HEARTBEAT, PAYLOAD_ITEMS, PushHub, Subscriber, sse_event
+
+
+def hub() -> PushHub:
+    return PushHub(None, "", "push", max_pending=3, max_connections=10)  # type: ignore[arg-type]
+
+
+def test_subscriber_delivers_in_order():
+    subscriber = Subscriber(1, max_pending=3)
+    subscriber.offer(b"a")
+    subscriber.offer(b"b")
+
+    async def drain():
+        return [await subscriber.next(0.01) for _ in range(3)]
+
+    assert asyncio.run(drain()) == [b"a", b"b", HEARTBEAT]
+
+
+def test_subscriber_wakes_on_offer():
+    subscriber = Subscriber(1, max_pending=3)
+
+    async def scenario():
+        waiting = asyncio.create_task(subscriber.next(60))
+        await asyncio.sleep(0)
+        subscriber.offer(b"a")
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(scenario()) == b"a"
+
+
+def test_slow_subscriber_is_evicted():
+    subscriber = Subscriber(1, max_pending=3)
+    for event in (b"a", b"b", b"c"):
+        subscriber.offer(event)
+    assert not subscriber.evicted
+    subscriber.offer(b"d")
+    assert subscriber.evicted
+    subscriber.offer(b"e")
+    # Queued events are dropped, the client reloads the timeline.
+    assert asyncio.run(subscriber.next(0.01)) is EVICTED
+
+
+def test_close_wakes_a_waiting_subscriber():
+    subscriber = Subscriber(1, max_pending=3)
+
+    async def scenario():
+        waiting = asyncio.create_task(subscriber.next(60))
+        await asyncio.sleep(0)
+        subscriber.close()
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(scenario()) is EVICTED
+
+
+def test_evictions_are_counted_on_unsubscribe():
+    push_hub = hub()
+    with push_hub.subscribe(1) as first, push_hub.subscribe(1):
+        assert push_hub.connections == 2
+        for _ in range(4):
+            first.offer(b"x")
+    assert push_hub.connections == 0
+    assert push_hub.snapshot() == {"connections": 0, "users": 0, "evictions": 1}
+
+
+def test_payloads_are_chunked():
+    push_hub = hub()
+    tweets = list(range(PAYLOAD_ITEMS * 2 + 1))
+    for tweet_id in tweets:
+        push_hub.publish_tweet(tweet_id)
+    push_hub.publish_likes({1: 5, 2: 7})
+    push_hub.publish_likes({1: 6})
+    payloads = [orjson.loads(payload) for payload in push_hub.payloads()]
+    assert [len(payload.get("tweets", ())) for payload in payloads] == [
+        PAYLOAD_ITEMS,
+        PAYLOAD_ITEMS,
+        1,
+        0,
+    ]
+    assert [id for payload in payloads for id in payload.get("tweets", ())] == tweets
+    assert payloads[-1] == {"likes": [[1, 6], [2, 7]]}
+    assert list(push_hub.payloads()) == []
+
+
+def test_payloads_fit_a_notify():
+    push_hub = hub()
+    for tweet_id in range(PAYLOAD_ITEMS):
+        push_hub.publish_tweet(2**31 - 1)
+        push_hub.publish_likes({2**31 - 1 - tweet_id: 2**31 - 1})
+    assert all(len(payload) < 8000 for payload in push_hub.payloads())
+
+
+def test_notifications_are_queued_for_dispatch():
+    push_hub = hub()
+    push_hub._on_notify(None, 0, "push", '{"tweets": [1, 2]}')
+    push_hub._on_notify(None, 0, "push", '{"likes": [[1, 3]]}')
+    assert push_hub._incoming_tweets == [1, 2]
+    assert push_hub._incoming_likes == {1: 3}
+
+
+def test_close_streams_evicts_every_subscriber():
+    push_hub = hub()
+    with push_hub.subscribe(1) as first, push_hub.subscribe(2) as second:
+        push_hub.close_streams()
+        assert first.evicted and second.evicted
+        assert push_hub.closing
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs POSIX signals")
+def test_shutdown_signal_closes_streams_before_the_server_handler():
+    received = []
+
+    def server_handler(sig, frame):
+        received.append(sig)
+
+    original = signal.signal(signal.SIGTERM, server_handler)
+    push_hub = hub()
+
+    async def scenario():
+        with push_hub.subscribe(1) as subscriber:
+            with push_hub.closing_on_signals():
+                signal.raise_signal(signal.SIGTERM)
+                assert received == [signal.SIGTERM]
+                return await asyncio.wait_for(subscriber.next(60), 1)
+
+    try:
+        assert asyncio.run(scenario()) is EVICTED
+        assert signal.getsignal(signal.SIGTERM) is server_handler
+    finally:
+        signal.signal(signal.SIGTERM, original)
+
+
+def test_sse_event():
+    assert sse_event("ready", {"user_id": 1}) == (
+        b'event: ready\ndata: {"user_id":1}\n\n'
+    )
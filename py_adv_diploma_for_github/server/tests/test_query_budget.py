@@ -0,0 +1,28 @@
+import asyncio
+import os
+
+import pytest
+import query_budget
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set"
+)
+
+# Two sizes tell a constant statement count from one that grows with the data.
+SIZES = [10, 1_000]
+
+
+@pytest.fixture(scope="module")
+def results():
+    # One run covers every endpoint, seeding takes most of the time.
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(query_budget.APP_DIR)
+        query_budget.migrate()
+        return asyncio.run(query_budget.run(SIZES))
+
+
+@pytest.mark.parametrize("name", query_budget.BUDGETS)
+def test_statement_budget(results, name):
+    result = results[name]
+    problems = query_budget.problems_of(name, result, SIZES)
+    assert not problems, "\n".join(problems + query_budget.statements_of(result, SIZES))
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+import replicas
+from replicas import ReplicaSet, primary_cookie_fresh
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(replicas.time, "monotonic", lambda: now[0])
+    return now
+
+
+def replica_set() -> ReplicaSet:
+    return ReplicaSet(None, [], check_interval=5, max_lag=5, eject_seconds=30)
+
+
+def test_writer_reads_primary_for_stick_seconds(clock):
+    replica_set_ = replica_set()
+    assert replica_set_.stick_seconds == 10
+    replica_set_.mark_write("1")
+    assert replica_set_.wrote_recently("1")
+    assert not replica_set_.wrote_recently("2")
+    clock[0] += 10
+    assert not replica_set_.wrote_recently("1")
+
+
+def test_expired_writers_are_dropped(clock):
+    replica_set_ = replica_set()
+    replica_set_.mark_write("1")
+    clock[0] += 5
+    replica_set_.mark_write("2")
+    replica_set_.mark_write("3")
+    replica_set_.mark_write("2")
+    assert list(replica_set_._writers) == ["1", "3", "2"]
+    clock[0] += 6
+    replica_set_.mark_write("4")
+    assert list(replica_set_._writers) == ["3", "2", "4"]
+
+
+@pytest.mark.parametrize(
+    "value, fresh",
+    [
+        (None, False),
+        ("", False),
+        ("junk", False),
+        ("1.5", False),
+        ("inf", False),
+        ("nan", False),
+        ("1e300", False),
+    ],
+)
+def test_primary_cookie_fresh(value, fresh):
+    assert primary_cookie_fresh(value, 10) is fresh
+
+
+def test_primary_cookie_fresh_within_stick_seconds():
+    assert primary_cookie_fresh(str(time.time() + 9), 10)
+    assert not primary_cookie_fresh(str(time.time() + 60), 10)
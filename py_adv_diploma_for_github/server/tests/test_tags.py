@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import tags
+from counters import TrendCounter
+
+NOW = datetime(2026, 10, 18, 12, 7, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("#Python and #python, #FastAPI", ["python", "fastapi"]),
+        ("#1 #2024 #v2", ["v2"]),
+        ("mail#tag x_#tag ##double #ok", ["ok"]),
+        ("#кофе!", ["кофе"]),
+        ("#" + "a" * 64 + " #" + "b" * 65, ["a" * 64]),
+    ],
+)
+def test_hashtags(text, expected):
+    assert tags.hashtags(text) == expected
+
+
+def test_mentions():
+    assert tags.mentions("@bob, @Alice @bob e@mail @@x") == ["bob", "Alice"]
+
+
+def test_normalize_tag():
+    assert tags.normalize_tag("#PyThon") == "python"
+
+
+def trend_counter() -> TrendCounter:
+    return TrendCounter(None, bucket_seconds=300, window_seconds=3600)
+
+
+def test_bucket_of():
+    counter = trend_counter()
+    assert counter.bucket_of(NOW) == datetime(2026, 10, 18, 12, 5, tzinfo=timezone.utc)
+    assert counter.bucket_of(NOW.replace(minute=5, second=0)) == counter.bucket_of(NOW)
+
+
+def test_window_start_keeps_twelve_buckets():
+    counter = trend_counter()
+    start = counter.window_start(NOW)
+    assert start == datetime(2026, 10, 18, 11, 10, tzinfo=timezone.utc)
+    assert (counter.bucket_of(NOW) - start) / counter.bucket == 11
+
+
+def test_record_counts_uses_inside_the_window():
+    counter = trend_counter()
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(hours=2)
+    counter.record(
+        added=[("a", now), ("b", now), ("c", old), ("d", tags.BACKFILLED_AT)],
+        removed=[("b", now), ("a", old), ("d", tags.BACKFILLED_AT)],
+    )
+    bucket = counter.bucket_of(now)
+    # Uses outside the window are not counted, nor taken back when removed.
+    assert {key: delta for key, delta in counter._pending.items() if delta} == {
+        (bucket, "a"): 1
+    }
+    assert all(key[0] == bucket for key in counter._pending)